@@ -1,23 +1,28 @@
-import pandas as pd
-from openai import OpenAI
 import time
 import os
-from difflib import SequenceMatcher
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backends"))
+from completions import create_completion
+from datasets import get_dataset_registry, frame_version
+from checkpoints import open_checkpoint
+from scoring import is_correct_genre
 
 def openai_response(model, messages, **kwargs):
     """
     Generate a response using OpenAI API.
+    Requests with temperature=0 are served from the completion cache when possible.
    
     Args:
         model (str): The OpenAI model to use (e.g., "gpt-4o-mini")
         messages (list): List of message dictionaries with role and content
-        **kwargs: Additional parameters to pass to the OpenAI API (temperature, max_tokens, etc.)
+        **kwargs: Additional parameters to pass to the OpenAI API (temperature, max_tokens, etc.),
+            plus max_retries/retry_delay for the retry policy
        
     Returns:
         The completion object from OpenAI
     """
-    client = OpenAI()
-    completion = client.chat.completions.create(
+    completion = create_completion(
         model=model,
         messages=messages,
         **kwargs
@@ -27,6 +32,7 @@ def openai_response(model, messages, **kwargs):
 def load_song_data(file_path):
     """
     Load song data from Excel file.
+    The workbook is parsed once and cached in columnar form (see backends/datasets.py).
     
     Args:
         file_path (str): Path to the Excel file
@@ -35,13 +41,8 @@ def load_song_data(file_path):
         DataFrame: Pandas DataFrame containing the song data
     """
     try:
-        df = pd.read_excel(file_path)
-        # Check if required columns exist
-        required_columns = ["Lyrics (4-8 lines, 50-100 words)", "Genre"]
-        for col in required_columns:
-            if col not in df.columns:
-                raise ValueError(f"Required column '{col}' not found in the Excel file")
-        return df
+        # Raises if the file is missing or lacks the required columns
+        return get_dataset_registry().load_path(file_path).frame.copy()
     except Exception as e:
         print(f"Error loading song data: {e}")
         return None
@@ -60,56 +61,23 @@ def get_user_prompt():
     print("Example: 'Analyze these lyrics and provide only the music genre as a one-word answer.'\n")
     return input("Your prompt: ")
 
-def calculate_similarity(a, b):
-    """
-    Calculate string similarity using SequenceMatcher.
-    
-    Args:
-        a (str): First string
-        b (str): Second string
-        
-    Returns:
-        float: Similarity ratio (0.0 to 1.0)
-    """
-    return SequenceMatcher(None, a.lower(), b.lower()).ratio()
-
-def is_correct_genre(expected, predicted, match_method="exact"):
-    """
-    Check if the predicted genre matches the expected genre.
-    
-    Args:
-        expected (str): Expected genre
-        predicted (str): Predicted genre
-        match_method (str): Matching method ('exact', 'contains', or 'fuzzy')
-        
-    Returns:
-        bool: True if correct, False otherwise
-    """
-    expected = expected.lower().strip()
-    predicted = predicted.lower().strip()
-    
-    if match_method == "exact":
-        return expected == predicted
-    elif match_method == "contains":
-        return expected in predicted or predicted in expected
-    elif match_method == "fuzzy":
-        # Consider it a match if similarity is at least 0.8
-        return calculate_similarity(expected, predicted) >= 0.8
-    else:
-        return False
-
-def evaluate_prompt(df, prompt, model="gpt-4o-mini", temperature=0.0, max_retries=3, retry_delay=2, match_method="contains"):
+def evaluate_prompt(df, prompt, model="gpt-4o-mini", temperature=0.0, max_retries=3, retry_delay=2, match_method="contains",
+                    team_name="local"):
     """
     Evaluate a prompt against all songs in the dataset.
+    Each prediction is checkpointed (see backends/checkpoints.py); if a run is
+    interrupted, evaluating the same prompt again resumes after the songs
+    already done instead of calling the API for them.
     
     Args:
         df (DataFrame): DataFrame containing song data
         prompt (str): User prompt to append to lyrics
         model (str): OpenAI model to use
         temperature (float): Temperature setting for OpenAI API
-        max_retries (int): Maximum number of retries for failed API calls
-        retry_delay (int): Delay between retries in seconds
+        max_retries (int): Maximum number of retries for rate-limited or failed API calls
+        retry_delay (int): Base delay in seconds for exponential backoff between retries
         match_method (str): Method to match genres
+        team_name (str): Name the checkpoint is kept under
         
     Returns:
         dict: Results of the evaluation
@@ -118,7 +86,12 @@ def evaluate_prompt(df, prompt, model="gpt-4o-mini", temperature=0.0, max_retrie
     correct_count = 0
     total_count = len(df)
     
+    checkpoint = open_checkpoint(team_name, prompt, frame_version(df), model)
+    completed = checkpoint.completed() if checkpoint is not None else {}
+    
     print(f"\nEvaluating prompt against {total_count} songs...\n")
+    if completed:
+        print(f"Resuming: {len(completed)} songs were already evaluated\n")
     
     for idx, row in df.iterrows():
         lyrics = row["Lyrics (4-8 lines, 50-100 words)"]
@@ -132,58 +105,56 @@ def evaluate_prompt(df, prompt, model="gpt-4o-mini", temperature=0.0, max_retrie
             {"role": "user", "content": combined_text}
         ]
         
-        # Call OpenAI API with retries
-        retries = 0
-        while retries <= max_retries:
-            try:
+        # Call OpenAI API; rate limiting and retries with backoff happen in completions.py
+        try:
+            if idx in completed:
+                predicted_genre = completed[idx]
+            else:
                 completion = openai_response(
                     model=model,
                     messages=messages,
-                    temperature=temperature
+                    temperature=temperature,
+                    max_retries=max_retries,
+                    retry_delay=retry_delay
                 )
                 
                 # Extract the predicted genre
                 predicted_genre = completion.choices[0].message.content.strip()
+                if checkpoint is not None:
+                    checkpoint.record([(idx, predicted_genre)])
+            
+            # Check if prediction is correct
+            is_correct = is_correct_genre(expected_genre, predicted_genre, match_method)
+            if is_correct:
+                correct_count += 1
                 
-                # Check if prediction is correct
-                is_correct = is_correct_genre(expected_genre, predicted_genre, match_method)
-                if is_correct:
-                    correct_count += 1
-                    
-                # Store result
-                results.append({
-                    "Lyrics": lyrics,
-                    "Expected Genre": expected_genre,
-                    "Predicted Genre": predicted_genre,
-                    "Correct": is_correct
-                })
-                
-                # Print progress
-                print(f"Song {idx+1}/{total_count}: {'✓' if is_correct else '✗'} Expected: {expected_genre}, Predicted: {predicted_genre}")
-                
-                # Success, so break the retry loop
-                break
-                
-            except Exception as e:
-                retries += 1
-                if retries <= max_retries:
-                    print(f"Error processing song {idx+1}, retrying ({retries}/{max_retries}): {e}")
-                    time.sleep(retry_delay)
-                else:
-                    print(f"Error processing song {idx+1} after {max_retries} retries: {e}")
-                    results.append({
-                        "Lyrics": lyrics,
-                        "Expected Genre": expected_genre,
-                        "Predicted Genre": "ERROR",
-                        "Correct": False
-                    })
-        
-        # Add a small delay to avoid rate limiting
-        time.sleep(1)
+            # Store result
+            results.append({
+                "Lyrics": lyrics,
+                "Expected Genre": expected_genre,
+                "Predicted Genre": predicted_genre,
+                "Correct": is_correct
+            })
+            
+            # Print progress
+            print(f"Song {idx+1}/{total_count}: {'✓' if is_correct else '✗'} Expected: {expected_genre}, Predicted: {predicted_genre}")
+            
+        except Exception as e:
+            print(f"Error processing song {idx+1} after {max_retries} retries: {e}")
+            results.append({
+                "Lyrics": lyrics,
+                "Expected Genre": expected_genre,
+                "Predicted Genre": "ERROR",
+                "Correct": False
+            })
     
     # Calculate score
     score = (correct_count / total_count) * 100 if total_count > 0 else 0
     
+    # Nothing is left to resume unless some songs failed
+    if checkpoint is not None and all(result["Predicted Genre"] != "ERROR" for result in results):
+        checkpoint.clear()
+    
     return {
         "results": results,
         "score": score,
@@ -0,0 +1,99 @@
+import os
+import re
+import asyncio
+import pandas as pd
+
+from async_chat import asy_chat_in
+from leaderboard_store import get_leaderboard_store
+from evaluation_archive import get_evaluation_archive, ANALYSIS
+from rate_limiter import estimate_tokens
+from usage import usage_scope, asy_reserve_quota, QuotaExceededError
+
+DEFAULT_CRITERIA = "Evaluate the Excel file for data quality, insights, and presentation."
+
+async def asy_analyze_file(team_name, file_path, evaluation_criteria=DEFAULT_CRITERIA):
+    """
+    Have the model score a team's Excel/CSV submission and record the score on the leaderboard.
+
+    Returns:
+        tuple: (result dict, HTTP status code)
+    """
+    try:
+        # Check if file exists and is Excel
+        if not os.path.exists(file_path) or not file_path.endswith(('.xlsx', '.xls', '.csv')):
+            return {"error": "File not found or not a valid Excel/CSV file", "status": "error"}, 404
+        
+        # Read the Excel file (on a worker thread, so the event loop keeps serving other requests)
+        if file_path.endswith('.csv'):
+            df = await asyncio.to_thread(pd.read_csv, file_path)
+        else:
+            df = await asyncio.to_thread(pd.read_excel, file_path)
+        
+        # Get basic stats about the data
+        data_stats = {
+            'columns': list(df.columns),
+            'rows': len(df),
+            'missing_values': df.isna().sum().to_dict(),
+            'sample': df.head(5).to_dict('records')
+        }
+        
+        # Create a prompt for the AI to evaluate the file
+        system_prompt = f"""You are an expert data scientist evaluating submissions for a hackathon.
+        Evaluate the following Excel data based on these criteria:
+        {evaluation_criteria}
+        
+        Provide:
+        1. A score from 0-100
+        2. Detailed feedback on strengths and weaknesses
+        3. Suggestions for improvement
+        """
+        
+        # Format the data stats as text for the AI
+        data_description = f"""
+        Dataset Summary:
+        - File: {os.path.basename(file_path)}
+        - Columns: {', '.join(data_stats['columns'])}
+        - Rows: {data_stats['rows']}
+        - Sample data: {str(data_stats['sample'])}
+        """
+        
+        # Make the OpenAI request, billed to the team and admitted only within its token quota
+        estimated = estimate_tokens([{"content": system_prompt}, {"content": data_description}])
+        try:
+            with usage_scope(endpoint="/api/analyze", team=team_name), \
+                    await asy_reserve_quota(team_name, estimated):
+                response = await asy_chat_in(
+                    input_text=data_description,
+                    system_prompt=system_prompt,
+                    model="gpt-4o"  # Using a more capable model for evaluation
+                )
+        except QuotaExceededError as e:
+            return {"error": str(e), "status": "error", "quota": e.details}, 429
+        
+        # Extract score from the response (assuming the AI includes it in the format "Score: XX/100")
+        score_match = re.search(r"score:?\s*(\d+)", response.lower())
+        score = int(score_match.group(1)) if score_match else 70  # Default if not found
+        
+        # Update the team's score in the leaderboard
+        await asyncio.to_thread(get_leaderboard_store().upsert_score, team_name, score)
+        
+        # Save the evaluation for reference
+        evaluation_id = await asyncio.to_thread(
+            get_evaluation_archive().record, team_name, "complete", kind=ANALYSIS, score=score, model="gpt-4o",
+            details={"file": file_path, "criteria": evaluation_criteria, "feedback": response}
+        )
+        
+        # Return the results
+        return {
+            "team": team_name,
+            "score": score,
+            "feedback": response,
+            "evaluation_id": evaluation_id,
+            "status": "success"
+        }, 200
+        
+    except Exception as e:
+        print(f"Analysis error: {e}")
+        import traceback
+        traceback.print_exc()
+        return {"error": str(e), "status": "error"}, 500
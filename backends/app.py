@@ -1,18 +1,29 @@
-import openai
-import os
-import pymongo
+import json
 import flask
 from flask_cors import CORS
 from datetime import datetime
-from flask import request, jsonify
-import pandas as pd
-import re
+from flask import request, jsonify, g
+import io
+import functools
 
-from chat import chat_in
+from chat import chat_in, chat_stream
 from database import write_to_db
 
-from async_chat import asy_chat_in
+from async_chat import asy_chat_in, asy_chat_stream
 from async_database import asy_write_to_db
+from clients import run_coroutine, iterate_async
+from completions import get_cache_stats
+from interaction_log import get_interaction_log
+import metrics
+from conversations import get_conversation_store
+from interactions import (ensure_indexes_in_background, find_interactions, interaction_counts, chatbot_summary,
+                          parse_date, InteractionQueryError)
+from leaderboard_store import get_leaderboard_store
+from events import broker, format_sse
+from jobs import get_job_queue, QueueFullError
+import usage
+from evaluation_archive import get_evaluation_archive, ArchiveQueryError
+from analyze_submission import asy_analyze_file, DEFAULT_CRITERIA
 
 from dotenv import load_dotenv
 load_dotenv()  # This loads the variables from .env
@@ -21,6 +32,116 @@ app = flask.Flask(__name__)
 CORS(app)  # Enable CORS for all routes
 
 
+def async_to_sync(func):
+    """Run async views on the shared client loop instead of a new loop per request,
+    so the pooled async OpenAI/Mongo clients are reused across requests."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        return run_coroutine(func(*args, **kwargs))
+    return wrapper
+
+
+app.async_to_sync = async_to_sync
+
+# Push every committed score to the leaderboard event stream
+get_leaderboard_store().add_listener(lambda delta: broker.publish('leaderboard', 'leaderboard', delta))
+
+
+def sse_response(stream):
+    return flask.Response(flask.stream_with_context(stream), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'  # disable proxy buffering (nginx)
+    })
+
+
+@app.before_request
+def start_job_workers():
+    # Started on first request rather than at import, so the debug reloader's parent runs no workers
+    get_job_queue().start()
+
+
+@app.before_request
+def ensure_mongo_indexes():
+    # the interaction query indexes and the conversation TTL index, once per process and off the request path;
+    # started here rather than at import, so importing app opens no Mongo client
+    ensure_indexes_in_background()
+    store = get_conversation_store()
+    if store is not None:
+        store.ensure_index_in_background()
+
+
+@app.before_request
+def start_request_timer():
+    # Request count, latency and in-flight gauge per route template; slow or failed requests are logged as JSON
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    g.request_timer = metrics.RequestTimer(request.method, route, request.path)
+    # model calls made for this request are billed to its route (see usage.py)
+    g.usage_scope = usage.enter_scope(endpoint=route)
+
+
+@app.after_request
+def finish_request_timer(response):
+    timer = g.get('request_timer')
+    if timer:
+        timer.finish(response.status_code)
+    return response
+
+
+@app.teardown_request
+def finish_failed_request_timer(error):
+    # after_request is skipped when a view raises
+    timer = g.get('request_timer')
+    if timer:
+        timer.finish(500, error=str(error) if error else None)
+    scope = g.pop('usage_scope', None)
+    if scope:
+        usage.exit_scope(scope)
+
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    return flask.Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+
+def queue_job(kind, team_name, payload):
+    """Queue a background job; return (body, status): 202 with its id and polling URLs, or 429."""
+    try:
+        # a team with no token quota left today cannot queue more work
+        usage.check_quota(team_name)
+        job = get_job_queue().submit(kind, team_name, payload)
+    except QueueFullError as e:
+        return {"error": str(e)}, 429
+    except usage.QuotaExceededError as e:
+        return {"error": str(e), "quota": e.details}, 429
+    job_id = job['job_id']
+    job.update({
+        "status_url": f"/api/jobs/{job_id}",
+        "result_url": f"/api/jobs/{job_id}/result"
+    })
+    if kind == 'evaluate-songs':
+        job["stream_url"] = f"/api/evaluate-songs/{job_id}/stream"
+    return job, 202
+
+
+def submit_job(kind, team_name, payload):
+    """Queue a background job and answer 202 with its id and polling URLs."""
+    body, status = queue_job(kind, team_name, payload)
+    return jsonify(body), status
+
+
+def last_event_id():
+    value = request.headers.get('Last-Event-ID')
+    return int(value) if value and value.isdigit() else None
+
+
+def conversation_store_for(data):
+    """Return the conversation store when the request continues a conversation ("history": false opts out)."""
+    store = get_conversation_store()
+    if store is None or not data.get('interaction_id') or data.get('history', True) is False:
+        return None
+    return store
+
+
 @app.route('/chat', methods=['POST'])
 def handle_chat():
     if not request.is_json:
@@ -40,10 +161,15 @@ def handle_chat():
     chatbot_name = data.get('chatbot_name')  # Optional
 
     try:
+        # Earlier turns of this interaction_id are sent ahead of the new message
+        store = conversation_store_for(data)
         response = chat_in(
             input_text=input_text,
             system_prompt=system_prompt,
-            model=model)
+            model=model,
+            history=store.history(interaction_id) if store else None)
+        if store and response is not None:
+            store.record(interaction_id, input_text, response)
 
         interaction_date = datetime.now()
         write_to_db(texts=[input_text, response],
@@ -58,6 +184,73 @@ def handle_chat():
         return jsonify({"error": str(e)}), 500
 
 
+def chat_stream_arguments(data):
+    """Validate a POST /chat/stream body (shared with /async_chat/stream); return (arguments, error message)."""
+    if 'input_text' not in data:
+        return None, "input_text is required"
+    return {
+        "input_text": data['input_text'],
+        "system_prompt": data.get('system_prompt'),
+        "model": data.get('model', 'gpt-4o-mini'),
+        "interaction_id": data.get('interaction_id'),
+        "chatbot_name": data.get('chatbot_name'),
+        "conversation_store": conversation_store_for(data)
+    }, None
+
+
+def chat_events(deltas, arguments):
+    """
+    Relay a streamed reply as Server-Sent Events, then log the whole exchange.
+
+    Events: "delta" {"text"} per piece of the reply, then "done" {"response", "status"}
+    with the full text, or "error" {"error", "status"} if the model call fails.
+    """
+    parts = []
+    try:
+        for text in deltas:
+            parts.append(text)
+            yield format_sse('delta', json.dumps({"text": text}))
+    except Exception as e:
+        print(f"Error in chat stream: {e}")
+        yield format_sse('error', json.dumps({"error": str(e), "status": "error"}))
+        return
+
+    response = "".join(parts)
+    if arguments['conversation_store']:
+        arguments['conversation_store'].record(arguments['interaction_id'], arguments['input_text'], response)
+    write_to_db(texts=[arguments['input_text'], response],
+                interaction_id=arguments['interaction_id'],
+                chatbot_name=arguments['chatbot_name'],
+                interaction_date=datetime.now())
+    yield format_sse('done', json.dumps({"response": response, "status": "success"}))
+
+
+def start_chat_stream(stream):
+    # stream: chat_stream or asy_chat_stream bridged with iterate_async
+    if not request.is_json:
+        return jsonify({"error": "Content-Type must be application/json"}), 415
+    arguments, error = chat_stream_arguments(request.get_json())
+    if error:
+        return jsonify({"error": error}), 400
+    store = arguments['conversation_store']
+    deltas = stream(arguments['input_text'], system_prompt=arguments['system_prompt'], model=arguments['model'],
+                    history=store.history(arguments['interaction_id']) if store else None)
+    # the body is streamed after this view returns; keep billing it to the route
+    return sse_response(usage.bind_scope(chat_events(deltas, arguments)))
+
+
+@app.route('/chat/stream', methods=['POST'])
+def handle_chat_stream():
+    # /chat with the reply relayed as it is generated (see chat_events for the events)
+    return start_chat_stream(chat_stream)
+
+
+@app.route('/async_chat/stream', methods=['POST'])
+def async_handle_chat_stream():
+    # The async client drives the stream on the shared loop; this thread relays each piece
+    return start_chat_stream(lambda *args, **kwargs: iterate_async(asy_chat_stream(*args, **kwargs)))
+
+
 @app.route('/async_chat', methods=['POST'])
 async def async_handle_chat():
     print("Async chat received")
@@ -78,10 +271,15 @@ async def async_handle_chat():
     chatbot_name = data.get('chatbot_name')  # Optional
 
     try:
+        # Earlier turns of this interaction_id are sent ahead of the new message
+        store = conversation_store_for(data)
         response = await asy_chat_in(
             input_text=input_text,
             system_prompt=system_prompt,
-            model=model)
+            model=model,
+            history=await store.asy_history(interaction_id) if store else None)
+        if store and response is not None:
+            store.record(interaction_id, input_text, response)
 
         interaction_date = datetime.now()
         await asy_write_to_db(texts=[input_text, response],
@@ -99,34 +297,60 @@ async def async_handle_chat():
 @app.route('/api/leaderboard', methods=['GET'])
 def get_leaderboard():
     try:
-        # Path to your Excel file
-        excel_path = os.path.join(os.path.dirname(__file__), 'data', 'leaderboard.xlsx')
-        
-        # Check if file exists
-        if not os.path.exists(excel_path):
-            # Return sample data if file doesn't exist
-            leaderboard_data = [
-                {"name": "Team 1", "score": 100},
-                {"name": "Team 2", "score": 90},
-                {"name": "Team 3", "score": 80}
-            ]
-            return jsonify(leaderboard_data)
-        
-        # Read Excel file
-        df = pd.read_excel(excel_path)
-        
-        # Sort by score descending
-        df = df.sort_values(by='score', ascending=False)
-        
-        # Convert to list of dictionaries (JSON format)
-        leaderboard_data = df.to_dict('records')
-        
-        return jsonify(leaderboard_data)
+        store = get_leaderboard_store()
+        since = request.args.get('since', type=int)
+
+        if since is not None:
+            # Incremental mode: only rows written after version `since`
+            snapshot, changed, full = store.get_changes(since)
+            if not changed and not full:
+                response = flask.Response(status=304)
+            else:
+                response = jsonify({"version": snapshot.version, "full": full, "changed": changed})
+        else:
+            # Sorted by score descending, serialized once per leaderboard version
+            snapshot = store.get_snapshot()
+            if request.if_none_match.contains(snapshot.etag):
+                response = flask.Response(status=304)
+            else:
+                response = flask.Response(snapshot.body, mimetype='application/json')
+
+        response.set_etag(snapshot.etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        response.headers['X-Leaderboard-Version'] = str(snapshot.version)
+        return response
     except Exception as e:
         print(f"Leaderboard error: {e}")
         return jsonify({"error": str(e)}), 500
 
 
+@app.route('/api/leaderboard/stream', methods=['GET'])
+def stream_leaderboard():
+    # Full leaderboard first, then a "leaderboard" delta event for every score committed
+    def initial():
+        snapshot = get_leaderboard_store().get_snapshot()
+        return 'snapshot', {"version": snapshot.version, "full": True, "changed": snapshot.rows}
+
+    return sse_response(broker.sse_stream('leaderboard', last_event_id(), replay=False, initial=initial))
+
+
+@app.route('/api/leaderboard/export', methods=['GET'])
+def export_leaderboard():
+    try:
+        buffer = io.BytesIO()
+        get_leaderboard_store().export_xlsx(buffer)
+        buffer.seek(0)
+        return flask.send_file(
+            buffer,
+            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+            as_attachment=True,
+            download_name='leaderboard.xlsx'
+        )
+    except Exception as e:
+        print(f"Leaderboard export error: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
 @app.route('/api/score', methods=['POST'])
 def update_score():
     if not request.is_json:
@@ -142,43 +366,9 @@ def update_score():
     new_score = data['score']
     
     try:
-        # Path to your Excel file
-        data_dir = os.path.join(os.path.dirname(__file__), 'data')
-        excel_path = os.path.join(data_dir, 'leaderboard.xlsx')
-        
-        # Create data directory if it doesn't exist
-        if not os.path.exists(data_dir):
-            os.makedirs(data_dir)
-        
-        # Check if file exists, create it if it doesn't
-        if not os.path.exists(excel_path):
-            # Create a new DataFrame
-            df = pd.DataFrame(columns=['name', 'score', 'last_updated'])
-        else:
-            # Read existing data
-            df = pd.read_excel(excel_path)
-        
-        # Check if team already exists
-        if team_name in df['name'].values:
-            # Update existing team's score
-            df.loc[df['name'] == team_name, 'score'] = new_score
-            df.loc[df['name'] == team_name, 'last_updated'] = datetime.now().isoformat()
-            message = "Score updated successfully"
-        else:
-            # Add new team
-            new_row = pd.DataFrame({
-                'name': [team_name],
-                'score': [new_score],
-                'last_updated': [datetime.now().isoformat()]
-            })
-            df = pd.concat([df, new_row], ignore_index=True)
-            message = "Team added successfully"
-        
-        # Sort by score descending
-        df = df.sort_values(by='score', ascending=False)
-        
-        # Save back to Excel
-        df.to_excel(excel_path, index=False)
+        # Atomic per-team upsert
+        added = get_leaderboard_store().upsert_score(team_name, new_score)
+        message = "Team added successfully" if added else "Score updated successfully"
         
         return jsonify({
             "status": "success",
@@ -203,118 +393,171 @@ async def analyze_submission():
     
     team_name = data['team_name']
     file_path = data['file_path']
-    evaluation_criteria = data.get('criteria', "Evaluate the Excel file for data quality, insights, and presentation.")
+    evaluation_criteria = data.get('criteria', DEFAULT_CRITERIA)
+
+    if data.get('background'):
+        return submit_job('analyze', team_name, {
+            "team_name": team_name, "file_path": file_path, "criteria": evaluation_criteria
+        })
     
+    result, status_code = await asy_analyze_file(team_name, file_path, evaluation_criteria)
+    if status_code != 200:
+        result.pop("status", None)
+    return jsonify(result), status_code
+
+
+@app.route('/api/cache/stats', methods=['GET'])
+def cache_stats():
+    return jsonify(get_cache_stats())
+
+
+@app.route('/api/interaction-log/stats', methods=['GET'])
+def interaction_log_stats():
+    return jsonify(get_interaction_log().get_stats())
+
+
+@app.route('/api/usage', methods=['GET'])
+def usage_report():
+    # Tokens, calls and cost, grouped by ?group_by= (default team,model) and filtered by
+    # ?team=, ?submission_id=, ?endpoint=, ?since= and ?until= (ISO dates, to the hour)
+    store = usage.get_usage_store()
+    if store is None:
+        return jsonify({"enabled": False})
     try:
-        # Check if file exists and is Excel
-        if not os.path.exists(file_path) or not file_path.endswith(('.xlsx', '.xls', '.csv')):
-            return jsonify({"error": "File not found or not a valid Excel/CSV file"}), 404
-        
-        # Read the Excel file
-        if file_path.endswith('.csv'):
-            df = pd.read_csv(file_path)
-        else:
-            df = pd.read_excel(file_path)
-        
-        # Get basic stats about the data
-        data_stats = {
-            'columns': list(df.columns),
-            'rows': len(df),
-            'missing_values': df.isna().sum().to_dict(),
-            'sample': df.head(5).to_dict('records')
-        }
-        
-        # Create a prompt for the AI to evaluate the file
-        system_prompt = f"""You are an expert data scientist evaluating submissions for a hackathon.
-        Evaluate the following Excel data based on these criteria:
-        {evaluation_criteria}
-        
-        Provide:
-        1. A score from 0-100
-        2. Detailed feedback on strengths and weaknesses
-        3. Suggestions for improvement
-        """
-        
-        # Format the data stats as text for the AI
-        data_description = f"""
-        Dataset Summary:
-        - File: {os.path.basename(file_path)}
-        - Columns: {', '.join(data_stats['columns'])}
-        - Rows: {data_stats['rows']}
-        - Sample data: {str(data_stats['sample'])}
-        """
-        
-        # Make the OpenAI request
-        response = await asy_chat_in(
-            input_text=data_description,
-            system_prompt=system_prompt,
-            model="gpt-4o"  # Using a more capable model for evaluation
-        )
-        
-        # Extract score from the response (assuming the AI includes it in the format "Score: XX/100")
-        score_match = re.search(r"score:?\s*(\d+)", response.lower())
-        score = int(score_match.group(1)) if score_match else 70  # Default if not found
-        
-        # Update the team's score in the leaderboard
-        data_dir = os.path.join(os.path.dirname(__file__), 'data')
-        excel_path = os.path.join(data_dir, 'leaderboard.xlsx')
-        
-        # Create data directory if it doesn't exist
-        if not os.path.exists(data_dir):
-            os.makedirs(data_dir)
-        
-        # Read or create leaderboard file
-        if not os.path.exists(excel_path):
-            # Create a new DataFrame
-            leaderboard_df = pd.DataFrame(columns=['name', 'score', 'last_updated'])
-        else:
-            # Read existing data
-            leaderboard_df = pd.read_excel(excel_path)
-        
-        # Update or add team
-        if team_name in leaderboard_df['name'].values:
-            leaderboard_df.loc[leaderboard_df['name'] == team_name, 'score'] = score
-            leaderboard_df.loc[leaderboard_df['name'] == team_name, 'last_updated'] = datetime.now().isoformat()
-        else:
-            new_row = pd.DataFrame({
-                'name': [team_name],
-                'score': [score],
-                'last_updated': [datetime.now().isoformat()]
-            })
-            leaderboard_df = pd.concat([leaderboard_df, new_row], ignore_index=True)
-        
-        # Sort and save
-        leaderboard_df = leaderboard_df.sort_values(by='score', ascending=False)
-        leaderboard_df.to_excel(excel_path, index=False)
-        
-        # Save the evaluation for reference
-        evaluations_dir = os.path.join(data_dir, 'evaluations')
-        if not os.path.exists(evaluations_dir):
-            os.makedirs(evaluations_dir)
-        
-        eval_file = os.path.join(evaluations_dir, f"{team_name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt")
-        with open(eval_file, 'w') as f:
-            f.write(f"Team: {team_name}\n")
-            f.write(f"Score: {score}\n")
-            f.write(f"File: {file_path}\n")
-            f.write(f"Evaluation:\n{response}\n")
-        
-        # Return the results
-        return jsonify({
-            "team": team_name,
-            "score": score,
-            "feedback": response,
-            "status": "success"
-        }), 200
-        
+        group_by = [group.strip() for group in request.args.get('group_by', 'team,model').split(',') if group.strip()]
+        report = store.report(group_by=group_by, team=request.args.get('team'),
+                              submission_id=request.args.get('submission_id'),
+                              endpoint=request.args.get('endpoint'),
+                              since=usage.parse_date(request.args.get('since'), 'since'),
+                              until=usage.parse_date(request.args.get('until'), 'until'))
+        return jsonify({"enabled": True, "group_by": group_by, "usage": report})
+    except usage.UsageQueryError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        print(f"Usage report error: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/api/usage/quota/<team_name>', methods=['GET'])
+def usage_quota(team_name):
+    # Today's quota, tokens used and reserved by running work, and when the quota resets
+    store = usage.get_usage_store()
+    if store is None:
+        return jsonify({"enabled": False})
+    return jsonify({"enabled": True, **store.quota_status(team_name)})
+
+
+def interaction_filters():
+    """Read the filters shared by the /api/interactions endpoints from the query string."""
+    return {
+        "chatbot_name": request.args.get('chatbot_name'),
+        "since": parse_date(request.args.get('since'), 'since'),
+        "until": parse_date(request.args.get('until'), 'until')
+    }
+
+
+@app.route('/api/interactions', methods=['GET'])
+def list_interactions():
+    # Newest first; pass next_cursor back as ?cursor= for the following page
+    try:
+        limit = request.args.get('limit', type=int)
+        if limit is not None and limit < 1:
+            return jsonify({"error": "limit must be a positive integer"}), 400
+        page = find_interactions(interaction_id=request.args.get('interaction_id'), limit=limit,
+                                 cursor=request.args.get('cursor'), **interaction_filters())
+        return jsonify(page)
+    except InteractionQueryError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        print(f"Interaction query error: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/api/interactions/counts', methods=['GET'])
+def count_interactions():
+    # Interactions and distinct conversations per chatbot per hour (or ?bucket=day / month)
+    try:
+        counts = interaction_counts(bucket=request.args.get('bucket', 'hour'), **interaction_filters())
+        return jsonify({"counts": counts})
+    except InteractionQueryError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
-        print(f"Analysis error: {e}")
-        import traceback
-        traceback.print_exc()
+        print(f"Interaction query error: {e}")
         return jsonify({"error": str(e)}), 500
 
 
-from evaluate_submission import evaluate_song_file
+@app.route('/api/interactions/chatbots', methods=['GET'])
+def summarize_chatbots():
+    try:
+        filters = interaction_filters()
+        return jsonify({"chatbots": chatbot_summary(since=filters['since'], until=filters['until'])})
+    except InteractionQueryError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        print(f"Interaction query error: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
+from evaluate_submission import evaluate_song_file, LAYOUTS
+from datasets import get_dataset_registry, DatasetError
+
+# Parse the song datasets at startup rather than on the first submission
+get_dataset_registry().preload()
+
+def evaluate_songs_arguments(data):
+    """
+    Validate a POST /api/evaluate-songs body (shared with asgi.py).
+
+    Returns:
+        tuple: (evaluate_song_file keyword arguments, None), or (None, error message) for a 400
+    """
+    # Check for required fields
+    if 'team_name' not in data or ('file_path' not in data and 'dataset' not in data):
+        return None, "team_name and file_path (or dataset) are required"
+    
+    # "batch" packs several songs into each model request
+    mode = data.get('mode', 'single')
+    if mode not in ('single', 'batch'):
+        return None, "mode must be 'single' or 'batch'"
+    batch_size = data.get('batch_size')
+    if batch_size is not None and (not isinstance(batch_size, int) or batch_size < 1):
+        return None, "batch_size must be a positive integer"
+    # Where the team's prompt goes in each song's request; None uses EVALUATION_LAYOUT
+    layout = data.get('layout')
+    if layout is not None and layout not in LAYOUTS:
+        return None, f"layout must be one of {', '.join(LAYOUTS)}"
+
+    return {
+        "team_name": data['team_name'],
+        "file_path": data.get('file_path'),
+        # Name of a registered dataset; takes precedence over file_path
+        "dataset": data.get('dataset'),
+        "prompt": data.get('prompt', ""),
+        # Optional client-chosen id; progress is streamed at /api/evaluate-songs/<submission_id>/stream
+        "submission_id": data.get('submission_id'),
+        "mode": mode,
+        "batch_size": batch_size,
+        # Score a stratified sample first and stop there with a quick estimate if it is conclusive
+        "progressive": bool(data.get('progressive', False)),
+        "layout": layout
+    }, None
+
+
+def queue_evaluate_songs(arguments):
+    """Queue an evaluation as a background job; progress is streamed under the job id."""
+    payload = {key: value for key, value in arguments.items() if key != 'submission_id'}
+    return queue_job('evaluate-songs', arguments['team_name'], payload)
+
+
+def evaluate_songs_result(result, submission_id=None):
+    """Return (body, status) for a finished evaluate_song_file call."""
+    if result.get("status") == "error":
+        # 429 when the team's token quota did not cover the submission
+        return result, 429 if "quota" in result else 500
+    if submission_id:
+        result["submission_id"] = submission_id
+    return result, 200
+
 
 @app.route('/api/evaluate-songs', methods=['POST'])
 def evaluate_songs():
@@ -322,23 +565,114 @@ def evaluate_songs():
         return jsonify({"error": "Content-Type must be application/json"}), 415
 
     data = request.get_json()
-    
-    # Check for required fields
-    if 'team_name' not in data or 'file_path' not in data:
-        return jsonify({"error": "team_name and file_path are required"}), 400
-    
-    team_name = data['team_name']
-    file_path = data['file_path']
-    evaluation_prompt = data.get('prompt', "")
+    arguments, error = evaluate_songs_arguments(data)
+    if error:
+        return jsonify({"error": error}), 400
+
+    if data.get('background'):
+        body, status = queue_evaluate_songs(arguments)
+        return jsonify(body), status
     
     # Call the evaluation function
-    result = evaluate_song_file(file_path, team_name, evaluation_prompt)
-    
-    if result.get("status") == "error":
-        return jsonify(result), 500
-    
-    return jsonify(result), 200
+    result = evaluate_song_file(**arguments)
+    body, status = evaluate_songs_result(result, arguments['submission_id'])
+    return jsonify(body), status
+
+
+@app.route('/api/datasets', methods=['GET'])
+def list_datasets():
+    registry = get_dataset_registry()
+    datasets = []
+    for name in registry.names():
+        try:
+            dataset = registry.get(name)
+            datasets.append({"name": name, "songs": len(dataset.frame), "version": dataset.version})
+        except DatasetError as e:
+            datasets.append({"name": name, "error": str(e)})
+    return jsonify(datasets)
+
+
+@app.route('/api/evaluations/team/<team_name>', methods=['GET'])
+def evaluation_history(team_name):
+    # A team's evaluations and analyses, newest first; filter with ?kind=songs|analysis and ?prompt_hash=,
+    # and pass next_cursor back as ?cursor= for the following page
+    try:
+        page = get_evaluation_archive().history(team_name, kind=request.args.get('kind'),
+                                                prompt_hash=request.args.get('prompt_hash'),
+                                                limit=request.args.get('limit', type=int),
+                                                cursor=request.args.get('cursor'))
+        return jsonify(page)
+    except ArchiveQueryError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        print(f"Evaluation history error: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/api/evaluations/<int:evaluation_id>', methods=['GET'])
+def get_evaluation(evaluation_id):
+    # One archived submission with its songs in dataset order; ?songs=0 leaves them out
+    evaluation = get_evaluation_archive().submission(evaluation_id, songs=request.args.get('songs') != '0')
+    if evaluation is None:
+        return jsonify({"error": "Evaluation not found"}), 404
+    return jsonify(evaluation)
+
+
+@app.route('/api/evaluations/<int:first_id>/diff/<int:second_id>', methods=['GET'])
+def diff_evaluations(first_id, second_id):
+    # Songs whose prediction or result changed from the first submission to the second
+    diff = get_evaluation_archive().diff(first_id, second_id)
+    if diff is None:
+        return jsonify({"error": "Evaluation not found"}), 404
+    return jsonify(diff)
+
+
+@app.route('/api/evaluate-songs/<submission_id>/stream', methods=['GET'])
+def stream_submission(submission_id):
+    # "song" per prediction, then "done" (or "failed") and the stream ends
+    return sse_response(broker.sse_stream(f"submission:{submission_id}", last_event_id()))
+
+
+def run_evaluate_songs_job(job_id, payload):
+    return evaluate_song_file(payload['file_path'], payload['team_name'], payload['prompt'], submission_id=job_id,
+                              mode=payload.get('mode', 'single'), batch_size=payload.get('batch_size'),
+                              dataset=payload.get('dataset'), progressive=payload.get('progressive', False),
+                              layout=payload.get('layout'))
+
+
+def run_analyze_job(job_id, payload):
+    result, _ = run_coroutine(asy_analyze_file(payload['team_name'], payload['file_path'], payload['criteria']))
+    return result
+
+
+get_job_queue().register('evaluate-songs', run_evaluate_songs_job)
+get_job_queue().register('analyze', run_analyze_job)
+
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = get_job_queue().get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job), 200
+
+
+@app.route('/api/jobs/<job_id>/result', methods=['GET'])
+def get_job_result(job_id):
+    job = get_job_queue().get(job_id, include_result=True)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    if job['status'] in ('queued', 'running'):
+        # Not finished yet; poll the status URL
+        return jsonify(job), 202
+    if job['status'] == 'failed':
+        return jsonify(job['result'] or {"error": job['error'], "status": "error"}), 500
+    return jsonify(job['result']), 200
 
 
 if __name__ == '__main__':
+    import sys
+    import signal
+    # exit normally on SIGTERM so atexit hooks run (queued chat interactions are written to Mongo)
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
     app.run(debug=True)
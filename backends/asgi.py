@@ -0,0 +1,282 @@
+"""
+ASGI entry point: the chat and evaluation endpoints as native async views, everything else from app.py.
+
+Under Flask, an `async def` view still occupies a worker thread while it
+waits: the thread blocks until the coroutine finishes on the shared client
+loop. Here the views below are awaited on the server's own event loop, so a
+request waiting on the model or on Mongo holds no thread and one process can
+keep hundreds of them in flight:
+
+    POST /async_chat
+    POST /async_chat/stream
+    POST /api/analyze
+    POST /api/evaluate-songs
+    GET  /api/evaluate-songs/<submission_id>/stream
+    GET  /api/leaderboard/stream
+
+Request and response bodies are the same as app.py's (JSON is encoded by
+Flask's encoder). Every other route is served by the Flask app itself,
+mounted through a2wsgi on a thread pool of ASGI_THREADS threads.
+
+Run (one worker per host; see README "ASGI server" for sizing):
+    uvicorn asgi:app --host 0.0.0.0 --port 5000 --workers 1 --limit-concurrency 2000
+
+Server-Sent Events and submission progress are published in-process, so a
+stream must be served by the worker that runs the evaluation: use more than
+one worker only behind sticky sessions, or for chat traffic alone.
+
+Settings (environment variables):
+    ASGI_THREADS    threads for the Flask routes and other blocking calls (default 40)
+    HOST, PORT      bind address when run as `python asgi.py` (default 127.0.0.1:5000)
+    WEB_CONCURRENCY uvicorn worker processes when run as `python asgi.py` (default 1)
+"""
+import os
+import json
+import asyncio
+import contextlib
+import concurrent.futures
+from datetime import datetime
+
+import anyio.to_thread
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Mount, Route
+
+from app import (app as flask_app, queue_job, evaluate_songs_arguments, queue_evaluate_songs,
+                 evaluate_songs_result, chat_stream_arguments, conversation_store_for)
+from async_chat import asy_chat_in, asy_chat_stream
+from async_database import asy_write_to_db
+from analyze_submission import asy_analyze_file, DEFAULT_CRITERIA
+from clients import aclose_clients
+from conversations import get_conversation_store
+from evaluate_submission import asy_evaluate_song_file
+from events import broker, format_sse
+from interaction_log import get_interaction_log
+from interactions import ensure_indexes_in_background
+from metrics import RequestTimer
+from usage import usage_scope, asy_bind_scope
+from jobs import get_job_queue
+from leaderboard_store import get_leaderboard_store
+
+DEFAULT_THREADS = 40
+# Seconds to wait for running background jobs at shutdown (they are requeued if cut off)
+JOB_SHUTDOWN_SECONDS = 10
+
+
+def instrumented(endpoint, route):
+    """
+    Record a native route in the same request metrics as the Flask routes (see metrics.RequestTimer),
+    and bill its model calls to the route (see usage.py).
+    """
+    async def handle(request):
+        timer = RequestTimer(request.method, route, request.url.path)
+        try:
+            with usage_scope(endpoint=route):
+                response = await endpoint(request)
+        except Exception as e:
+            timer.finish(500, error=str(e))
+            raise
+        timer.finish(response.status_code)
+        return response
+    return handle
+
+
+def json_response(body, status=200):
+    """Encode like Flask's jsonify, so both servers return byte-identical bodies."""
+    return Response(flask_app.json.response(body).get_data(), status_code=status, media_type="application/json")
+
+
+async def json_body(request):
+    """Return the request's JSON object, or an error response like the Flask views give."""
+    if request.headers.get("content-type", "").split(";")[0].strip() != "application/json":
+        return None, json_response({"error": "Content-Type must be application/json"}, 415)
+    try:
+        data = json.loads(await request.body())
+    except ValueError:
+        return None, json_response({"error": "Request body is not valid JSON"}, 400)
+    if not isinstance(data, dict):
+        return None, json_response({"error": "Request body must be a JSON object"}, 400)
+    return data, None
+
+
+def sse_response(stream):
+    return StreamingResponse(stream, media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"  # disable proxy buffering (nginx)
+    })
+
+
+def last_event_id(request):
+    value = request.headers.get("last-event-id")
+    return int(value) if value and value.isdigit() else None
+
+
+async def async_chat(request):
+    data, error = await json_body(request)
+    if error:
+        return error
+
+    # Check if required field exists
+    if 'input_text' not in data:
+        return json_response({"error": "input_text is required"}, 400)
+
+    input_text = data['input_text']
+    try:
+        # Earlier turns of this interaction_id are sent ahead of the new message
+        store = conversation_store_for(data)
+        response = await asy_chat_in(
+            input_text=input_text,
+            system_prompt=data.get('system_prompt'),
+            model=data.get('model', 'gpt-4o-mini'),
+            history=await store.asy_history(data['interaction_id']) if store else None)
+        if store and response is not None:
+            store.record(data['interaction_id'], input_text, response)
+
+        await asy_write_to_db(texts=[input_text, response],
+                              interaction_id=data.get('interaction_id'),
+                              chatbot_name=data.get('chatbot_name'),
+                              interaction_date=datetime.now())
+
+        return json_response({"response": response, "status": "success"})
+
+    except Exception as e:
+        return json_response({"error": str(e)}, 500)
+
+
+async def chat_events(arguments):
+    # Same events as app.chat_events: "delta" per piece, then "done" with the full reply, or "error"
+    store = arguments['conversation_store']
+    parts = []
+    try:
+        history = await store.asy_history(arguments['interaction_id']) if store else None
+        async for text in asy_chat_stream(arguments['input_text'], system_prompt=arguments['system_prompt'],
+                                          model=arguments['model'], history=history):
+            parts.append(text)
+            yield format_sse('delta', json.dumps({"text": text}))
+    except Exception as e:
+        print(f"Error in chat stream: {e}")
+        yield format_sse('error', json.dumps({"error": str(e), "status": "error"}))
+        return
+
+    response = "".join(parts)
+    if store:
+        store.record(arguments['interaction_id'], arguments['input_text'], response)
+    await asy_write_to_db(texts=[arguments['input_text'], response],
+                          interaction_id=arguments['interaction_id'],
+                          chatbot_name=arguments['chatbot_name'],
+                          interaction_date=datetime.now())
+    yield format_sse('done', json.dumps({"response": response, "status": "success"}))
+
+
+async def async_chat_stream(request):
+    data, error = await json_body(request)
+    if error:
+        return error
+    arguments, error = chat_stream_arguments(data)
+    if error:
+        return json_response({"error": error}, 400)
+    # the body is streamed after this view returns; keep billing it to the route
+    return sse_response(asy_bind_scope(chat_events(arguments)))
+
+
+async def analyze(request):
+    data, error = await json_body(request)
+    if error:
+        return error
+
+    # Check for required fields
+    if 'team_name' not in data or 'file_path' not in data:
+        return json_response({"error": "team_name and file_path are required"}, 400)
+
+    team_name = data['team_name']
+    file_path = data['file_path']
+    evaluation_criteria = data.get('criteria', DEFAULT_CRITERIA)
+
+    if data.get('background'):
+        body, status = await anyio.to_thread.run_sync(queue_job, 'analyze', team_name, {
+            "team_name": team_name, "file_path": file_path, "criteria": evaluation_criteria
+        })
+        return json_response(body, status)
+
+    result, status_code = await asy_analyze_file(team_name, file_path, evaluation_criteria)
+    if status_code != 200:
+        result.pop("status", None)
+    return json_response(result, status_code)
+
+
+async def evaluate_songs(request):
+    data, error = await json_body(request)
+    if error:
+        return error
+    arguments, error = evaluate_songs_arguments(data)
+    if error:
+        return json_response({"error": error}, 400)
+
+    if data.get('background'):
+        body, status = await anyio.to_thread.run_sync(queue_evaluate_songs, arguments)
+        return json_response(body, status)
+
+    result = await asy_evaluate_song_file(**arguments)
+    body, status = evaluate_songs_result(result, arguments['submission_id'])
+    return json_response(body, status)
+
+
+async def stream_submission(request):
+    # "song" per prediction, then "done" (or "failed") and the stream ends
+    topic = f"submission:{request.path_params['submission_id']}"
+    return sse_response(broker.asy_sse_stream(topic, last_event_id(request)))
+
+
+async def stream_leaderboard(request):
+    # Full leaderboard first, then a "leaderboard" delta event for every score committed
+    def initial():
+        snapshot = get_leaderboard_store().get_snapshot()
+        return 'snapshot', {"version": snapshot.version, "full": True, "changed": snapshot.rows}
+
+    return sse_response(broker.asy_sse_stream('leaderboard', last_event_id(request), replay=False, initial=initial))
+
+
+@contextlib.asynccontextmanager
+async def lifespan(_):
+    threads = int(os.getenv("ASGI_THREADS", DEFAULT_THREADS))
+    # bound both thread pools: asyncio.to_thread (evaluations, analysis) and anyio's (Starlette)
+    anyio.to_thread.current_default_thread_limiter().total_tokens = threads
+    executor = concurrent.futures.ThreadPoolExecutor(threads, thread_name_prefix="asgi")
+    asyncio.get_running_loop().set_default_executor(executor)
+    get_job_queue().start()
+    ensure_indexes_in_background()
+    store = get_conversation_store()
+    if store is not None:
+        store.ensure_index_in_background()
+    try:
+        yield
+    finally:
+        await anyio.to_thread.run_sync(get_job_queue().stop, JOB_SHUTDOWN_SECONDS)
+        # write the chat interactions still queued while the Mongo client is open
+        await anyio.to_thread.run_sync(get_interaction_log().close)
+        await aclose_clients()
+
+
+app = Starlette(
+    routes=[
+        Route('/async_chat', instrumented(async_chat, '/async_chat'), methods=['POST']),
+        Route('/async_chat/stream', instrumented(async_chat_stream, '/async_chat/stream'), methods=['POST']),
+        Route('/api/analyze', instrumented(analyze, '/api/analyze'), methods=['POST']),
+        Route('/api/evaluate-songs', instrumented(evaluate_songs, '/api/evaluate-songs'), methods=['POST']),
+        Route('/api/evaluate-songs/{submission_id}/stream', instrumented(stream_submission, '/api/evaluate-songs/{submission_id}/stream'), methods=['GET']),
+        Route('/api/leaderboard/stream', instrumented(stream_leaderboard, '/api/leaderboard/stream'), methods=['GET']),
+        # everything else is served by the Flask app
+        Mount('/', app=WSGIMiddleware(flask_app, workers=int(os.getenv("ASGI_THREADS", DEFAULT_THREADS))))
+    ],
+    middleware=[Middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"])],
+    lifespan=lifespan
+)
+
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run("asgi:app", host=os.getenv("HOST", "127.0.0.1"), port=int(os.getenv("PORT", 5000)),
+                workers=int(os.getenv("WEB_CONCURRENCY", 1)))
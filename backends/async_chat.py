@@ -1,24 +1,22 @@
-import os
-import asyncio
-from aiohttp import ClientSession
-from openai import AsyncOpenAI
+from completions import asy_create_completion, asy_stream_completion
+from metrics import timed
 
-client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-
-async def asy_chat_in(input_text, system_prompt="You are a helpful assistant", model="gpt-4o-mini"):
+@timed("asy_chat_in")
+async def asy_chat_in(input_text, system_prompt="You are a helpful assistant", model="gpt-4o-mini", history=None):
     try:
         # Add chat messages
         messages = []
         if system_prompt:
             messages.append({"role": "system", "content": system_prompt})
+        # earlier turns of the conversation (see conversations.py)
+        messages.extend(history or [])
         messages.append({"role": "user", "content": input_text})
 
         # call api
-        async with ClientSession() as session:
-            response = await client.chat.completions.create(
-                model=model,
-                messages=messages
-            )
+        response = await asy_create_completion(
+            model=model,
+            messages=messages
+        )
 
         # get response text
         response_text = response.choices[0].message.content
@@ -28,3 +26,17 @@ async def asy_chat_in(input_text, system_prompt="You are a helpful assistant", m
     except Exception as e:
         error_msg = f"Error in asy_chat_in: {str(e)}"
         print(error_msg)
+
+
+async def asy_chat_stream(input_text, system_prompt="You are a helpful assistant", model="gpt-4o-mini", history=None):
+    # Same request as asy_chat_in, but yields the reply piece by piece as the model writes it.
+    # Errors are raised to the caller, which has already started its response.
+    messages = []
+    if system_prompt:
+        messages.append({"role": "system", "content": system_prompt})
+    # earlier turns of the conversation (see conversations.py)
+    messages.extend(history or [])
+    messages.append({"role": "user", "content": input_text})
+
+    async for text in asy_stream_completion(model=model, messages=messages):
+        yield text
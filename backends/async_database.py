@@ -1,22 +1,11 @@
-import motor.motor_asyncio
+from interaction_log import get_interaction_log, interaction_document
+from metrics import timed
 
+@timed("asy_write_to_db")
 async def asy_write_to_db(texts=[], interaction_id=None, chatbot_name=None, interaction_date=None):
     try:
-        # connect to db
-        client = motor.motor_asyncio.AsyncIOMotorClient("mongodb://localhost:27017/")
-        db = client["chatbot"]
-        collection = db["chatbot"]
-        
-        # write data to db
-        data = {
-            "text": texts,
-            "interaction_id": interaction_id,
-            "chatbot_name": chatbot_name,
-            "interaction_date": interaction_date
-            }
-        await collection.insert_one(data)
-        print(f"Data written to db for interaction_id: {interaction_id}")
+        # queued for a batched insert_many on the interaction log's writer thread (see interaction_log.py);
+        # only waits when the queue is full
+        await get_interaction_log().asy_log(interaction_document(texts, interaction_id, chatbot_name, interaction_date))
     except Exception as e:
-        print(f"Error writing to db: {e}")
-    finally:
-        client.close()
+        print(f"Error writing to db: {e}")
\ No newline at end of file
@@ -0,0 +1,337 @@
+"""
+Bulk song evaluation through the OpenAI Batch API.
+
+Large re-scoring runs (e.g. every archived submission after the
+dataset changes) do not need answers within seconds, so instead of one live
+request per song they are written as JSONL batch input files, one line per
+song per submission with custom_id "<submission>:<song>". The files are
+submitted as batches, polled until they finish, and the output files are
+read line by line back into the same results evaluate_song_genres and
+evaluate_song_file return.
+
+Two backends share the submit / retrieve / download interface:
+    OpenAIBatchBackend  the files and batches endpoints of the OpenAI API
+    LocalBatchBackend   a directory on disk that answers every request with
+                        the stub_openai classifier, for offline runs and tests
+
+Usage:
+    python batch_api.py rescore [--backend local|openai] [--dataset PATH] [--team NAME]
+                                [--output report.jsonl] [--update-leaderboard]
+"""
+import os
+import json
+import time
+import uuid
+import shutil
+import argparse
+
+import pandas as pd
+
+from datasets import get_dataset_registry, DEFAULT_DATASET_PATH
+from evaluate_submission import song_rows, song_messages, score_songs, summarize_results, evaluation_report
+from evaluation_archive import get_evaluation_archive
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
+BATCHES_DIR = os.path.join(DATA_DIR, 'batches')
+
+ENDPOINT = "/v1/chat/completions"
+# Provider limits for one batch input file
+MAX_REQUESTS_PER_FILE = 50000
+MAX_BYTES_PER_FILE = 190 * 1024 * 1024
+
+TERMINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+
+class OpenAIBatchBackend:
+    """Submit batches through the OpenAI files and batches endpoints."""
+
+    def __init__(self, client=None, completion_window="24h"):
+        if client is None:
+            from clients import get_openai_client
+            client = get_openai_client()
+        self.client = client
+        self.completion_window = completion_window
+
+    def submit(self, input_path):
+        """Upload a JSONL input file and create a batch for it; return the batch id."""
+        with open(input_path, "rb") as f:
+            uploaded = self.client.files.create(file=f, purpose="batch")
+        batch = self.client.batches.create(input_file_id=uploaded.id, endpoint=ENDPOINT,
+                                           completion_window=self.completion_window)
+        return batch.id
+
+    def retrieve(self, batch_id):
+        """Return {id, status, output_file_id, error_file_id} for a batch."""
+        batch = self.client.batches.retrieve(batch_id)
+        return {"id": batch.id, "status": batch.status,
+                "output_file_id": batch.output_file_id, "error_file_id": batch.error_file_id}
+
+    def download(self, file_id, path):
+        """Stream a result file to path without holding it in memory."""
+        with self.client.files.with_streaming_response.content(file_id) as response:
+            response.stream_to_file(path)
+
+
+class LocalBatchBackend:
+    """
+    File-based stand-in for the Batch API.
+
+    A submitted batch is a directory holding a copy of the input file. The
+    first retrieve() reports it in progress; the next one answers every
+    request with stub_openai.stub_reply, writes output.jsonl (and errors.jsonl
+    for malformed requests) in the provider's format and reports it completed.
+    """
+
+    def __init__(self, directory=None):
+        self.directory = directory or os.path.join(BATCHES_DIR, 'local')
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _state_path(self, batch_id):
+        return os.path.join(self.directory, batch_id, "state.json")
+
+    def _save_state(self, batch_id, state):
+        with open(self._state_path(batch_id), "w") as f:
+            json.dump(state, f)
+
+    def submit(self, input_path):
+        batch_id = f"batch_local_{uuid.uuid4().hex}"
+        os.makedirs(os.path.join(self.directory, batch_id))
+        shutil.copyfile(input_path, os.path.join(self.directory, batch_id, "input.jsonl"))
+        self._save_state(batch_id, {"id": batch_id, "status": "validating",
+                                    "output_file_id": None, "error_file_id": None})
+        return batch_id
+
+    def retrieve(self, batch_id):
+        with open(self._state_path(batch_id)) as f:
+            state = json.load(f)
+        if state["status"] == "validating":
+            state["status"] = "in_progress"
+        elif state["status"] == "in_progress":
+            state.update(self._process(batch_id), status="completed")
+        self._save_state(batch_id, state)
+        return state
+
+    def download(self, file_id, path):
+        shutil.copyfile(os.path.join(self.directory, file_id), path)
+
+    def _process(self, batch_id):
+        from stub_openai import stub_reply, completion_body
+
+        batch_dir = os.path.join(self.directory, batch_id)
+        errors = 0
+        with open(os.path.join(batch_dir, "input.jsonl")) as source, \
+                open(os.path.join(batch_dir, "output.jsonl"), "w") as output, \
+                open(os.path.join(batch_dir, "errors.jsonl"), "w") as error_output:
+            for line in source:
+                if not line.strip():
+                    continue
+                request = json.loads(line)
+                body = request.get("body") or {}
+                line_id = f"batch_req_{uuid.uuid4().hex}"
+                if request.get("url") != ENDPOINT or not body.get("messages"):
+                    errors += 1
+                    error_output.write(json.dumps({
+                        "id": line_id, "custom_id": request.get("custom_id"), "response": None,
+                        "error": {"code": "invalid_request", "message": "Expected a chat completion request"}
+                    }) + "\n")
+                    continue
+                json_mode = (body.get("response_format") or {}).get("type") == "json_object"
+                content = stub_reply(body["messages"], json_mode=json_mode)
+                output.write(json.dumps({
+                    "id": line_id, "custom_id": request.get("custom_id"),
+                    "response": {"status_code": 200, "request_id": uuid.uuid4().hex,
+                                 "body": completion_body(body.get("model", "stub"), content)},
+                    "error": None
+                }) + "\n")
+        return {"output_file_id": f"{batch_id}/output.jsonl",
+                "error_file_id": f"{batch_id}/errors.jsonl" if errors else None}
+
+
+def get_batch_backend(name):
+    """Return the backend called "openai" or "local"."""
+    if name == "openai":
+        return OpenAIBatchBackend()
+    if name == "local":
+        return LocalBatchBackend()
+    raise ValueError(f"Unknown batch backend '{name}' (expected 'openai' or 'local')")
+
+
+def write_batch_inputs(requests, directory):
+    """
+    Write batch request lines to as many JSONL files as the per-file limits require.
+
+    Args:
+        requests: Iterable of request dicts ({custom_id, method, url, body})
+        directory (str): Where to write input-<n>.jsonl
+
+    Returns:
+        list: Paths of the files written
+    """
+    paths = []
+    f = None
+    count = size = 0
+    try:
+        for request in requests:
+            line = (json.dumps(request) + "\n").encode("utf-8")
+            if f is None or count >= MAX_REQUESTS_PER_FILE or size + len(line) > MAX_BYTES_PER_FILE:
+                if f is not None:
+                    f.close()
+                paths.append(os.path.join(directory, f"input-{len(paths) + 1}.jsonl"))
+                f = open(paths[-1], "wb")
+                count = size = 0
+            f.write(line)
+            count += 1
+            size += len(line)
+    finally:
+        if f is not None:
+            f.close()
+    return paths
+
+
+def wait_for_batch(backend, batch_id, poll_interval=30, timeout=None):
+    """Poll a batch until it reaches a terminal status and return its final state."""
+    deadline = None if timeout is None else time.monotonic() + timeout
+    status = None
+    while True:
+        state = backend.retrieve(batch_id)
+        if state["status"] != status:
+            status = state["status"]
+            print(f"Batch {batch_id}: {status}")
+        if status in TERMINAL_STATUSES:
+            return state
+        if deadline is not None and time.monotonic() >= deadline:
+            raise TimeoutError(f"Batch {batch_id} still {status} after {timeout}s")
+        time.sleep(poll_interval)
+
+
+def iter_batch_output(path):
+    """
+    Read a batch output or error file one line at a time.
+
+    Yields:
+        tuple: (custom_id, content, error) where content is the completion text,
+               or None with an error message for a failed request
+    """
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            response = record.get("response") or {}
+            error = record.get("error")
+            if error or response.get("status_code") != 200:
+                error = error or (response.get("body") or {}).get("error") or f"HTTP {response.get('status_code')}"
+                yield record.get("custom_id"), None, error.get("message", str(error)) if isinstance(error, dict) else str(error)
+                continue
+            try:
+                content = response["body"]["choices"][0]["message"]["content"]
+            except (KeyError, IndexError, TypeError):
+                yield record.get("custom_id"), None, "Malformed response body"
+                continue
+            yield record.get("custom_id"), content, None
+
+
+def evaluate_in_batch(df, prompts, backend, model="gpt-4o-mini", work_dir=None, poll_interval=30, timeout=None):
+    """
+    Evaluate several prompts against the same songs with the Batch API.
+
+    Args:
+        df (pandas.DataFrame): Song dataset
+        prompts (list): One prompt per submission
+        backend: OpenAIBatchBackend or LocalBatchBackend
+        work_dir (str): Directory for input/output files (default data/batches/<timestamp>)
+
+    Returns:
+        list: One evaluate_song_genres-style dict per prompt, in order; songs
+              whose request failed are predicted as ERROR
+    """
+    rows = song_rows(df)
+    work_dir = work_dir or os.path.join(BATCHES_DIR, pd.Timestamp.now().strftime('%Y%m%d_%H%M%S'))
+    os.makedirs(work_dir, exist_ok=True)
+
+    requests = ({
+        "custom_id": f"{submission}:{position}",
+        "method": "POST",
+        "url": ENDPOINT,
+        "body": {"model": model, "messages": song_messages(lyrics, prompt), "temperature": 0.0}
+    } for submission, prompt in enumerate(prompts) for position, (_, lyrics, _) in enumerate(rows))
+    input_paths = write_batch_inputs(requests, work_dir)
+
+    batch_ids = [backend.submit(path) for path in input_paths]
+    predictions = {}
+    failed = 0
+    for number, batch_id in enumerate(batch_ids, 1):
+        state = wait_for_batch(backend, batch_id, poll_interval, timeout)
+        for kind in ("output", "error"):
+            file_id = state.get(f"{kind}_file_id")
+            if not file_id:
+                continue
+            path = os.path.join(work_dir, f"{kind}-{number}.jsonl")
+            backend.download(file_id, path)
+            for custom_id, content, error in iter_batch_output(path):
+                if content is None:
+                    failed += 1
+                    print(f"Batch request {custom_id} failed: {error}")
+                    continue
+                submission, position = map(int, custom_id.split(":"))
+                predictions[submission, position] = content.strip()
+    if failed:
+        print(f"{failed} batch requests failed and are scored as ERROR")
+
+    return [summarize_results(score_songs(rows, [predictions.get((submission, position), "ERROR")
+                                                 for position in range(len(rows))]))
+            for submission in range(len(prompts))]
+
+
+def rescore_evaluations(backend, dataset_path=DEFAULT_DATASET_PATH, archive=None, team=None, **kwargs):
+    """
+    Re-evaluate every archived prompt against the dataset in one bulk run.
+
+    A prompt a team submitted several times is evaluated once, as its latest
+    submission; team limits the run to one team.
+
+    Returns:
+        list: One evaluate_song_file-style result per prompt, with the "evaluation_id" it was last submitted
+              as, oldest first
+    """
+    archive = archive or get_evaluation_archive()
+    submissions = archive.latest_prompts(team)
+    df = get_dataset_registry().load_path(dataset_path).frame
+    evaluations = evaluate_in_batch(df, [prompt for _, _, prompt in submissions], backend, **kwargs)
+    return [{"evaluation_id": evaluation_id, **evaluation_report(team_name, prompt, evaluation)}
+            for (evaluation_id, team_name, prompt), evaluation in zip(submissions, evaluations)]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk evaluation through the Batch API")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    rescore = subparsers.add_parser("rescore", help="re-score every prompt in the evaluation archive")
+    rescore.add_argument("--backend", choices=("local", "openai"), default="local")
+    rescore.add_argument("--dataset", default=DEFAULT_DATASET_PATH)
+    rescore.add_argument("--model", default="gpt-4o-mini")
+    rescore.add_argument("--team", help="only re-score this team's prompts")
+    rescore.add_argument("--poll-interval", type=float, default=30)
+    rescore.add_argument("--output", help="write one JSON result per prompt to this file")
+    rescore.add_argument("--update-leaderboard", action="store_true",
+                         help="set each team's score from its most recent submission")
+    args = parser.parse_args()
+
+    results = rescore_evaluations(get_batch_backend(args.backend), args.dataset, team=args.team, model=args.model,
+                                  poll_interval=args.poll_interval if args.backend == "openai" else 0)
+    for result in results:
+        print(f"{result['team']} (evaluation {result['evaluation_id']}): {result['score']}/100 "
+              f"({result['correct']}/{result['total']})")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            for result in results:
+                f.write(json.dumps(result) + "\n")
+        print(f"Wrote {len(results)} results to {args.output}")
+
+    if args.update_leaderboard:
+        from leaderboard_store import get_leaderboard_store
+        # results are oldest first, so the last one per team is the latest
+        latest = {result["team"]: result for result in results}
+        for team_name, result in latest.items():
+            get_leaderboard_store().upsert_score(team_name, result["score"])
+        print(f"Updated {len(latest)} leaderboard scores")
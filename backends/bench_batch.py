@@ -0,0 +1,67 @@
+import os
+import json
+import time
+import argparse
+import urllib.request
+
+from stub_openai import start_in_thread
+from datasets import get_dataset_registry
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Accuracy and request-count parity of batch vs per-song evaluation")
+    parser.add_argument("--batch-sizes", default="5,10,20", help="comma-separated batch sizes to compare")
+    parser.add_argument("--songs", type=int, default=200, help="number of dataset rows to evaluate")
+    parser.add_argument("--prompt", default="Reply with the genre only.")
+    parser.add_argument("--model", default="gpt-4o-mini")
+    parser.add_argument("--latency", type=float, default=0.2, help="stub seconds per completion")
+    parser.add_argument("--batch-noise", type=float, default=0.05,
+                        help="fraction of batched songs the stub answers differently than when sent alone")
+    parser.add_argument("--live", action="store_true",
+                        help="call the real API (OPENAI_API_KEY) instead of the local stub")
+    args = parser.parse_args()
+
+    # Every run must reach the model, not replay the previous run from the cache
+    os.environ["COMPLETION_CACHE"] = "0"
+    stats_url = None
+    if not args.live:
+        base_url = start_in_thread(latency=args.latency, batch_noise=args.batch_noise)
+        os.environ["OPENAI_BASE_URL"] = base_url
+        os.environ["OPENAI_API_KEY"] = "stub"
+        stats_url = f"{base_url}/stub/stats"
+
+    from evaluate_submission import evaluate_song_genres
+
+    def request_count():
+        if stats_url is None:
+            return None
+        with urllib.request.urlopen(stats_url) as response:
+            return json.load(response)["requests"]
+
+    df = get_dataset_registry().get().frame.head(args.songs)
+    runs = [("single", None)] + [("batch", int(size)) for size in args.batch_sizes.split(",")]
+
+    if not args.live:
+        # the stub's disagreement is injected, so only --live measures what batching costs in accuracy
+        print(f"stub: {args.batch_noise:.0%} of batched songs answered differently; agreement checks the "
+              f"batch plumbing only, run with --live to measure the model")
+    baseline = None
+    print(f"{'mode':>10} {'requests':>9} {'seconds':>8} {'score':>6} {'agree':>7}")
+    for mode, batch_size in runs:
+        before = request_count()
+        start = time.perf_counter()
+        evaluation = evaluate_song_genres(df, args.prompt, model=args.model, mode=mode, batch_size=batch_size)
+        elapsed = time.perf_counter() - start
+        after = request_count()
+
+        predictions = [result["Predicted Genre"] for result in evaluation["results"]]
+        if baseline is None:
+            baseline = predictions
+        agreement = sum(a == b for a, b in zip(baseline, predictions)) / max(1, len(predictions))
+        label = mode if batch_size is None else f"batch/{batch_size}"
+        requests = "-" if before is None else after - before
+        print(f"{label:>10} {requests:>9} {elapsed:8.2f} {evaluation['score']:>6} {agreement:>7.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+import os
+import time
+import argparse
+
+from stub_openai import start_in_thread
+from datasets import get_dataset_registry
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serial vs concurrent evaluate_song_genres against a local stub")
+    parser.add_argument("--latency", type=float, default=0.2, help="stub seconds per completion")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--songs", type=int, default=200, help="number of dataset rows to evaluate")
+    args = parser.parse_args()
+
+    # Time the API calls, not completion cache hits from the first run
+    os.environ["COMPLETION_CACHE"] = "0"
+    # Point the OpenAI client at the stub before anything creates one
+    os.environ["OPENAI_BASE_URL"] = start_in_thread(latency=args.latency)
+    os.environ["OPENAI_API_KEY"] = "stub"
+
+    from evaluate_submission import evaluate_song_genres
+
+    df = get_dataset_registry().get().frame.head(args.songs)
+    prompt = "Reply with the genre only."
+
+    timings = {}
+    evaluations = {}
+    for label, concurrency in (("serial", 1), ("concurrent", args.concurrency)):
+        start = time.perf_counter()
+        evaluations[label] = evaluate_song_genres(df, prompt, concurrency=concurrency)
+        timings[label] = time.perf_counter() - start
+        print(f"{label:>10} (concurrency={concurrency:>3}): {timings[label]:7.2f}s  "
+              f"score {evaluations[label]['score']}/100")
+
+    same = evaluations["serial"]["results"] == evaluations["concurrent"]["results"]
+    print(f"\nSpeedup: {timings['serial'] / timings['concurrent']:.1f}x, identical results: {same}")
+
+
+if __name__ == "__main__":
+    main()
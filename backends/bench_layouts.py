@@ -0,0 +1,91 @@
+import os
+import time
+import argparse
+
+from stub_openai import start_in_thread
+from datasets import get_dataset_registry, LYRICS_COLUMN, GENRE_COLUMN
+
+BASE_PROMPT = "Classify the genre of the song lyrics. Reply with one of Hip-Hop, Pop, Country, Rock or R&B only."
+
+
+def few_shot_prompt(df, per_genre, base_prompt):
+    """
+    Append per_genre labelled songs of each genre to base_prompt.
+
+    Provider prompt caching only starts at 1024 tokens, so a short team prompt
+    gains nothing from any layout; worked examples are a realistic way a team
+    prompt gets that long. Returns (prompt, dataset index of the examples).
+    """
+    examples = df.groupby(GENRE_COLUMN, sort=True).head(per_genre) if per_genre else df.head(0)
+    blocks = [f"Lyrics:\n{row[LYRICS_COLUMN]}\nGenre: {row[GENRE_COLUMN]}" for _, row in examples.iterrows()]
+    prompt = base_prompt if not blocks else base_prompt + "\n\nExamples:\n\n" + "\n\n".join(blocks)
+    return prompt, list(examples.index)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Latency, token cost and accuracy parity of the evaluation message layouts")
+    parser.add_argument("--layouts", default="lyrics_first,prompt_first,system",
+                        help="comma-separated layouts to compare; the first is the accuracy baseline")
+    parser.add_argument("--songs", type=int, default=200, help="number of dataset rows to evaluate")
+    parser.add_argument("--prompt", default=BASE_PROMPT)
+    parser.add_argument("--prompt-file", help="read the team prompt from a file instead")
+    parser.add_argument("--examples", type=int, default=3,
+                        help="labelled songs per genre appended to the prompt (left out of the evaluation)")
+    parser.add_argument("--model", default="gpt-4o-mini")
+    parser.add_argument("--concurrency", type=int, help="requests in flight (default EVALUATION_CONCURRENCY)")
+    parser.add_argument("--latency", type=float, default=0.2, help="stub seconds per completion")
+    parser.add_argument("--live", action="store_true",
+                        help="call the real API (OPENAI_API_KEY) instead of the local stub")
+    args = parser.parse_args()
+
+    # Every run must reach the model, not replay the previous run from the cache
+    os.environ["COMPLETION_CACHE"] = "0"
+    # token counts are read from the usage scopes; keep them out of data/usage.sqlite3
+    os.environ["USAGE_DB"] = ":memory:"
+    if not args.live:
+        os.environ["OPENAI_BASE_URL"] = start_in_thread(latency=args.latency)
+        os.environ["OPENAI_API_KEY"] = "stub"
+        # the stub has no limits; the client's token pacing would otherwise dominate the later runs' times
+        os.environ.setdefault("OPENAI_RPM", "1000000")
+        os.environ.setdefault("OPENAI_TPM", "1000000000")
+
+    from evaluate_submission import evaluate_song_genres
+    from metrics import SPAN_SECONDS
+    from usage import usage_scope
+
+    df = get_dataset_registry().get().frame
+    if args.prompt_file:
+        with open(args.prompt_file, encoding="utf-8") as file:
+            base_prompt = file.read().strip()
+    else:
+        base_prompt = args.prompt
+    prompt, example_rows = few_shot_prompt(df, args.examples, base_prompt)
+    df = df.drop(index=example_rows).head(args.songs)
+    print(f"{len(df)} songs, prompt of ~{len(prompt) // 4} tokens ({len(example_rows)} examples), "
+          f"{'live API' if args.live else 'stub'} {args.model}\n")
+
+    baseline = None
+    print(f"{'layout':>13} {'seconds':>8} {'call ms':>8} {'prompt tok':>11} {'cached':>8} {'cached %':>9} "
+          f"{'cost $':>9} {'score':>6} {'agree':>7}")
+    for layout in args.layouts.split(","):
+        calls_before, seconds_before = SPAN_SECONDS.totals(span="model_call")
+        start = time.perf_counter()
+        with usage_scope(endpoint="bench-layouts", team=f"bench-{layout}") as scope:
+            evaluation = evaluate_song_genres(df, prompt, model=args.model, concurrency=args.concurrency,
+                                              layout=layout)
+        elapsed = time.perf_counter() - start
+        calls_after, seconds_after = SPAN_SECONDS.totals(span="model_call")
+        call_ms = (seconds_after - seconds_before) / max(1, calls_after - calls_before) * 1000
+
+        totals = scope.totals()
+        predictions = [result["Predicted Genre"] for result in evaluation["results"]]
+        if baseline is None:
+            baseline = predictions
+        agreement = sum(a == b for a, b in zip(baseline, predictions)) / max(1, len(predictions))
+        cached_share = totals["cached_tokens"] / max(1, totals["prompt_tokens"])
+        print(f"{layout:>13} {elapsed:8.2f} {call_ms:8.0f} {totals['prompt_tokens']:>11} {totals['cached_tokens']:>8} "
+              f"{cached_share:>9.1%} {totals['cost_usd']:>9.5f} {evaluation['score']:>6} {agreement:>7.1%}")
+
+
+if __name__ == "__main__":
+    main()
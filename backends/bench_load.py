@@ -0,0 +1,279 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import platform
+import tempfile
+import subprocess
+from datetime import datetime, timezone
+
+import aiohttp
+
+import stub_mongo
+from stub_openai import start_in_thread, add_stub_arguments, stub_options
+from bench_server import server_environment, start_server, free_port, wait_ready, sample_process, percentile, SERVERS
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), 'data', 'bench')
+# evaluations are archived in the server's temporary data directory (see bench_server.server_environment)
+BENCH_TEAM = "bench-load"
+
+
+def chat_body(number):
+    return {"input_text": f"Say only test {number}", "chatbot_name": "bench", "interaction_id": f"bench-{number}"}
+
+
+def chat_succeeded(status, body):
+    # chat_in reports a failed model call as a null response
+    return status == 200 and isinstance(body, dict) and body.get("response") is not None
+
+
+def evaluation_body(number):
+    # a distinct prompt per request, so no evaluation reuses another's predictions
+    return {"team_name": f"{BENCH_TEAM}-{number}", "dataset": "songs",
+            "prompt": f"Reply with the genre only. (bench {number})"}
+
+
+def evaluation_succeeded(status, body):
+    return status == 200 and isinstance(body, dict) and body.get("status") == "success"
+
+
+def leaderboard_succeeded(status, body):
+    return status == 200 and isinstance(body, list)
+
+
+# name: (method, path, body(request number) or None, success(status, body), default requests, default concurrency)
+SCENARIOS = {
+    "chat": ("POST", "/chat", chat_body, chat_succeeded, 300, 20),
+    "async_chat": ("POST", "/async_chat", chat_body, chat_succeeded, 300, 50),
+    # every request classifies the whole song dataset (200 model calls)
+    "evaluate_songs": ("POST", "/api/evaluate-songs", evaluation_body, evaluation_succeeded, 4, 2),
+    "leaderboard": ("GET", "/api/leaderboard", None, leaderboard_succeeded, 2000, 50),
+}
+
+
+def parse_scenarios(value, scale):
+    """Parse "name[:requests[:concurrency]],..." into [(name, requests, concurrency)]."""
+    scenarios = []
+    for item in value.split(","):
+        name, *sizes = item.strip().split(":")
+        if name not in SCENARIOS:
+            raise SystemExit(f"Unknown scenario {name!r}; choose from {', '.join(SCENARIOS)}")
+        requests = int(sizes[0]) if sizes else max(1, round(SCENARIOS[name][4] * scale))
+        concurrency = int(sizes[1]) if len(sizes) > 1 else SCENARIOS[name][5]
+        scenarios.append((name, requests, concurrency))
+    return scenarios
+
+
+async def run_scenario(base_url, name, requests, concurrency):
+    """Send `requests` requests with at most `concurrency` in flight; return latencies, failures and status codes."""
+    method, path, body, succeeded, _, _ = SCENARIOS[name]
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    failures = 0
+    statuses = {}
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    timeout = aiohttp.ClientTimeout(total=600)
+
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        async def one(number):
+            nonlocal failures
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    async with session.request(method, base_url + path,
+                                               json=body(number) if body else None) as response:
+                        status = response.status
+                        try:
+                            data = await response.json(content_type=None)
+                        except ValueError:
+                            data = None
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    status, data = "connection error", None
+                latencies.append(time.perf_counter() - start)
+                statuses[str(status)] = statuses.get(str(status), 0) + 1
+                if not succeeded(status, data):
+                    failures += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(number) for number in range(requests)))
+        return time.perf_counter() - start, sorted(latencies), failures, statuses
+
+
+async def stub_stats(stub_url):
+    async with aiohttp.ClientSession() as session:
+        async with session.get(f"{stub_url}/stub/stats") as response:
+            return await response.json()
+
+
+async def measure(pid, base_url, stub_url, name, requests, concurrency):
+    """Run one scenario while sampling the server process; return its result record."""
+    before = await stub_stats(stub_url)
+    peaks = {}
+    sampler = asyncio.ensure_future(sample_process(pid, peaks))
+    try:
+        elapsed, latencies, failures, statuses = await run_scenario(base_url, name, requests, concurrency)
+    finally:
+        sampler.cancel()
+    after = await stub_stats(stub_url)
+
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(requests / elapsed, 2),
+        "errors": failures,
+        "error_rate": round(failures / requests, 4),
+        "statuses": statuses,
+        "latency_ms": {
+            "mean": round(sum(latencies) / len(latencies) * 1000, 1),
+            "p50": round(percentile(latencies, 0.50) * 1000, 1),
+            "p95": round(percentile(latencies, 0.95) * 1000, 1),
+            "p99": round(percentile(latencies, 0.99) * 1000, 1),
+            "max": round(latencies[-1] * 1000, 1),
+        },
+        # what the model provider saw: calls made, and the 500s/429s the stub injected
+        "upstream": {key: after.get(key, 0) - before.get(key, 0) for key in ("requests", "errors", "rate_limited")},
+        "server": {"peak_threads": peaks.get("Threads"), "peak_rss_mb": peaks.get("VmRSS", 0) // 1024},
+    }
+
+
+def git_revision():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], capture_output=True,
+                               text=True).stdout.strip()
+        return commit + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def print_result(name, result):
+    latency = result["latency_ms"]
+    upstream = result["upstream"]
+    print(f"{name:>15}: {result['throughput_rps']:8.1f} req/s  p50 {latency['p50']:7.0f}ms  "
+          f"p95 {latency['p95']:7.0f}ms  p99 {latency['p99']:7.0f}ms  errors {result['error_rate']:6.1%}  "
+          f"upstream {upstream['requests']} calls / {upstream['errors']} 500s / {upstream['rate_limited']} 429s")
+
+
+def run(args):
+    scenarios = parse_scenarios(args.scenarios, args.scale)
+    stub_url = start_in_thread(latency=args.latency, **stub_options(args))
+    mongo_uri = args.mongo_uri or stub_mongo.start_in_thread()[0]
+    env = server_environment(stub_url, mongo_uri, tempfile.mkdtemp(prefix="bench_load_"))
+    # every request reaches the stub: no completion cache hits, no resumed evaluations
+    env.update(COMPLETION_CACHE="0", CHECKPOINTS="0")
+
+    commit = git_revision()
+    results = {
+        "meta": {
+            "commit": commit,
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "server": args.server,
+            "stub": {"latency": args.latency, **stub_options(args)},
+            "python": platform.python_version(),
+            "cpus": os.cpu_count(),
+        },
+        "scenarios": {},
+    }
+
+    print(f"{args.server} server at {commit}, stub {args.distribution} {args.latency}s, "
+          f"error rate {args.error_rate}, 429 rate {args.rate_limit_rate}, rpm {args.rpm or 'unlimited'}")
+    port = free_port()
+    server = start_server(args.server, port, env)
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        asyncio.run(wait_ready(f"{base_url}/api/cache/stats"))
+        for name, requests, concurrency in scenarios:
+            result = asyncio.run(measure(server.pid, base_url, stub_url, name, requests, concurrency))
+            results["scenarios"][name] = result
+            print_result(name, result)
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{commit}_{args.server}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as file:
+        json.dump(results, file, indent=2)
+    print(f"\nResults saved to {output}")
+
+
+def change(before, after):
+    return (after - before) / before if before else 0.0
+
+
+def compare(args):
+    """Print candidate vs baseline per scenario; exit 1 if any scenario regressed by more than the threshold."""
+    with open(args.baseline, encoding='utf-8') as file:
+        baseline = json.load(file)
+    with open(args.candidate, encoding='utf-8') as file:
+        candidate = json.load(file)
+
+    print(f"baseline  {baseline['meta']['commit']} ({baseline['meta']['server']}, {baseline['meta']['timestamp']})")
+    print(f"candidate {candidate['meta']['commit']} ({candidate['meta']['server']}, {candidate['meta']['timestamp']})")
+    for key, label in (("stub", "stub settings"), ("server", "servers"), ("cpus", "CPU counts")):
+        if baseline["meta"][key] != candidate["meta"][key]:
+            print(f"warning: the runs used different {label}")
+
+    regressions = []
+    for name in baseline["scenarios"]:
+        if name not in candidate["scenarios"]:
+            continue
+        before, after = baseline["scenarios"][name], candidate["scenarios"][name]
+        rows = [("throughput req/s", before["throughput_rps"], after["throughput_rps"], -1)]
+        rows += [(f"{key} ms", before["latency_ms"][key], after["latency_ms"][key], 1) for key in ("p50", "p95", "p99")]
+        print(f"\n{name}")
+        for label, old, new, worse in rows:
+            delta = change(old, new)
+            # throughput regresses when it falls, latency when it rises
+            regressed = delta * worse > args.threshold
+            if regressed:
+                regressions.append(f"{name} {label}")
+            print(f"  {label:<17} {old:10.1f} -> {new:10.1f}  {delta:+7.1%}{'  REGRESSION' if regressed else ''}")
+        error_delta = after["error_rate"] - before["error_rate"]
+        regressed = error_delta > args.error_threshold
+        if regressed:
+            regressions.append(f"{name} error rate")
+        print(f"  {'error rate':<17} {before['error_rate']:10.2%} -> {after['error_rate']:10.2%}  "
+              f"{error_delta * 100:+6.2f}pt{'  REGRESSION' if regressed else ''}")
+
+    if regressions:
+        print(f"\n{len(regressions)} regression(s): {', '.join(regressions)}")
+        sys.exit(1)
+    print("\nNo regressions")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end load test of the API against local OpenAI/Mongo stubs")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="run the load scenarios and save the results as JSON")
+    run_parser.add_argument("--server", choices=sorted(SERVERS), default="asgi")
+    run_parser.add_argument("--scenarios", default=",".join(SCENARIOS),
+                            help="comma-separated name[:requests[:concurrency]] (default: all)")
+    run_parser.add_argument("--scale", type=float, default=1.0, help="multiply the default request counts")
+    run_parser.add_argument("--mongo-uri", help="real MongoDB to log chats to (default: stub_mongo.py)")
+    run_parser.add_argument("--output", help="results file (default data/bench/<time>_<commit>_<server>.json)")
+    add_stub_arguments(run_parser)
+
+    compare_parser = commands.add_parser("compare", help="compare two result files")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("candidate")
+    compare_parser.add_argument("--threshold", type=float, default=0.10,
+                                help="relative throughput drop / latency rise counted as a regression")
+    compare_parser.add_argument("--error-threshold", type=float, default=0.01,
+                                help="absolute error-rate rise counted as a regression")
+
+    args = parser.parse_args()
+    if args.command == "run":
+        run(args)
+    else:
+        compare(args)
+
+
+if __name__ == "__main__":
+    main()
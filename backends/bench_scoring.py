@@ -0,0 +1,78 @@
+import time
+import random
+import argparse
+from difflib import SequenceMatcher
+
+import scoring
+from scoring import match_genres, MATCH_METHODS
+
+GENRES = ["Hip-Hop", "Pop", "Country", "Rock", "R&B"]
+VARIANTS = {
+    "Hip-Hop": ["Hip-Hop", "hip hop", "Hip-hop", "HIPHOP", "Rap", "hip-hop.", "Hip Hop/Rap", "Hip-Hoop"],
+    "Pop": ["Pop", "pop", "POP.", "Pop music", "K-Pop", "Popp"],
+    "Country": ["Country", "country", "Country.", "Country and Western", "Contry", "Folk"],
+    "Rock": ["Rock", "rock", "Rock and Roll", "Punk Rock", "Rok", "Metal"],
+    "R&B": ["R&B", "RnB", "r&b", "Rhythm and Blues", "R & B", "Soul"],
+}
+TEMPLATES = ["{}", "{}", "{}", "The genre is {}", "Genre: {}", "**{}**", "I think this is {}."]
+
+
+def legacy_is_correct_genre(expected, predicted, match_method):
+    """The per-row implementation scoring.py replaced, for comparison."""
+    expected = expected.lower().strip()
+    predicted = predicted.lower().strip()
+    if match_method == "exact":
+        return expected == predicted
+    elif match_method == "contains":
+        return expected in predicted or predicted in expected
+    elif match_method == "fuzzy":
+        return SequenceMatcher(None, expected, predicted).ratio() >= 0.8
+    return False
+
+
+def synthetic_predictions(count, seed):
+    rng = random.Random(seed)
+    expected = [rng.choice(GENRES) for _ in range(count)]
+    predicted = []
+    for genre in expected:
+        # mostly answers for the right genre, some for another one
+        source = genre if rng.random() < 0.7 else rng.choice(GENRES)
+        predicted.append(rng.choice(TEMPLATES).format(rng.choice(VARIANTS[source])))
+    return expected, predicted
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-row vs vectorized genre matching on synthetic predictions")
+    parser.add_argument("--count", type=int, default=100000)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    expected, predicted = synthetic_predictions(args.count, args.seed)
+    print(f"{args.count} predictions, {len(set(predicted))} distinct\n")
+    print(f"{'method':>9} {'per-row':>9} {'vectorized':>11} {'speedup':>8} {'legacy acc':>11} {'new acc':>8}")
+
+    fuzzy_backends = [("fuzzy", scoring.cpdist)]
+    if scoring.cpdist is not None:
+        fuzzy_backends.append(("fuzzy/np", None))
+    runs = [(method, scoring.cpdist) for method in MATCH_METHODS if method != "fuzzy"] + fuzzy_backends
+    for label, backend in runs:
+        method = label.split("/")[0]
+        start = time.perf_counter()
+        legacy = [legacy_is_correct_genre(e, p, method) for e, p in zip(expected, predicted)]
+        legacy_seconds = time.perf_counter() - start
+
+        installed, scoring.cpdist = scoring.cpdist, backend
+        scoring.normalize_genre.cache_clear()
+        try:
+            start = time.perf_counter()
+            correct = match_genres(expected, predicted, method)
+            vector_seconds = time.perf_counter() - start
+        finally:
+            scoring.cpdist = installed
+
+        print(f"{label:>9} {legacy_seconds:8.3f}s {vector_seconds:10.3f}s {legacy_seconds / vector_seconds:7.1f}x "
+              f"{sum(legacy) / args.count:>11.1%} {correct.mean():>8.1%}")
+
+
+if __name__ == "__main__":
+    main()
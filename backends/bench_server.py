@@ -0,0 +1,151 @@
+import os
+import sys
+import time
+import socket
+import asyncio
+import argparse
+import tempfile
+import subprocess
+
+import aiohttp
+
+from stub_openai import start_in_thread
+import stub_mongo
+
+SERVERS = {
+    # the way app.py runs today: Werkzeug's threaded server, async views bridged onto the client loop
+    "flask": [sys.executable, "-c", "import sys, signal; from app import app; "
+              "signal.signal(signal.SIGTERM, lambda *_: sys.exit(0)); app.run(port=int(sys.argv[1]), threaded=True)"],
+    # asgi.py on uvicorn with a single worker
+    "asgi": [sys.executable, "-m", "uvicorn", "asgi:app", "--workers", "1", "--log-level", "warning", "--port"],
+}
+
+
+def server_environment(base_url, mongo_uri, data_dir):
+    """Environment for a server under test: the stubs, and its SQLite files in data_dir."""
+    return dict(
+        os.environ,
+        OPENAI_BASE_URL=base_url, OPENAI_API_KEY="stub",
+        # the benchmark measures the server, not the client-side limiter
+        OPENAI_RPM="1000000", OPENAI_TPM="1000000000",
+        MONGO_URI=mongo_uri,
+        LEADERBOARD_DB=os.path.join(data_dir, "leaderboard.sqlite3"),
+        JOBS_DB=os.path.join(data_dir, "jobs.sqlite3"),
+        CHECKPOINTS_DB=os.path.join(data_dir, "checkpoints.sqlite3"),
+        EVALUATION_ARCHIVE_DB=os.path.join(data_dir, "evaluations.sqlite3"),
+    )
+
+
+def start_server(name, port, env):
+    """Start one of SERVERS on port; the caller terminates it."""
+    return subprocess.Popen(SERVERS[name] + [str(port)], env=env, cwd=os.path.dirname(os.path.abspath(__file__)),
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def wait_ready(url, timeout=60):
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as session:
+        while time.monotonic() < deadline:
+            try:
+                async with session.get(url) as response:
+                    if response.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"Server did not come up at {url}")
+
+
+async def load(url, requests, concurrency):
+    """POST `requests` chat requests with at most `concurrency` in flight; return latencies and error count."""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = 0
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    timeout = aiohttp.ClientTimeout(total=300)
+
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        async def one(number):
+            nonlocal errors
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    async with session.post(url, json={"input_text": f"Say only test {number}",
+                                                       "chatbot_name": "bench"}) as response:
+                        body = await response.json()
+                        if response.status != 200 or body.get("status") != "success":
+                            errors += 1
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    errors += 1
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(number) for number in range(requests)))
+        return time.perf_counter() - start, sorted(latencies), errors
+
+
+async def sample_process(pid, peaks, interval=0.25):
+    """Record the server's peak thread count and resident memory (Linux /proc) until cancelled."""
+    while True:
+        try:
+            with open(f"/proc/{pid}/status") as status:
+                for line in status:
+                    key, _, value = line.partition(":")
+                    if key in ("Threads", "VmRSS"):
+                        peaks[key] = max(peaks.get(key, 0), int(value.split()[0]))
+        except OSError:
+            return
+        await asyncio.sleep(interval)
+
+
+async def measure(pid, url, requests, concurrency):
+    peaks = {}
+    sampler = asyncio.ensure_future(sample_process(pid, peaks))
+    try:
+        return await load(url, requests, concurrency), peaks
+    finally:
+        sampler.cancel()
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(fraction * len(values)))] if values else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Throughput of POST /async_chat under Flask vs the ASGI server")
+    parser.add_argument("--servers", default="flask,asgi", help="comma-separated: flask, asgi")
+    parser.add_argument("--latency", type=float, default=0.2, help="stub seconds per completion")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--mongo-uri", help="real MongoDB to log chats to (default: stub_mongo.py)")
+    args = parser.parse_args()
+
+    base_url = start_in_thread(latency=args.latency)
+    mongo_uri = args.mongo_uri or stub_mongo.start_in_thread()[0]
+    env = server_environment(base_url, mongo_uri, tempfile.mkdtemp(prefix="bench_server_"))
+
+    print(f"{args.requests} requests, concurrency {args.concurrency}, stub latency {args.latency}s")
+    for name in args.servers.split(","):
+        port = free_port()
+        server = start_server(name, port, env)
+        try:
+            asyncio.run(wait_ready(f"http://127.0.0.1:{port}/api/cache/stats"))
+            (elapsed, latencies, errors), peaks = asyncio.run(measure(server.pid, f"http://127.0.0.1:{port}/async_chat",
+                                                                      args.requests, args.concurrency))
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+        print(f"{name:>6}: {args.requests / elapsed:7.1f} req/s  {elapsed:6.2f}s  "
+              f"p50 {percentile(latencies, 0.5) * 1000:6.0f}ms  p95 {percentile(latencies, 0.95) * 1000:6.0f}ms  "
+              f"errors {errors}  peak threads {peaks.get('Threads', '?')}  "
+              f"peak RSS {peaks.get('VmRSS', 0) // 1024}MB")
+
+
+if __name__ == "__main__":
+    main()
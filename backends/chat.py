@@ -1,19 +1,20 @@
-from openai import OpenAI
-import os
+from completions import create_completion, stream_completion
+from metrics import timed
 
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-
-def chat_in(input_text, system_prompt="You are a helpful assistant", model="gpt-4o-mini"):
+@timed("chat_in")
+def chat_in(input_text, system_prompt="You are a helpful assistant", model="gpt-4o-mini", history=None):
     try:
         
         # Add chat messages
         messages = []
         if system_prompt:
             messages.append({"role": "system", "content": system_prompt})
+        # earlier turns of the conversation (see conversations.py)
+        messages.extend(history or [])
         messages.append({"role": "user", "content": input_text})
         
         # call api
-        response = client.chat.completions.create(
+        response = create_completion(
             model=model,
             messages=messages
         )
@@ -26,4 +27,16 @@ def chat_in(input_text, system_prompt="You are a helpful assistant", model="gpt-
     except Exception as e:
         error_msg = f"Error in chat_in: {str(e)}"
         print(error_msg)
-    
\ No newline at end of file
+
+
+def chat_stream(input_text, system_prompt="You are a helpful assistant", model="gpt-4o-mini", history=None):
+    # Same request as chat_in, but yields the reply piece by piece as the model writes it.
+    # Errors are raised to the caller, which has already started its response.
+    messages = []
+    if system_prompt:
+        messages.append({"role": "system", "content": system_prompt})
+    # earlier turns of the conversation (see conversations.py)
+    messages.extend(history or [])
+    messages.append({"role": "user", "content": input_text})
+
+    yield from stream_completion(model=model, messages=messages)
@@ -0,0 +1,190 @@
+"""
+Per-song checkpoints for evaluations in progress.
+
+Each prediction is written to a SQLite file as soon as its song completes,
+keyed by the run: team, a hash of the prompt, the dataset version, the
+model, the message layout and the mode (with its batch size), so a batched
+run never resumes into a per-song one or back. If the process dies or the
+provider fails midway, running the same evaluation again loads the stored
+predictions, scores them without calling the API and only classifies the
+songs that are left. "ERROR" predictions are not stored, so those songs are
+retried. A run's checkpoint is deleted once its evaluation completes;
+abandoned ones expire after CHECKPOINT_TTL.
+
+Settings (environment variables):
+    CHECKPOINTS       set to 0 to disable checkpoints (default 1)
+    CHECKPOINTS_DB    SQLite file (default data/checkpoints.sqlite3)
+    CHECKPOINT_TTL    seconds an unfinished run is kept (default 7 days)
+"""
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+
+DEFAULT_PATH = os.path.join(os.path.dirname(__file__), 'data', 'checkpoints.sqlite3')
+
+
+def prompt_hash(prompt):
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+
+
+def run_key(team, prompt, dataset_version, model, layout=None, mode="single", batch_size=None):
+    """Return the checkpoint key of an evaluation run."""
+    parts = [team, prompt_hash(prompt), dataset_version, model]
+    # runs in the original layout and mode keep the keys they had before layouts and modes were keyed
+    if layout and layout != "lyrics_first":
+        parts.append(layout)
+    if mode and mode != "single":
+        parts.append(f"{mode}:{batch_size}")
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+
+class Checkpoint:
+    """The stored predictions of one evaluation run, by song (dataset row index)."""
+
+    def __init__(self, store, key):
+        self.store = store
+        self.key = key
+
+    def completed(self):
+        """Return {song: predicted genre} for every song already evaluated."""
+        return self.store.completed(self.key)
+
+    def record(self, predictions):
+        """Store [(song, predicted genre)]; ERROR predictions are skipped."""
+        self.store.record(self.key, predictions)
+
+    def clear(self):
+        """Forget the run once its evaluation has completed."""
+        self.store.clear(self.key)
+
+
+class CheckpointStore:
+    """SQLite store of per-song predictions for unfinished evaluation runs."""
+
+    def __init__(self, path=DEFAULT_PATH, ttl=7 * 24 * 3600):
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        # a commit per song is cheap in WAL mode with synchronous=NORMAL, and survives a process crash
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS runs ("
+            "key TEXT PRIMARY KEY, team TEXT NOT NULL, prompt_hash TEXT NOT NULL, dataset_version TEXT NOT NULL, "
+            "model TEXT NOT NULL, created_at REAL NOT NULL, updated_at REAL NOT NULL, "
+            "mode TEXT NOT NULL DEFAULT 'single', batch_size INTEGER)"
+        )
+        columns = [row[1] for row in self._db.execute("PRAGMA table_info(runs)")]
+        if "mode" not in columns:
+            self._db.execute("ALTER TABLE runs ADD COLUMN mode TEXT NOT NULL DEFAULT 'single'")
+            self._db.execute("ALTER TABLE runs ADD COLUMN batch_size INTEGER")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS predictions ("
+            "key TEXT NOT NULL, song INTEGER NOT NULL, prediction TEXT NOT NULL, "
+            "PRIMARY KEY (key, song)) WITHOUT ROWID"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS runs_updated ON runs (updated_at)")
+        self._expire()
+
+    def open(self, team, prompt, dataset_version, model, layout=None, mode="single", batch_size=None):
+        """Return the checkpoint of a run, creating it if this is the first attempt."""
+        key = run_key(team, prompt, dataset_version, model, layout, mode, batch_size)
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR IGNORE INTO runs (key, team, prompt_hash, dataset_version, model, created_at, updated_at, "
+                "mode, batch_size) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, team, prompt_hash(prompt), dataset_version, model, now, now, mode,
+                 batch_size if mode == "batch" else None)
+            )
+        return Checkpoint(self, key)
+
+    def completed(self, key):
+        with self._lock:
+            rows = self._db.execute("SELECT song, prediction FROM predictions WHERE key = ?", (key,)).fetchall()
+        return dict(rows)
+
+    def record(self, key, predictions):
+        rows = [(key, int(song), prediction) for song, prediction in predictions if prediction != "ERROR"]
+        if not rows:
+            return
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._db.executemany("INSERT OR REPLACE INTO predictions (key, song, prediction) VALUES (?, ?, ?)",
+                                     rows)
+                self._db.execute("UPDATE runs SET updated_at = ? WHERE key = ?", (time.time(), key))
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def clear(self, key):
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._db.execute("DELETE FROM predictions WHERE key = ?", (key,))
+                self._db.execute("DELETE FROM runs WHERE key = ?", (key,))
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def runs(self):
+        """Return the unfinished runs with their number of stored predictions, most recent first."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT r.team, r.prompt_hash, r.dataset_version, r.model, r.mode, r.batch_size, r.created_at, "
+                "r.updated_at, COUNT(p.song) AS songs FROM runs r LEFT JOIN predictions p ON p.key = r.key "
+                "GROUP BY r.key ORDER BY r.updated_at DESC"
+            ).fetchall()
+        columns = ["team", "prompt_hash", "dataset_version", "model", "mode", "batch_size", "created_at", "updated_at",
+                   "songs"]
+        return [dict(zip(columns, row)) for row in rows]
+
+    def _expire(self):
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._db.execute(
+                    "DELETE FROM predictions WHERE key IN (SELECT key FROM runs WHERE updated_at < ?)", (cutoff,)
+                )
+                self._db.execute("DELETE FROM runs WHERE updated_at < ?", (cutoff,))
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_checkpoint_store():
+    """Return the process-wide store, or None when CHECKPOINTS=0."""
+    global _store
+    if os.getenv("CHECKPOINTS", "1") == "0":
+        return None
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = CheckpointStore(
+                    path=os.getenv("CHECKPOINTS_DB", DEFAULT_PATH),
+                    ttl=float(os.getenv("CHECKPOINT_TTL", 7 * 24 * 3600))
+                )
+    return _store
+
+
+def open_checkpoint(team, prompt, dataset_version, model, layout=None, mode="single", batch_size=None):
+    """Return the Checkpoint for a run, or None when checkpoints are disabled."""
+    store = get_checkpoint_store()
+    if store is None:
+        return None
+    return store.open(team, prompt, dataset_version, model, layout, mode, batch_size)
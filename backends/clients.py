@@ -0,0 +1,223 @@
+"""
+Process-wide registry of pooled OpenAI and MongoDB clients.
+
+Clients are created lazily on first use and reused for every request, so
+connection pools (HTTP keep-alive for OpenAI, socket pools for Mongo) are
+shared instead of being rebuilt per call. Async clients are bound to the
+event loop they were created on, so they are kept per loop; the shared
+background loop started by run_coroutine() lets sync callers and Flask async
+views reuse the same async pools.
+
+Pool sizes come from environment variables:
+    OPENAI_MAX_CONNECTIONS            max open HTTP connections per OpenAI client (default 100)
+    OPENAI_MAX_KEEPALIVE_CONNECTIONS  idle connections kept alive (default 20)
+    MONGO_URI                         connection string (default mongodb://localhost:27017/)
+    MONGO_MAX_POOL_SIZE               max sockets per Mongo client (default 100)
+"""
+import os
+import atexit
+import asyncio
+import threading
+import contextvars
+import concurrent.futures
+import weakref
+
+try:
+    import httpx
+except ImportError:  # recent openai releases are built on httpx2
+    import httpx2 as httpx
+import pymongo
+import motor.motor_asyncio
+from openai import OpenAI, AsyncOpenAI, DefaultHttpxClient, DefaultAsyncHttpxClient
+
+_lock = threading.Lock()
+_openai_client = None
+_mongo_client = None
+# event loop -> client, so async clients never cross loops
+_async_openai_clients = weakref.WeakKeyDictionary()
+_motor_clients = weakref.WeakKeyDictionary()
+
+_background_loop = None
+_background_thread = None
+
+
+def _openai_limits():
+    return httpx.Limits(
+        max_connections=int(os.getenv("OPENAI_MAX_CONNECTIONS", 100)),
+        max_keepalive_connections=int(os.getenv("OPENAI_MAX_KEEPALIVE_CONNECTIONS", 20))
+    )
+
+
+def _mongo_settings():
+    return os.getenv("MONGO_URI", "mongodb://localhost:27017/"), int(os.getenv("MONGO_MAX_POOL_SIZE", 100))
+
+
+def get_openai_client():
+    """Return the shared synchronous OpenAI client."""
+    global _openai_client
+    if _openai_client is None:
+        with _lock:
+            if _openai_client is None:
+                _openai_client = OpenAI(
+                    api_key=os.getenv("OPENAI_API_KEY"),
+                    http_client=DefaultHttpxClient(limits=_openai_limits()),
+                    max_retries=0  # retries and backoff are handled by completions.py
+                )
+    return _openai_client
+
+
+def get_async_openai_client():
+    """Return the AsyncOpenAI client for the running event loop."""
+    loop = asyncio.get_running_loop()
+    client = _async_openai_clients.get(loop)
+    if client is None:
+        client = AsyncOpenAI(
+            api_key=os.getenv("OPENAI_API_KEY"),
+            http_client=DefaultAsyncHttpxClient(limits=_openai_limits()),
+            max_retries=0  # retries and backoff are handled by completions.py
+        )
+        _async_openai_clients[loop] = client
+    return client
+
+
+def get_mongo_client():
+    """Return the shared pymongo client."""
+    global _mongo_client
+    if _mongo_client is None:
+        with _lock:
+            if _mongo_client is None:
+                uri, pool_size = _mongo_settings()
+                _mongo_client = pymongo.MongoClient(uri, maxPoolSize=pool_size)
+    return _mongo_client
+
+
+def new_mongo_client(**options):
+    """Return a pymongo client of its own with the shared settings (and options); the caller closes it."""
+    uri, pool_size = _mongo_settings()
+    return pymongo.MongoClient(uri, maxPoolSize=pool_size, **options)
+
+
+def get_motor_client():
+    """Return the Motor client for the running event loop."""
+    loop = asyncio.get_running_loop()
+    client = _motor_clients.get(loop)
+    if client is None:
+        uri, pool_size = _mongo_settings()
+        client = motor.motor_asyncio.AsyncIOMotorClient(uri, maxPoolSize=pool_size, io_loop=loop)
+        _motor_clients[loop] = client
+    return client
+
+
+def _get_background_loop():
+    global _background_loop, _background_thread
+    if _background_loop is None:
+        with _lock:
+            if _background_loop is None:
+                loop = asyncio.new_event_loop()
+                _background_thread = threading.Thread(target=loop.run_forever, name="client-loop", daemon=True)
+                _background_thread.start()
+                _background_loop = loop
+    return _background_loop
+
+
+def submit_coroutine(coro):
+    """
+    Start a coroutine on the shared background event loop without waiting for it.
+
+    The caller's contextvars (e.g. the Flask request context) are carried over.
+    Cancelling the returned concurrent.futures.Future cancels the task.
+    """
+    loop = _get_background_loop()
+    context = contextvars.copy_context()
+    future = concurrent.futures.Future()
+
+    def finished(task):
+        if future.cancelled():
+            return
+        if task.cancelled():
+            future.cancel()
+        elif task.exception() is not None:
+            future.set_exception(task.exception())
+        else:
+            future.set_result(task.result())
+
+    def start():
+        if future.cancelled():
+            coro.close()
+            return
+        task = loop.create_task(coro, context=context)
+        task.add_done_callback(finished)
+        future.add_done_callback(lambda f: f.cancelled() and loop.call_soon_threadsafe(task.cancel))
+
+    loop.call_soon_threadsafe(start)
+    return future
+
+
+def run_coroutine(coro):
+    """
+    Run a coroutine on the shared background event loop and wait for its result.
+
+    The caller's contextvars (e.g. the Flask request context) are carried over,
+    and async clients created inside keep their pools between calls.
+    """
+    return submit_coroutine(coro).result()
+
+
+def iterate_async(agen):
+    """
+    Iterate an async generator on the shared background event loop from synchronous code.
+
+    Each item is fetched with run_coroutine; closing this generator closes the async one.
+    """
+    try:
+        while True:
+            try:
+                yield run_coroutine(agen.__anext__())
+            except StopAsyncIteration:
+                return
+    finally:
+        run_coroutine(agen.aclose())
+
+
+async def aclose_clients():
+    """Close the async clients belonging to the running event loop."""
+    loop = asyncio.get_running_loop()
+    client = _async_openai_clients.pop(loop, None)
+    if client is not None:
+        await client.close()
+    motor_client = _motor_clients.pop(loop, None)
+    if motor_client is not None:
+        motor_client.close()
+
+
+def close_clients():
+    """Close every pooled client. Registered with atexit; safe to call more than once."""
+    global _openai_client, _mongo_client, _background_loop
+    with _lock:
+        if _openai_client is not None:
+            _openai_client.close()
+            _openai_client = None
+        if _mongo_client is not None:
+            _mongo_client.close()
+            _mongo_client = None
+
+    if _background_loop is not None and _background_loop.is_running():
+        try:
+            run_coroutine(aclose_clients())
+        except Exception as e:
+            print(f"Error closing async clients: {e}")
+        _background_loop.call_soon_threadsafe(_background_loop.stop)
+        _background_thread.join(timeout=5)
+        _background_loop = None
+
+    # Clients on other loops can only be closed if their loop is idle
+    for loop in list(_async_openai_clients.keys()) + list(_motor_clients.keys()):
+        if loop.is_closed() or loop.is_running():
+            continue
+        try:
+            loop.run_until_complete(aclose_clients())
+        except Exception as e:
+            print(f"Error closing async clients: {e}")
+
+
+atexit.register(close_clients)
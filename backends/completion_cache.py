@@ -0,0 +1,169 @@
+"""
+Content-addressed cache for deterministic chat completions.
+
+A request is identified by a SHA-256 of its model, messages, temperature and
+any other request parameters. Entries live in two tiers: an in-memory LRU for
+the hot set, and a SQLite file that survives restarts. Both tiers expire
+entries after a TTL, and the SQLite tier is trimmed to a maximum entry count
+by evicting the least recently used rows.
+
+Settings (environment variables):
+    COMPLETION_CACHE                 set to 0 to disable caching (default 1)
+    COMPLETION_CACHE_PATH            SQLite file (default data/completion_cache.sqlite3)
+    COMPLETION_CACHE_TTL             seconds before an entry expires (default 7 days)
+    COMPLETION_CACHE_MEMORY_ENTRIES  in-memory LRU size (default 4096)
+    COMPLETION_CACHE_MAX_ENTRIES     on-disk entry cap (default 100000)
+"""
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+
+DEFAULT_PATH = os.path.join(os.path.dirname(__file__), 'data', 'completion_cache.sqlite3')
+
+# Trim the disk tier after this many stores instead of on every write
+EVICTION_INTERVAL = 100
+
+
+def cache_key(model, messages, temperature, **params):
+    """Return the content address of a completion request."""
+    payload = {"model": model, "messages": messages, "temperature": temperature}
+    payload.update(params)
+    encoded = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+class CompletionCache:
+    """Two-tier (memory LRU + SQLite) cache of serialized completions."""
+
+    def __init__(self, path=DEFAULT_PATH, ttl=7 * 24 * 3600, memory_entries=4096, max_entries=100000):
+        self.path = path
+        self.ttl = ttl
+        self.memory_entries = memory_entries
+        self.max_entries = max_entries
+        self._memory = OrderedDict()  # key -> (stored_at, value)
+        self._lock = threading.Lock()
+        self._stores_since_eviction = 0
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS completions ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, stored_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS completions_accessed ON completions (accessed_at)")
+        self._db.commit()
+
+    def get(self, key):
+        """Return the cached value for key, or None."""
+        now = time.time()
+        with self._lock:
+            value = self._get_memory(key, now)
+            if value is not None:
+                return value
+
+            row = self._db.execute(
+                "SELECT value, stored_at FROM completions WHERE key = ? AND stored_at > ?",
+                (key, now - self.ttl)
+            ).fetchone()
+            if row is None:
+                self.stats["misses"] += 1
+                return None
+
+            self._db.execute("UPDATE completions SET accessed_at = ? WHERE key = ?", (now, key))
+            self._db.commit()
+            self._remember(key, row[1], row[0])
+            self.stats["disk_hits"] += 1
+            return row[0]
+
+    def get_memory(self, key):
+        """Return the value for key from the in-memory tier only, or None; it never reads the SQLite file."""
+        with self._lock:
+            return self._get_memory(key, time.time())
+
+    def set(self, key, value):
+        """Store value under key in both tiers."""
+        now = time.time()
+        with self._lock:
+            self._remember(key, now, value)
+            self._db.execute(
+                "INSERT OR REPLACE INTO completions (key, value, stored_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, value, now, now)
+            )
+            self._db.commit()
+            self.stats["stores"] += 1
+            self._stores_since_eviction += 1
+            if self._stores_since_eviction >= EVICTION_INTERVAL:
+                self._evict(now)
+
+    def clear(self):
+        """Drop every entry from both tiers."""
+        with self._lock:
+            self._memory.clear()
+            self._db.execute("DELETE FROM completions")
+            self._db.commit()
+
+    def get_stats(self):
+        """Return hit/miss counters and tier sizes."""
+        with self._lock:
+            stats = dict(self.stats)
+            stats["memory_entries"] = len(self._memory)
+            stats["disk_entries"] = self._db.execute("SELECT COUNT(*) FROM completions").fetchone()[0]
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = round((stats["memory_hits"] + stats["disk_hits"]) / lookups, 4) if lookups else 0.0
+        return stats
+
+    def _get_memory(self, key, now):
+        entry = self._memory.get(key)
+        if entry is None:
+            return None
+        if now - entry[0] >= self.ttl:
+            del self._memory[key]
+            return None
+        self._memory.move_to_end(key)
+        self.stats["memory_hits"] += 1
+        return entry[1]
+
+    def _remember(self, key, stored_at, value):
+        self._memory[key] = (stored_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _evict(self, now):
+        self._stores_since_eviction = 0
+        expired = self._db.execute("DELETE FROM completions WHERE stored_at <= ?", (now - self.ttl,)).rowcount
+        overflow = self._db.execute(
+            "DELETE FROM completions WHERE key IN ("
+            "SELECT key FROM completions ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,)
+        ).rowcount
+        self._db.commit()
+        self.stats["evictions"] += expired + overflow
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_completion_cache():
+    """Return the process-wide cache, or None when COMPLETION_CACHE=0."""
+    global _cache
+    if os.getenv("COMPLETION_CACHE", "1") == "0":
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = CompletionCache(
+                    path=os.getenv("COMPLETION_CACHE_PATH", DEFAULT_PATH),
+                    ttl=float(os.getenv("COMPLETION_CACHE_TTL", 7 * 24 * 3600)),
+                    memory_entries=int(os.getenv("COMPLETION_CACHE_MEMORY_ENTRIES", 4096)),
+                    max_entries=int(os.getenv("COMPLETION_CACHE_MAX_ENTRIES", 100000))
+                )
+    return _cache
@@ -0,0 +1,277 @@
+"""
+Single entry point for chat completion calls.
+
+create_completion / asy_create_completion wrap the pooled clients from
+clients.py. Requests made with temperature 0 are deterministic, so they are
+answered from the completion cache when an identical request has been seen
+before. Everything else goes to the API through the per-model rate limiter,
+which paces calls to the provider's limits and retries 429/5xx responses
+with exponential backoff.
+
+stream_completion / asy_stream_completion yield the reply's text as the
+model generates it. They share the limiter and the retries (until the
+stream has started) but are never cached.
+
+Every call, including cache hits, is counted by usage.py against the team
+and submission of the current usage scope.
+"""
+import time
+import asyncio
+
+from openai.types.chat import ChatCompletion
+
+from clients import get_openai_client, get_async_openai_client
+from completion_cache import get_completion_cache, cache_key
+from rate_limiter import get_rate_limiter, estimate_tokens, is_retryable, error_headers
+from metrics import Counter, span
+from usage import record_model_call, cached_tokens
+
+MODEL_TOKENS = Counter("datanexus_model_tokens_total", "Tokens reported by the model API.", ["model", "kind"])
+MODEL_RETRIES = Counter("datanexus_model_retries_total", "Model calls retried after a 429/5xx/connection error.",
+                        ["model"])
+CACHE_LOOKUPS = Counter("datanexus_completion_cache_lookups_total", "Completion cache lookups.", ["result"])
+
+
+def _cacheable(kwargs):
+    return kwargs.get("temperature") == 0 and not kwargs.get("stream")
+
+
+def _lookup(model, messages, kwargs):
+    cache = get_completion_cache()
+    if cache is None or not _cacheable(kwargs):
+        return None, None
+    key = cache_key(model, messages, **kwargs)
+    return key, _cached_completion(model, cache.get(key))
+
+
+async def _asy_lookup(model, messages, kwargs):
+    # the memory tier is answered inline; only a memory miss reads the SQLite file, on a worker thread
+    cache = get_completion_cache()
+    if cache is None or not _cacheable(kwargs):
+        return None, None
+    key = cache_key(model, messages, **kwargs)
+    cached = cache.get_memory(key)
+    if cached is None:
+        cached = await asyncio.to_thread(cache.get, key)
+    return key, _cached_completion(model, cached)
+
+
+def _cached_completion(model, cached):
+    CACHE_LOOKUPS.inc(result="hit" if cached is not None else "miss")
+    if cached is None:
+        return None
+    record_model_call(model, cache_hit=True)
+    return ChatCompletion.model_validate_json(cached)
+
+
+def _store(key, completion):
+    cache = get_completion_cache()
+    if key is not None and cache is not None:
+        cache.set(key, completion.model_dump_json())
+
+
+async def _asy_store(key, completion):
+    cache = get_completion_cache()
+    if key is not None and cache is not None:
+        await asyncio.to_thread(cache.set, key, completion.model_dump_json())
+
+
+def _record_usage(model, limiter, estimated, usage):
+    limiter.record_usage(estimated, usage.total_tokens if usage else None)
+    if usage:
+        MODEL_TOKENS.inc(usage.prompt_tokens or 0, model=model, kind="prompt")
+        MODEL_TOKENS.inc(usage.completion_tokens or 0, model=model, kind="completion")
+        # prompt tokens the provider served from its prompt cache (part of the prompt count)
+        MODEL_TOKENS.inc(cached_tokens(usage), model=model, kind="cached")
+    # billed to the team/submission/endpoint of the current usage scope
+    record_model_call(model, usage)
+
+
+def _completed(model, limiter, estimated, raw):
+    limiter.update_from_headers(raw.headers)
+    completion = raw.parse()
+    _record_usage(model, limiter, estimated, getattr(completion, "usage", None))
+    return completion
+
+
+def _retry_delay(model, limiter, error, attempt, max_retries, retry_delay):
+    """Return the backoff before the next attempt, or None if the error should be raised."""
+    if attempt >= max_retries or not is_retryable(error):
+        return None
+    MODEL_RETRIES.inc(model=model)
+    headers = error_headers(error)
+    limiter.update_from_headers(headers)
+    return limiter.backoff_delay(attempt, headers, base_delay=retry_delay)
+
+
+def create_completion(model, messages, max_retries=None, retry_delay=None, **kwargs):
+    """
+    Create a chat completion, serving temperature-0 requests from the cache.
+
+    Args:
+        model (str): Model name
+        messages (list): Chat messages
+        max_retries (int): Retries after rate-limit/server errors (default OPENAI_MAX_RETRIES)
+        retry_delay (float): Base backoff delay in seconds (default OPENAI_RETRY_DELAY)
+        **kwargs: Extra parameters for chat.completions.create
+
+    Returns:
+        ChatCompletion
+    """
+    key, completion = _lookup(model, messages, kwargs)
+    if completion is not None:
+        return completion
+
+    limiter = get_rate_limiter(model)
+    max_retries = limiter.max_retries if max_retries is None else max_retries
+    estimated = estimate_tokens(messages, **kwargs)
+    attempt = 0
+    while True:
+        time.sleep(limiter.reserve(estimated))
+        try:
+            with span("model_call"):
+                raw = get_openai_client().chat.completions.with_raw_response.create(
+                    model=model, messages=messages, **kwargs)
+            break
+        except Exception as e:
+            delay = _retry_delay(model, limiter, e, attempt, max_retries, retry_delay)
+            if delay is None:
+                raise
+            print(f"Model call failed ({e}), retrying in {delay:.1f}s ({attempt + 1}/{max_retries})")
+            time.sleep(delay)
+            attempt += 1
+
+    completion = _completed(model, limiter, estimated, raw)
+    _store(key, completion)
+    return completion
+
+
+async def asy_create_completion(model, messages, max_retries=None, retry_delay=None, **kwargs):
+    """Async version of create_completion; the cache's SQLite tier is read and written on a worker thread."""
+    key, completion = await _asy_lookup(model, messages, kwargs)
+    if completion is not None:
+        return completion
+
+    limiter = get_rate_limiter(model)
+    max_retries = limiter.max_retries if max_retries is None else max_retries
+    estimated = estimate_tokens(messages, **kwargs)
+    attempt = 0
+    while True:
+        await asyncio.sleep(limiter.reserve(estimated))
+        try:
+            with span("model_call"):
+                raw = await get_async_openai_client().chat.completions.with_raw_response.create(
+                    model=model, messages=messages, **kwargs)
+            break
+        except Exception as e:
+            delay = _retry_delay(model, limiter, e, attempt, max_retries, retry_delay)
+            if delay is None:
+                raise
+            print(f"Model call failed ({e}), retrying in {delay:.1f}s ({attempt + 1}/{max_retries})")
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    completion = _completed(model, limiter, estimated, raw)
+    await _asy_store(key, completion)
+    return completion
+
+
+def _stream_arguments(kwargs):
+    # the last chunk then carries the usage, which corrects the token bucket
+    return {**kwargs, "stream": True, "stream_options": {"include_usage": True}}
+
+
+def _delta_text(chunk):
+    if chunk.choices and chunk.choices[0].delta.content:
+        return chunk.choices[0].delta.content
+    return None
+
+
+def stream_completion(model, messages, max_retries=None, retry_delay=None, **kwargs):
+    """
+    Stream a chat completion, yielding the text of each delta as it arrives.
+
+    Args:
+        model (str): Model name
+        messages (list): Chat messages
+        max_retries (int): Retries before the stream starts (default OPENAI_MAX_RETRIES)
+        retry_delay (float): Base backoff delay in seconds (default OPENAI_RETRY_DELAY)
+        **kwargs: Extra parameters for chat.completions.create
+
+    Yields:
+        str: the next piece of the reply; closing the generator closes the HTTP stream
+    """
+    limiter = get_rate_limiter(model)
+    max_retries = limiter.max_retries if max_retries is None else max_retries
+    estimated = estimate_tokens(messages, **kwargs)
+    attempt = 0
+    while True:
+        time.sleep(limiter.reserve(estimated))
+        try:
+            with span("model_stream_start"):
+                raw = get_openai_client().chat.completions.with_raw_response.create(
+                    model=model, messages=messages, **_stream_arguments(kwargs))
+            break
+        except Exception as e:
+            delay = _retry_delay(model, limiter, e, attempt, max_retries, retry_delay)
+            if delay is None:
+                raise
+            print(f"Model call failed ({e}), retrying in {delay:.1f}s ({attempt + 1}/{max_retries})")
+            time.sleep(delay)
+            attempt += 1
+
+    limiter.update_from_headers(raw.headers)
+    stream = raw.parse()
+    usage = None
+    try:
+        for chunk in stream:
+            usage = chunk.usage or usage
+            text = _delta_text(chunk)
+            if text:
+                yield text
+    finally:
+        stream.close()
+        _record_usage(model, limiter, estimated, usage)
+
+
+async def asy_stream_completion(model, messages, max_retries=None, retry_delay=None, **kwargs):
+    """Async version of stream_completion."""
+    limiter = get_rate_limiter(model)
+    max_retries = limiter.max_retries if max_retries is None else max_retries
+    estimated = estimate_tokens(messages, **kwargs)
+    attempt = 0
+    while True:
+        await asyncio.sleep(limiter.reserve(estimated))
+        try:
+            with span("model_stream_start"):
+                raw = await get_async_openai_client().chat.completions.with_raw_response.create(
+                    model=model, messages=messages, **_stream_arguments(kwargs))
+            break
+        except Exception as e:
+            delay = _retry_delay(model, limiter, e, attempt, max_retries, retry_delay)
+            if delay is None:
+                raise
+            print(f"Model call failed ({e}), retrying in {delay:.1f}s ({attempt + 1}/{max_retries})")
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    limiter.update_from_headers(raw.headers)
+    stream = raw.parse()
+    usage = None
+    try:
+        async for chunk in stream:
+            usage = chunk.usage or usage
+            text = _delta_text(chunk)
+            if text:
+                yield text
+    finally:
+        await stream.close()
+        _record_usage(model, limiter, estimated, usage)
+
+
+def get_cache_stats():
+    """Return the completion cache counters, or {"enabled": False}."""
+    cache = get_completion_cache()
+    if cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **cache.get_stats()}
@@ -0,0 +1,333 @@
+"""
+Server-side conversation history for the chat endpoints, keyed by interaction_id.
+
+When a chat request carries an interaction_id, the earlier turns of that
+conversation are sent to the model ahead of the new message, so a client
+only ever sends the new message.
+
+Conversations are held in an in-memory LRU of CONVERSATION_CACHE_SIZE
+entries, backed by the chatbot.conversations collection in Mongo: a
+conversation that was evicted, or that another worker process served, is
+loaded from Mongo on its next turn. A conversation that is not in memory
+starts empty at once and its stored history is loaded in the background; a
+request waits at most CONVERSATION_LOAD_TIMEOUT for it, and turns recorded
+meanwhile are kept after the loaded ones. The store has its own Mongo client
+that gives up after CONVERSATION_MONGO_TIMEOUT, and after a failed load
+Mongo is not asked again for CONVERSATION_RETRY_SECONDS, so chats carry on
+without history while Mongo is down. Writes to Mongo happen on a background
+thread and add nothing to a request. A conversation is only saved once its
+stored history has been read (a save retries the read if the load failed),
+so a save never replaces turns it has not seen. The TTL index is created at
+startup (ensure_index_in_background).
+
+History is kept within CONVERSATION_TOKEN_BUDGET tokens (~4 characters per
+token, as the rate limiter counts). Once the stored turns go over the budget,
+the oldest ones are folded into a running summary by the model, in the
+background, keeping the newest half of the budget verbatim. Until that
+summary is ready, a request that would go over the budget leaves out its
+oldest turns.
+
+Settings (environment variables):
+    CONVERSATIONS               set to 0 to disable conversation history (default 1)
+    CONVERSATION_CACHE_SIZE     conversations kept in memory (default 1000)
+    CONVERSATION_TOKEN_BUDGET   tokens of history sent with a request (default 2000)
+    CONVERSATION_SUMMARY_MODEL  model that summarizes old turns (default gpt-4o-mini)
+    CONVERSATION_TTL            seconds an idle conversation is kept in Mongo (default 30 days)
+    CONVERSATION_LOAD_TIMEOUT   seconds a request waits for stored history (default 0.25)
+    CONVERSATION_MONGO_TIMEOUT  seconds to reach Mongo before a load or save fails (default 1.0)
+    CONVERSATION_RETRY_SECONDS  seconds without loads after one failed (default 30)
+"""
+import os
+import time
+import atexit
+import asyncio
+import threading
+import concurrent.futures
+from datetime import datetime, timezone
+from collections import OrderedDict
+
+from clients import new_mongo_client
+from completions import create_completion
+from usage import usage_scope
+
+DATABASE = "chatbot"
+COLLECTION = "conversations"
+
+SUMMARY_PROMPT = (
+    "You maintain the memory of a conversation between a user and an assistant. Rewrite the summary so far "
+    "together with the new turns into one concise summary. Keep names, facts, decisions, open questions and "
+    "anything the user asked to remember; leave out pleasantries. Answer with the summary only."
+)
+
+
+def message_tokens(message):
+    """Rough token count of one message, counted the way rate_limiter.estimate_tokens does."""
+    return len(str(message.get("content") or "")) // 4 + 4
+
+
+class Conversation:
+    """The running summary and the verbatim turns of one conversation."""
+
+    def __init__(self, interaction_id, summary="", turns=None, loaded=True):
+        self.interaction_id = interaction_id
+        self.summary = summary
+        self.turns = turns or []
+        self.lock = threading.Lock()
+        self.summarizing = False
+        # set once the background load has finished, whether or not it could read Mongo
+        self.loaded = threading.Event()
+        # True once the stored history has been merged in (or Mongo had none); until then nothing is
+        # saved or summarized, so the stored turns are never overwritten
+        self.stored = loaded
+        if loaded:
+            self.loaded.set()
+
+    def tokens(self):
+        return sum(message_tokens(turn) for turn in self.turns)
+
+    def history(self, budget):
+        """Return the messages to send ahead of a new one: the summary, then the newest turns within budget."""
+        with self.lock:
+            summary, turns = self.summary, list(self.turns)
+        messages = []
+        if summary:
+            messages.append({"role": "system", "content": f"Summary of the conversation so far:\n{summary}"})
+            budget -= message_tokens(messages[0])
+        # walk back from the newest (user, assistant) pair, keeping whole pairs
+        start = len(turns)
+        while start >= 2:
+            pair_tokens = message_tokens(turns[start - 2]) + message_tokens(turns[start - 1])
+            if pair_tokens > budget:
+                break
+            budget -= pair_tokens
+            start -= 2
+        return messages + turns[start:]
+
+
+class ConversationStore:
+    """In-memory LRU of conversations, persisted to Mongo in the background."""
+
+    def __init__(self, capacity=1000, budget=2000, summary_model="gpt-4o-mini", ttl=30 * 24 * 3600,
+                 load_timeout=0.25, mongo_timeout=1.0, retry_seconds=30, collection=None):
+        self.capacity = capacity
+        self.budget = budget
+        self.summary_model = summary_model
+        self.ttl = ttl
+        self.load_timeout = load_timeout
+        self.mongo_timeout = mongo_timeout
+        self.retry_seconds = retry_seconds
+        self._collection = collection
+        self._client = None
+        self._index_started = False
+        # monotonic time before which loads are skipped, after one failed
+        self._unavailable_until = 0.0
+        self._conversations = OrderedDict()
+        self._lock = threading.Lock()
+        self._loader = concurrent.futures.ThreadPoolExecutor(4, thread_name_prefix="conversation-load")
+        # one thread each: saves stay in order, and a slow summary never holds up a save;
+        # both finish their pending work at interpreter exit, before the Mongo client is closed
+        self._saver = concurrent.futures.ThreadPoolExecutor(1, thread_name_prefix="conversation-save")
+        self._summarizer = concurrent.futures.ThreadPoolExecutor(1, thread_name_prefix="conversation-summary")
+
+    def collection(self):
+        if self._collection is None:
+            with self._lock:
+                if self._collection is None:
+                    # a client of its own, so a Mongo outage costs a chat mongo_timeout rather than pymongo's 30s
+                    timeout_ms = int(self.mongo_timeout * 1000)
+                    self._client = new_mongo_client(serverSelectionTimeoutMS=timeout_ms, connectTimeoutMS=timeout_ms)
+                    atexit.register(self._client.close)
+                    self._collection = self._client[DATABASE][COLLECTION]
+        return self._collection
+
+    def ensure_index(self):
+        # idle conversations expire from Mongo
+        self.collection().create_index("updated_at", name="updated_at_ttl", expireAfterSeconds=int(self.ttl))
+
+    def ensure_index_in_background(self):
+        """ensure_index() once, on a daemon thread, so startup does not wait on (or fail without) Mongo."""
+        with self._lock:
+            if self._index_started:
+                return
+            self._index_started = True
+
+        def run():
+            try:
+                self.ensure_index()
+            except Exception as e:
+                print(f"Could not create the conversation TTL index: {e}")
+
+        threading.Thread(target=run, name="conversation-index", daemon=True).start()
+
+    def get(self, interaction_id):
+        """Return the conversation, waiting up to load_timeout for its stored history."""
+        conversation = self._lookup(interaction_id)
+        conversation.loaded.wait(self.load_timeout)
+        return conversation
+
+    async def asy_get(self, interaction_id):
+        """get() for event loop callers: only waits (on a worker thread) while stored history is loading."""
+        conversation = self._lookup(interaction_id)
+        if not conversation.loaded.is_set():
+            await asyncio.to_thread(conversation.loaded.wait, self.load_timeout)
+        return conversation
+
+    def history(self, interaction_id):
+        return self.get(interaction_id).history(self.budget)
+
+    async def asy_history(self, interaction_id):
+        return (await self.asy_get(interaction_id)).history(self.budget)
+
+    def record(self, interaction_id, user_text, reply):
+        """Append a turn; saving it and any summarizing it calls for happen in the background."""
+        # if it was evicted since its history was read, it is loaded again and the turn goes after the stored ones
+        self._append(self._lookup(interaction_id), user_text, reply)
+
+    def _append(self, conversation, user_text, reply):
+        with conversation.lock:
+            conversation.turns.append({"role": "user", "content": user_text})
+            conversation.turns.append({"role": "assistant", "content": reply})
+        self._saver.submit(self._save, conversation)
+        self._maybe_summarize(conversation)
+
+    def _maybe_summarize(self, conversation):
+        with conversation.lock:
+            # not before the stored turns are merged in; _load checks again once they are
+            summarize = (conversation.stored and conversation.tokens() > self.budget
+                         and not conversation.summarizing)
+            if summarize:
+                conversation.summarizing = True
+        if summarize:
+            self._summarizer.submit(self._summarize, conversation)
+
+    def _lookup(self, interaction_id):
+        """
+        Return the conversation from memory, or start it empty and load its stored history in the background.
+
+        The empty conversation stays in memory, so a conversation Mongo does not have is looked up once.
+        """
+        with self._lock:
+            conversation = self._conversations.get(interaction_id)
+            if conversation is not None:
+                self._conversations.move_to_end(interaction_id)
+                return conversation
+            conversation = Conversation(interaction_id, loaded=False)
+            self._conversations[interaction_id] = conversation
+            while len(self._conversations) > self.capacity:
+                self._conversations.popitem(last=False)
+            skip = time.monotonic() < self._unavailable_until
+        if skip:
+            # Mongo failed recently; carry on without the stored history
+            conversation.loaded.set()
+        else:
+            self._loader.submit(self._load, conversation)
+        return conversation
+
+    def _load(self, conversation):
+        try:
+            self._merge_stored(conversation)
+        except Exception as e:
+            print(f"Error loading conversation {conversation.interaction_id}: {e}")
+            self._unavailable_until = time.monotonic() + self.retry_seconds
+        finally:
+            conversation.loaded.set()
+        self._maybe_summarize(conversation)
+
+    def _merge_stored(self, conversation):
+        """Merge the stored summary and turns ahead of any recorded since the conversation started in memory."""
+        document = self.collection().find_one({"_id": conversation.interaction_id})
+        with conversation.lock:
+            if document is not None:
+                conversation.summary = document.get("summary", "") or conversation.summary
+                conversation.turns = document.get("turns", []) + conversation.turns
+            conversation.stored = True
+
+    def _save(self, conversation):
+        conversation.loaded.wait()
+        if not conversation.stored:
+            # the load failed (or was skipped): read the stored history now, or keep the turns in memory
+            # until a later save can, rather than replace the document with only the new turns
+            if time.monotonic() < self._unavailable_until:
+                return
+            try:
+                self._merge_stored(conversation)
+            except Exception as e:
+                print(f"Not saving conversation {conversation.interaction_id}, its history could not be read: {e}")
+                self._unavailable_until = time.monotonic() + self.retry_seconds
+                return
+            self._maybe_summarize(conversation)
+        with conversation.lock:
+            document = {
+                "summary": conversation.summary,
+                "turns": list(conversation.turns),
+                "updated_at": datetime.now(timezone.utc)
+            }
+        try:
+            self.collection().replace_one({"_id": conversation.interaction_id}, document, upsert=True)
+        except Exception as e:
+            print(f"Error saving conversation {conversation.interaction_id}: {e}")
+
+    def _summarize(self, conversation):
+        """Fold the oldest turns into the summary, keeping the newest half of the budget verbatim."""
+        try:
+            with conversation.lock:
+                summary, turns = conversation.summary, list(conversation.turns)
+            keep, kept_tokens = len(turns), 0
+            while keep >= 2:
+                pair_tokens = message_tokens(turns[keep - 2]) + message_tokens(turns[keep - 1])
+                if kept_tokens + pair_tokens > self.budget // 2:
+                    break
+                kept_tokens += pair_tokens
+                keep -= 2
+            folded = turns[:keep]
+            if not folded:
+                return
+
+            transcript = "\n".join(f"{turn['role'].capitalize()}: {turn['content']}" for turn in folded)
+            with usage_scope(endpoint="conversation-summary"):
+                completion = create_completion(
+                    model=self.summary_model,
+                    messages=[
+                        {"role": "system", "content": SUMMARY_PROMPT},
+                        {"role": "user",
+                         "content": f"Summary so far:\n{summary or '(none)'}\n\nNew turns:\n{transcript}"}
+                    ],
+                    temperature=0,
+                    max_tokens=max(64, self.budget // 4)
+                )
+            new_summary = completion.choices[0].message.content
+
+            with conversation.lock:
+                # turns recorded while the model was summarizing stay after the folded ones
+                conversation.turns = conversation.turns[len(folded):]
+                conversation.summary = new_summary
+            self._saver.submit(self._save, conversation)
+        except Exception as e:
+            print(f"Error summarizing conversation {conversation.interaction_id}: {e}")
+        finally:
+            with conversation.lock:
+                conversation.summarizing = False
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_conversation_store():
+    """Return the process-wide store, or None when CONVERSATIONS=0."""
+    global _store
+    if os.getenv("CONVERSATIONS", "1") == "0":
+        return None
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = ConversationStore(
+                    capacity=int(os.getenv("CONVERSATION_CACHE_SIZE", 1000)),
+                    budget=int(os.getenv("CONVERSATION_TOKEN_BUDGET", 2000)),
+                    summary_model=os.getenv("CONVERSATION_SUMMARY_MODEL", "gpt-4o-mini"),
+                    ttl=float(os.getenv("CONVERSATION_TTL", 30 * 24 * 3600)),
+                    load_timeout=float(os.getenv("CONVERSATION_LOAD_TIMEOUT", 0.25)),
+                    mongo_timeout=float(os.getenv("CONVERSATION_MONGO_TIMEOUT", 1.0)),
+                    retry_seconds=float(os.getenv("CONVERSATION_RETRY_SECONDS", 30))
+                )
+    return _store
@@ -0,0 +1,186 @@
+"""
+Song dataset registry.
+
+Parsing Prompt Engineering Songs.xlsx with openpyxl costs more than everything
+else an evaluation does locally, so datasets are parsed once and kept in
+memory. The first load of a workbook also writes a columnar copy (Parquet when
+pyarrow is installed, a pickle otherwise) under data/cache/, named after the
+workbook's mtime and size; later processes read that instead of the workbook.
+A dataset is reloaded when its workbook's mtime or size changes.
+
+Each Dataset holds the full DataFrame plus the lyrics and genre columns as
+NumPy string arrays, and a content hash (version) that changes whenever the
+songs do. Datasets are registered by name; "songs" is the competition dataset
+and more can be added with register() or the DATASETS setting. Workbooks
+given by path are loaded through the same cache.
+
+Settings (environment variables):
+    DATASETS           extra datasets as "name=path;name=path"
+    DATASET_CACHE_DIR  directory for the columnar copies (default data/cache)
+"""
+import os
+import re
+import hashlib
+import threading
+from collections import namedtuple
+
+import pandas as pd
+
+try:
+    import pyarrow  # noqa: F401 (needed by DataFrame.to_parquet)
+    CACHE_FORMAT = "parquet"
+except ImportError:
+    CACHE_FORMAT = "pkl"
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
+DEFAULT_CACHE_DIR = os.path.join(DATA_DIR, 'cache')
+DEFAULT_DATASET = "songs"
+DEFAULT_DATASET_PATH = os.path.join(DATA_DIR, 'Prompt Engineering Songs.xlsx')
+
+LYRICS_COLUMN = "Lyrics (4-8 lines, 50-100 words)"
+GENRE_COLUMN = "Genre"
+REQUIRED_COLUMNS = [LYRICS_COLUMN, GENRE_COLUMN]
+
+# frame is shared between callers and must not be modified
+Dataset = namedtuple('Dataset', ['name', 'path', 'frame', 'lyrics', 'genres', 'version', 'mtime_ns', 'size'])
+
+
+class DatasetError(ValueError):
+    """Raised when a dataset is unknown, missing or lacks the required columns."""
+
+
+def _read_workbook(path):
+    df = pd.read_excel(path) if path.endswith(('.xlsx', '.xls')) else pd.read_csv(path)
+    for column in REQUIRED_COLUMNS:
+        if column not in df.columns:
+            raise DatasetError(f"Required column '{column}' not found in the Excel file")
+    return df
+
+
+def _content_version(lyrics, genres):
+    digest = hashlib.sha256()
+    for lyric, genre in zip(lyrics, genres):
+        digest.update(f"{lyric}\x1f{genre}\x1e".encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+
+def frame_version(df):
+    """Content hash of a song DataFrame, equal to Dataset.version for the same songs."""
+    return _content_version(df[LYRICS_COLUMN].fillna("").astype(str), df[GENRE_COLUMN].fillna("").astype(str))
+
+
+class DatasetRegistry:
+    """Named song datasets, loaded once and refreshed when their file changes."""
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR):
+        self.cache_dir = cache_dir
+        self._paths = {}
+        self._loaded = {}
+        self._lock = threading.Lock()
+
+    def register(self, name, path):
+        """Register (or re-point) a dataset name; it is loaded on first use."""
+        with self._lock:
+            self._paths[name] = os.path.abspath(path)
+            self._loaded.pop(name, None)
+
+    def names(self):
+        return sorted(self._paths)
+
+    def get(self, name=DEFAULT_DATASET):
+        """
+        Return a registered dataset, reloading it if its file changed.
+
+        Raises:
+            DatasetError: If the name is unknown or the file is missing or invalid
+        """
+        path = self._paths.get(name)
+        if path is None:
+            raise DatasetError(f"Unknown dataset '{name}'")
+        return self._load(name, path)
+
+    def load_path(self, path):
+        """Return the dataset stored at path, through the same memory and file cache."""
+        path = os.path.abspath(path)
+        return self._load(path, path)
+
+    def preload(self):
+        """Load every registered dataset now instead of on the first submission."""
+        for name in self.names():
+            try:
+                dataset = self.get(name)
+                print(f"Loaded dataset '{name}': {len(dataset.frame)} songs (version {dataset.version})")
+            except DatasetError as e:
+                print(f"Could not load dataset '{name}': {e}")
+
+    def _load(self, key, path):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            raise DatasetError(f"File not found: {path}")
+        dataset = self._loaded.get(key)
+        if dataset is not None and (dataset.mtime_ns, dataset.size) == (stat.st_mtime_ns, stat.st_size):
+            return dataset
+
+        with self._lock:
+            dataset = self._loaded.get(key)
+            if dataset is None or (dataset.mtime_ns, dataset.size) != (stat.st_mtime_ns, stat.st_size):
+                frame = self._read_cached(path, stat)
+                lyrics = frame[LYRICS_COLUMN].fillna("").astype(str).to_numpy(dtype=str)
+                genres = frame[GENRE_COLUMN].fillna("").astype(str).to_numpy(dtype=str)
+                dataset = self._loaded[key] = Dataset(
+                    name=key, path=path, frame=frame, lyrics=lyrics, genres=genres,
+                    version=_content_version(lyrics, genres), mtime_ns=stat.st_mtime_ns, size=stat.st_size
+                )
+        return dataset
+
+    def _cache_path(self, path, stat):
+        stem = re.sub(r"[^A-Za-z0-9_-]+", "_", os.path.splitext(os.path.basename(path))[0])
+        source = hashlib.sha1(path.encode("utf-8")).hexdigest()[:8]
+        return os.path.join(self.cache_dir, f"{stem}-{source}-{stat.st_mtime_ns}-{stat.st_size}.{CACHE_FORMAT}")
+
+    def _read_cached(self, path, stat):
+        cache_path = self._cache_path(path, stat)
+        if os.path.exists(cache_path):
+            try:
+                return pd.read_parquet(cache_path) if CACHE_FORMAT == "parquet" else pd.read_pickle(cache_path)
+            except Exception as e:
+                print(f"Ignoring unreadable dataset cache {cache_path}: {e}")
+
+        frame = _read_workbook(path)
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            # drop copies of older versions of the same workbook
+            prefix = cache_path.rsplit("-", 2)[0] + "-"
+            for name in os.listdir(self.cache_dir):
+                stale = os.path.join(self.cache_dir, name)
+                if stale.startswith(prefix) and stale != cache_path:
+                    os.remove(stale)
+            temp_path = f"{cache_path}.{os.getpid()}.tmp"
+            if CACHE_FORMAT == "parquet":
+                frame.to_parquet(temp_path, index=False)
+            else:
+                frame.to_pickle(temp_path)
+            os.replace(temp_path, cache_path)
+        except Exception as e:
+            print(f"Could not write dataset cache {cache_path}: {e}")
+        return frame
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_dataset_registry():
+    """Return the process-wide registry with "songs" and any DATASETS entries registered."""
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                registry = DatasetRegistry(os.getenv("DATASET_CACHE_DIR", DEFAULT_CACHE_DIR))
+                registry.register(DEFAULT_DATASET, DEFAULT_DATASET_PATH)
+                for entry in filter(None, os.getenv("DATASETS", "").split(";")):
+                    name, _, path = entry.partition("=")
+                    registry.register(name.strip(), path.strip())
+                _registry = registry
+    return _registry
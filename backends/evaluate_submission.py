@@ -1,56 +1,224 @@
 import os
+import json
+import math
+import uuid
+import asyncio
+from contextlib import aclosing
+import numpy as np
 import pandas as pd
 import re
 import sys
-from openai import OpenAI
 from dotenv import load_dotenv
-from difflib import SequenceMatcher
+from clients import run_coroutine
+from completions import asy_create_completion
+from leaderboard_store import get_leaderboard_store
+from events import broker
+from datasets import get_dataset_registry, DatasetError, LYRICS_COLUMN, GENRE_COLUMN
+from scoring import is_correct_genre, match_genres
+from checkpoints import open_checkpoint
+from evaluation_archive import get_evaluation_archive
+from metrics import span, timed
+from rate_limiter import estimate_tokens
+from usage import enter_scope, exit_scope, asy_reserve_quota, QuotaExceededError
 
-def evaluate_song_file(file_path, team_name, prompt):
+# Model used for submissions
+MODEL = "gpt-4o-mini"
+# Number of songs classified in parallel; override with EVALUATION_CONCURRENCY
+DEFAULT_CONCURRENCY = 20
+# Songs packed into one request in "batch" mode; override with EVALUATION_BATCH_SIZE
+DEFAULT_BATCH_SIZE = 10
+# Songs shown in the feedback table
+PREVIEW_SONGS = 5
+# Songs are stored in the evaluation archive this many at a time
+FLUSH_EVERY = 10
+# Progressive mode: songs per genre scored first (EVALUATION_SAMPLE_PER_GENRE), and the
+# evaluation stops there if the 95% interval on accuracy is at most EVALUATION_CI_WIDTH
+# wide, or if even its upper bound is below EVALUATION_HOPELESS_ACCURACY
+DEFAULT_SAMPLE_PER_GENRE = 8
+DEFAULT_CI_WIDTH = 0.15
+DEFAULT_HOPELESS_ACCURACY = 0.25
+# Tokens expected in a reply per song, for the quota estimate of a submission
+REPLY_TOKENS_PER_SONG = 8
+# How a single-song request is laid out (see song_messages); override with EVALUATION_LAYOUT
+LAYOUTS = ("lyrics_first", "prompt_first", "system")
+DEFAULT_LAYOUT = "lyrics_first"
+
+BATCH_INSTRUCTIONS = (
+    "Apply the instructions above to each song below separately, as if it were the only song. "
+    'Respond with a JSON object of the form {"predictions": [{"id": <song number>, "genre": "<answer>"}]} '
+    "with exactly one entry per song, where <answer> is what you would have replied for that song alone."
+)
+
+def evaluate_song_file(file_path, team_name, prompt, submission_id=None, mode="single", batch_size=None, dataset=None,
+                       progressive=False, layout=None):
     """
     Evaluates a song data Excel file based on user prompt and calculates a score.
+    The songs come from the registered dataset named `dataset` if given,
+    otherwise from file_path; both are parsed once and then served from memory.
+    If submission_id is given, per-song progress is published to the
+    "submission:<submission_id>" event topic. mode="batch" classifies
+    batch_size songs per request (see evaluate_song_genres).
+    With progressive=True a stratified sample is scored first; if that already
+    settles the accuracy (see progressive_decision) the result is returned as
+    a quick estimate and not recorded on the leaderboard, otherwise the
+    remaining songs are scored as usual.
+    Predictions are checkpointed per song, so if the evaluation is interrupted
+    the next submission of the same prompt resumes where it stopped.
+    The submission is admitted only if the team's token quota covers an
+    estimate of it (see usage.py); the tokens it used are in result["usage"].
+    layout picks how each single-song request is built (see song_messages).
+    """
+    return run_coroutine(asy_evaluate_song_file(file_path, team_name, prompt, submission_id=submission_id, mode=mode,
+                                                batch_size=batch_size, dataset=dataset, progressive=progressive,
+                                                layout=layout))
+
+@timed("evaluate_song_file")
+async def asy_evaluate_song_file(file_path, team_name, prompt, submission_id=None, mode="single", batch_size=None,
+                                 dataset=None, progressive=False, layout=None):
+    """
+    Async version of evaluate_song_file for callers already on an event loop (asgi.py).
+    Blocking steps (parsing a new workbook, the leaderboard write) run on a worker thread.
     """
     load_dotenv()  # Load environment variables from .env file
+    # Model calls are billed to the team and this submission; one without an id gets one for the usage report
+    scope = enter_scope(endpoint="/api/evaluate-songs", team=team_name, submission_id=submission_id or uuid.uuid4().hex)
+    reservation = None
+    layout = layout or os.getenv("EVALUATION_LAYOUT", DEFAULT_LAYOUT)
     
     try:
-        # Check if file exists
-        if not os.path.exists(file_path):
-            return {"error": f"File not found: {file_path}", "status": "error"}
-            
-        # Read the Excel file
-        df = pd.read_excel(file_path)
+        # Look up the dataset (checks the file exists and has the required columns)
+        try:
+            registry = get_dataset_registry()
+            if dataset:
+                data = await asyncio.to_thread(registry.get, dataset)
+            else:
+                data = await asyncio.to_thread(registry.load_path, file_path)
+        except DatasetError as e:
+            return publish_failure(submission_id, {"error": str(e), "status": "error"})
+        df = data.frame
+        if mode == "batch":
+            batch_size = batch_size or int(os.getenv("EVALUATION_BATCH_SIZE", DEFAULT_BATCH_SIZE))
+        checkpoint = await asyncio.to_thread(open_checkpoint, team_name, prompt, data.version, MODEL, layout, mode,
+                                             batch_size)
+        # Songs the checkpoint already holds are scored without a model call, so they cost no quota
+        completed = await asyncio.to_thread(checkpoint.completed) if checkpoint is not None else {}
+        remaining = df[~df.index.isin(list(completed))] if completed else df
+        try:
+            reservation = await asy_reserve_quota(
+                team_name, evaluation_token_estimate(remaining, prompt, mode, batch_size, layout))
+        except QuotaExceededError as e:
+            return publish_failure(submission_id, {"error": str(e), "status": "error", "quota": e.details})
+        
+        # Row positions scored in each stage; None means the whole dataset
+        stages = [None]
+        if progressive:
+            sample = stratified_sample(df, int(os.getenv("EVALUATION_SAMPLE_PER_GENRE", DEFAULT_SAMPLE_PER_GENRE)))
+            sampled = set(sample)
+            stages = [sample, [position for position in range(len(df)) if position not in sampled]]
+        
+        # Score songs as their completions arrive; each one goes to the evaluation
+        # archive right away, so only the feedback preview is kept in memory
+        on_result = progress_publisher(submission_id, len(df)) if submission_id else None
+        tally = RunningTally(len(df))
+        preview = {}
+        estimate = None
+        async with EvaluationWriter(team_name, prompt, model=MODEL, layout=layout, mode=mode,
+                                    dataset_version=data.version, submission_id=scope.submission_id) as writer:
+            for stage in stages:
+                if stage is not None and not stage:
+                    continue
+                stage_df = df if stage is None else df.iloc[stage]
+                # aclosing cancels the in-flight requests if the evaluation fails midway
+                song_results = asy_iter_song_results(stage_df, prompt, model=MODEL, mode=mode, batch_size=batch_size,
+                                                     checkpoint=checkpoint, layout=layout)
+                async with aclosing(song_results):
+                    async for position, song_result in song_results:
+                        position = position if stage is None else stage[position]
+                        tally.add(song_result)
+                        await writer.write(position, song_result)
+                        # keep the first PREVIEW_SONGS songs (by dataset position) for the feedback table
+                        preview[position] = song_result
+                        if len(preview) > PREVIEW_SONGS:
+                            del preview[max(preview)]
+                        if on_result is not None:
+                            on_result(position, song_result)
+                if progressive and estimate is None:
+                    estimate = progressive_decision(tally.correct_count, tally.completed, len(df))
+                    if estimate["stopped"]:
+                        break
+            await writer.finish(tally, estimate if estimate and estimate["stopped"] else None)
+        is_estimate = bool(estimate and estimate["stopped"])
+        evaluation_results = {**tally.summary(scored_only=is_estimate),
+                              "results": [preview[position] for position in sorted(preview)],
+                              "positions": sorted(preview)}
         
-        # Check if required columns exist
-        required_columns = ["Lyrics (4-8 lines, 50-100 words)", "Genre"]
-        for col in required_columns:
-            if col not in df.columns:
-                return {"error": f"Required column '{col}' not found in the Excel file", "status": "error"}
+        # Save results to leaderboard (quick estimates are not recorded)
+        if not is_estimate:
+            await asyncio.to_thread(get_leaderboard_store().upsert_score, team_name, evaluation_results['score'])
+            # nothing is left to resume unless some songs failed
+            if checkpoint is not None and tally.errors == 0:
+                await asyncio.to_thread(checkpoint.clear)
         
-        # Use song genre evaluation function
-        evaluation_results = evaluate_song_genres(df, prompt)
+        result = evaluation_report(team_name, prompt, evaluation_results, estimate if is_estimate else None)
+        if progressive:
+            result["estimate"] = is_estimate
+            result["sample"] = estimate
+        result["layout"] = layout
+        # the archived submission, for GET /api/evaluations/<id> and diffs
+        result["evaluation_id"] = writer.id
+        result["usage"] = scope.totals()
+        if submission_id:
+            broker.publish(f"submission:{submission_id}", "done", {
+                "score": result['score'], "correct": result['correct'], "total": result['total'],
+                "estimate": is_estimate
+            }, close=True)
+        return result
         
-        # Generate detailed feedback
-        feedback = f"""# Prompt Engineering Score: {evaluation_results['score']}/100
+    except Exception as e:
+        import traceback
+        error_details = traceback.format_exc()
+        print(f"Error evaluating file: {str(e)}")
+        print(error_details)
+        return publish_failure(submission_id, {"error": str(e), "details": error_details, "status": "error"})
+    finally:
+        if reservation is not None:
+            reservation.release()
+        exit_scope(scope)
+
+def evaluation_report(team_name, prompt, evaluation_results, estimate=None):
+    """
+    Build the evaluate_song_file result (score and markdown feedback) from evaluate_song_genres output.
+    estimate is the progressive_decision() of a run that stopped after its sample.
+    """
+    # Generate detailed feedback
+    feedback = f"""# Prompt Engineering Score: {evaluation_results['score']}/100{' (quick estimate)' if estimate else ''}
 
 ## Summary
 - **Correct Classifications**: {evaluation_results['correct_count']}/{evaluation_results['total_count']}
 - **Accuracy**: {evaluation_results['score']}%
 - **Prompt Used**: "{prompt}"
-
+"""
+    if estimate:
+        feedback += f"""- **Quick Estimate**: scored on a sample of {estimate['sampled']} of {estimate['dataset_songs']} songs; \
+95% confidence interval {estimate['low']}-{estimate['high']}% ({estimate['reason']}). \
+Run the full evaluation to record a leaderboard score.
+"""
+    feedback += """
 ## Detailed Results
 
 | Song | Expected Genre | Predicted Genre | Result |
 |------|---------------|----------------|--------|
 """
+    
+    # Add first 5 results to feedback table
+    positions = evaluation_results.get('positions') or range(PREVIEW_SONGS)
+    for position, result in zip(positions, evaluation_results['results'][:PREVIEW_SONGS]):
+        feedback += f"| {position+1} | {result['Expected Genre']} | {result['Predicted Genre']} | {'✓' if result['Correct'] else '✗'} |\n"
+    
+    if evaluation_results['total_count'] > PREVIEW_SONGS:
+        feedback += f"\n*...and {evaluation_results['total_count']-PREVIEW_SONGS} more songs*\n"
         
-        # Add first 5 results to feedback table
-        for i, result in enumerate(evaluation_results['results'][:5]):
-            feedback += f"| {i+1} | {result['Expected Genre']} | {result['Predicted Genre']} | {'✓' if result['Correct'] else '✗'} |\n"
-        
-        if len(evaluation_results['results']) > 5:
-            feedback += f"\n*...and {len(evaluation_results['results'])-5} more songs*\n"
-            
-        feedback += f"""
+    feedback += f"""
 ## Analysis
 
 Your prompt: "{prompt}"
@@ -63,148 +231,432 @@ Your prompt: "{prompt}"
 - {'Consider being more specific about musical elements and lyrical patterns' if evaluation_results['score'] < 90 else 'Minor refinements could achieve perfect accuracy'}
 - {'Focus on distinguishing between similar genres' if evaluation_results['score'] < 80 else 'Your approach effectively distinguishes between genres'}
 """
-        
-        # Save results to leaderboard
-        data_dir = os.path.join(os.path.dirname(__file__), 'data')
-        if not os.path.exists(data_dir):
-            os.makedirs(data_dir)
-            
-        excel_path = os.path.join(data_dir, 'leaderboard.xlsx')
-        
-        # Create or update leaderboard
-        if os.path.exists(excel_path):
-            leaderboard_df = pd.read_excel(excel_path)
-        else:
-            leaderboard_df = pd.DataFrame(columns=['name', 'score', 'last_updated'])
-        
-        # Update or add team
-        if team_name in leaderboard_df['name'].values:
-            leaderboard_df.loc[leaderboard_df['name'] == team_name, 'score'] = evaluation_results['score']
-            leaderboard_df.loc[leaderboard_df['name'] == team_name, 'last_updated'] = pd.Timestamp.now().isoformat()
-        else:
-            new_row = pd.DataFrame({
-                'name': [team_name],
-                'score': [evaluation_results['score']],
-                'last_updated': [pd.Timestamp.now().isoformat()]
-            })
-            leaderboard_df = pd.concat([leaderboard_df, new_row], ignore_index=True)
-        
-        # Sort and save leaderboard
-        leaderboard_df = leaderboard_df.sort_values(by='score', ascending=False)
-        leaderboard_df.to_excel(excel_path, index=False)
-        
-        # Save detailed evaluation
-        evaluations_dir = os.path.join(data_dir, 'evaluations')
-        if not os.path.exists(evaluations_dir):
-            os.makedirs(evaluations_dir)
-        
-        eval_file = os.path.join(evaluations_dir, f"{team_name}_{pd.Timestamp.now().strftime('%Y%m%d_%H%M%S')}.txt")
-        with open(eval_file, 'w') as f:
-            f.write(f"Team: {team_name}\n")
-            f.write(f"Score: {evaluation_results['score']}/100\n")
-            f.write(f"Correct: {evaluation_results['correct_count']}/{evaluation_results['total_count']}\n")
-            f.write(f"Prompt: {prompt}\n\n")
-            f.write("Detailed Results:\n\n")
-            
-            for i, result in enumerate(evaluation_results['results']):
-                f.write(f"Song {i+1}:\n")
-                f.write(f"Lyrics: {result['Lyrics'][:100]}...\n")
-                f.write(f"Expected Genre: {result['Expected Genre']}\n")
-                f.write(f"Predicted Genre: {result['Predicted Genre']}\n")
-                f.write(f"Correct: {'Yes' if result['Correct'] else 'No'}\n\n")
-        
-        return {
-            "team": team_name,
-            "score": evaluation_results['score'],
-            "feedback": feedback,
-            "correct": evaluation_results['correct_count'],
-            "total": evaluation_results['total_count'],
-            "status": "success"
-        }
-        
-    except Exception as e:
-        import traceback
-        error_details = traceback.format_exc()
-        print(f"Error evaluating file: {str(e)}")
-        print(error_details)
-        return {"error": str(e), "details": error_details, "status": "error"}
 
-def calculate_similarity(a, b):
-    """Calculate string similarity using SequenceMatcher."""
-    return SequenceMatcher(None, a.lower(), b.lower()).ratio()
+    return {
+        "team": team_name,
+        "score": evaluation_results['score'],
+        "feedback": feedback,
+        "correct": evaluation_results['correct_count'],
+        "total": evaluation_results['total_count'],
+        "status": "success"
+    }
 
-def is_correct_genre(expected, predicted, match_method="contains"):
-    """Check if the predicted genre matches the expected genre."""
-    expected = expected.lower().strip()
-    predicted = predicted.lower().strip()
-    
-    if match_method == "exact":
-        return expected == predicted
-    elif match_method == "contains":
-        return expected in predicted or predicted in expected
-    elif match_method == "fuzzy":
-        # Consider it a match if similarity is at least 0.8
-        return calculate_similarity(expected, predicted) >= 0.8
-    else:
-        return False
-
-def evaluate_song_genres(df, prompt, model="gpt-4o-mini"):
-    """Evaluate each song in the dataset using the provided prompt."""
-    results = []
-    correct_count = 0
-    total_count = len(df)
-    client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-    
-    for idx, row in df.iterrows():
-        lyrics = row["Lyrics (4-8 lines, 50-100 words)"]
-        expected_genre = row["Genre"]
-        
-        # Combine lyrics with the user prompt
-        combined_text = f"{lyrics}\n\n{prompt}"
-        
+class RunningTally:
+    """Correct/completed/failed counts of an evaluation in progress."""
+
+    def __init__(self, total_count):
+        self.total_count = total_count
+        self.completed = 0
+        self.correct_count = 0
+        self.errors = 0
+
+    def add(self, result):
+        self.completed += 1
+        if result["Correct"]:
+            self.correct_count += 1
+        elif result["Predicted Genre"] == "ERROR":
+            self.errors += 1
+
+    @property
+    def score(self):
+        return int((self.correct_count / self.total_count) * 100) if self.total_count > 0 else 0
+
+    def summary(self, scored_only=False):
+        """Score over the whole dataset, or with scored_only over the songs scored so far."""
+        if scored_only:
+            score = int((self.correct_count / self.completed) * 100) if self.completed > 0 else 0
+            return {"score": score, "correct_count": self.correct_count, "total_count": self.completed}
+        return {"score": self.score, "correct_count": self.correct_count, "total_count": self.total_count}
+
+class EvaluationWriter:
+    """
+    Record an evaluation in the archive (see evaluation_archive.py) while it runs.
+    The submission is added as "running" with its team and prompt, songs are
+    stored every FLUSH_EVERY songs, then the score and status. A run that raises
+    ends "incomplete" with the error; one that dies keeps every stored song.
+    Used as `async with`: every archive write runs on a worker thread, off the event loop.
+    """
+
+    def __init__(self, team_name, prompt, archive=None, **fields):
+        self.archive = archive or get_evaluation_archive()
+        self.team_name = team_name
+        self.prompt = prompt
+        self.fields = fields
+        self.id = None
+        self._pending = []
+        self._written = 0
+
+    async def write(self, position, result):
+        self._pending.append((position, result['Expected Genre'], result['Predicted Genre'], result['Correct']))
+        self._written += 1
+        if len(self._pending) >= FLUSH_EVERY:
+            await self.flush()
+
+    async def flush(self):
+        pending, self._pending = self._pending, []
+        await asyncio.to_thread(self.archive.add_results, self.id, pending)
+
+    async def finish(self, tally, estimate=None):
+        await self.flush()
+        summary = tally.summary(scored_only=estimate is not None)
+        await asyncio.to_thread(self.archive.finish, self.id, "complete" if estimate is None else "estimate",
+                                score=summary['score'], correct=summary['correct_count'],
+                                total=summary['total_count'], details={"estimate": estimate} if estimate else None)
+
+    async def __aenter__(self):
+        self.id = await asyncio.to_thread(self.archive.start, self.team_name, prompt=self.prompt, **self.fields)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            return
+        # keep the songs scored so far; the original error is what the caller sees
         try:
-            # Call OpenAI API
-            completion = client.chat.completions.create(
-                model=model,
-                messages=[{"role": "user", "content": combined_text}],
-                temperature=0.0
-            )
-            
-            # Extract the predicted genre
-            predicted_genre = completion.choices[0].message.content.strip()
-            
-            # Check if prediction is correct (using contains method by default)
-            is_correct = is_correct_genre(expected_genre, predicted_genre, "contains")
-            if is_correct:
-                correct_count += 1
-                
-            # Store result
-            results.append({
-                "Lyrics": lyrics,
-                "Expected Genre": expected_genre,
-                "Predicted Genre": predicted_genre,
-                "Correct": is_correct
-            })
-            
+            await self.flush()
+            await asyncio.to_thread(self.archive.finish, self.id, "incomplete",
+                                    details={"songs": self._written, "error": f"{exc_type.__name__}: {exc}"})
         except Exception as e:
-            print(f"Error processing song {idx+1}: {e}")
-            results.append({
-                "Lyrics": lyrics,
-                "Expected Genre": expected_genre,
-                "Predicted Genre": "ERROR",
-                "Correct": False
-            })
-    
+            print(f"Could not record incomplete evaluation {self.id}: {e}")
+
+def stratified_sample(df, per_genre, seed=0):
+    """
+    Return the row positions of up to per_genre songs of each genre, in dataset order.
+    The fixed seed keeps the sample the same between submissions, so prompts are
+    compared on the same songs and a later full run reuses the cached completions.
+    """
+    rng = np.random.default_rng(seed)
+    positions = pd.Series(np.arange(len(df)))
+    sample = []
+    for _, group in positions.groupby(df[GENRE_COLUMN].to_numpy()):
+        sample.extend(rng.choice(group.to_numpy(), size=min(per_genre, len(group)), replace=False).tolist())
+    return sorted(sample)
+
+def wilson_interval(correct, total, z=1.96):
+    """Wilson score interval (low, high) for a proportion; z=1.96 gives 95% confidence."""
+    if total == 0:
+        return 0.0, 1.0
+    p = correct / total
+    denominator = 1 + z * z / total
+    centre = (p + z * z / (2 * total)) / denominator
+    margin = z * math.sqrt(p * (1 - p) / total + z * z / (4 * total * total)) / denominator
+    return max(0.0, centre - margin), min(1.0, centre + margin)
+
+def progressive_decision(correct, scored, dataset_songs):
+    """
+    Decide whether a progressive evaluation can stop after its sample.
+
+    Returns:
+        dict: sampled, dataset_songs, low and high (95% interval, in percent),
+              stopped and reason ("interval is tight", "score is hopeless" or None)
+    """
+    low, high = wilson_interval(correct, scored)
+    max_width = float(os.getenv("EVALUATION_CI_WIDTH", DEFAULT_CI_WIDTH))
+    hopeless = float(os.getenv("EVALUATION_HOPELESS_ACCURACY", DEFAULT_HOPELESS_ACCURACY))
+    reason = None
+    if high < hopeless:
+        reason = "score is hopeless"
+    elif high - low <= max_width:
+        reason = "interval is tight"
+    return {
+        "sampled": scored,
+        "dataset_songs": dataset_songs,
+        "low": round(low * 100),
+        "high": round(high * 100),
+        "stopped": reason is not None and scored < dataset_songs,
+        "reason": reason
+    }
+
+def evaluation_token_estimate(df, prompt, mode="single", batch_size=None, layout=DEFAULT_LAYOUT):
+    """Estimate the tokens an evaluation of df will use, counted as the rate limiter counts them."""
+    lyrics = [lyrics for _, lyrics, _ in iter_song_rows(df)]
+    if mode == "batch":
+        size = batch_size or int(os.getenv("EVALUATION_BATCH_SIZE", DEFAULT_BATCH_SIZE))
+        return sum(estimate_tokens(build_batch_messages(prompt, lyrics[start:start + size]),
+                                   max_tokens=REPLY_TOKENS_PER_SONG * len(lyrics[start:start + size]))
+                   for start in range(0, len(lyrics), size))
+    return sum(estimate_tokens(song_messages(song, prompt, layout), max_tokens=REPLY_TOKENS_PER_SONG)
+               for song in lyrics)
+
+def publish_failure(submission_id, error_result):
+    """Close a submission's progress stream with a "failed" event and pass the error result through."""
+    if submission_id:
+        broker.publish(f"submission:{submission_id}", "failed", {"error": error_result["error"]}, close=True)
+    return error_result
+
+def progress_publisher(submission_id, total_count):
+    """Return an on_result callback that publishes each song's prediction for a submission."""
+    topic = f"submission:{submission_id}"
+    tally = RunningTally(total_count)
+
+    def on_result(position, result):
+        tally.add(result)
+        broker.publish(topic, "song", {
+            "song": position + 1,
+            "expected": result["Expected Genre"],
+            "predicted": result["Predicted Genre"],
+            "correct": result["Correct"],
+            "completed": tally.completed,
+            "correct_so_far": tally.correct_count,
+            "total": total_count
+        })
+
+    return on_result
+
+def evaluate_song_genres(df, prompt, model="gpt-4o-mini", concurrency=None, on_result=None, mode="single",
+                         batch_size=None, checkpoint=None, layout=DEFAULT_LAYOUT):
+    """
+    Evaluate each song in the dataset using the provided prompt.
+    mode="single" sends one request per song; mode="batch" packs batch_size
+    songs into one request and falls back to per-song requests for any song
+    whose prediction is missing from the reply. With a checkpoint (see
+    checkpoints.open_checkpoint) songs it already holds are not re-classified
+    and new predictions are stored as they arrive. layout applies to the
+    single-song requests (see song_messages).
+    """
+    return run_coroutine(asy_evaluate_song_genres(df, prompt, model=model, concurrency=concurrency,
+                                                  on_result=on_result, mode=mode, batch_size=batch_size,
+                                                  checkpoint=checkpoint, layout=layout))
+
+def iter_song_rows(df):
+    """Yield (idx, lyrics, expected_genre) for each song without copying the dataset."""
+    return zip(df.index, df[LYRICS_COLUMN], df[GENRE_COLUMN])
+
+def song_rows(df):
+    """Return the dataset as [(idx, lyrics, expected_genre)]."""
+    return list(iter_song_rows(df))
+
+def song_messages(lyrics, prompt, layout=DEFAULT_LAYOUT):
+    """
+    Chat messages for classifying one song.
+    "lyrics_first" (the original layout) sends the lyrics followed by the team's prompt.
+    "prompt_first" and "system" put the prompt, which is the same for every song of a
+    submission, ahead of the lyrics, as a leading block or a system message; a provider
+    that caches prompt prefixes then bills and processes it once rather than 200 times.
+    """
+    if layout == "prompt_first":
+        return [{"role": "user", "content": f"{prompt}\n\n### Lyrics\n{lyrics}"}]
+    if layout == "system":
+        return [{"role": "system", "content": prompt}, {"role": "user", "content": lyrics}]
+    if layout != "lyrics_first":
+        raise ValueError(f"Unknown message layout '{layout}' (expected one of {', '.join(LAYOUTS)})")
+    return [{"role": "user", "content": f"{lyrics}\n\n{prompt}"}]
+
+def score_song(lyrics, expected_genre, predicted_genre):
+    """Build one song's result row; ERROR predictions are never correct."""
+    return {
+        "Lyrics": lyrics,
+        "Expected Genre": expected_genre,
+        "Predicted Genre": predicted_genre,
+        # Check if prediction is correct (using contains method by default)
+        "Correct": predicted_genre != "ERROR" and is_correct_genre(expected_genre, predicted_genre, "contains")
+    }
+
+def score_songs(songs, predictions):
+    """score_song for many songs at once: songs is [(idx, lyrics, expected_genre)], predictions a list of genres."""
+    expected = [expected_genre for _, _, expected_genre in songs]
+    correct = match_genres(expected, predictions, "contains")
+    return [{
+        "Lyrics": lyrics,
+        "Expected Genre": expected_genre,
+        "Predicted Genre": predicted_genre,
+        "Correct": predicted_genre != "ERROR" and bool(is_correct)
+    } for (_, lyrics, expected_genre), predicted_genre, is_correct in zip(songs, predictions, correct)]
+
+def summarize_results(results):
+    """Wrap per-song results with the correct count and the integer percentage score."""
+    correct_count = sum(1 for result in results if result["Correct"])
+    total_count = len(results)
+
     # Calculate score
     score = int((correct_count / total_count) * 100) if total_count > 0 else 0
-    
+
     return {
-        "results": results,
+        "results": list(results),
         "score": score,
         "correct_count": correct_count,
         "total_count": total_count
     }
 
+async def asy_classify_song(semaphore, idx, lyrics, expected_genre, prompt, model, layout=DEFAULT_LAYOUT):
+    """Classify a single song, waiting on the semaphore before calling the API."""
+    async with semaphore:
+        try:
+            # Call OpenAI API (repeated requests are served from the completion cache)
+            with span("evaluate_song"):
+                completion = await asy_create_completion(
+                    model=model,
+                    messages=song_messages(lyrics, prompt, layout),
+                    temperature=0.0
+                )
+
+            # Extract the predicted genre
+            predicted_genre = completion.choices[0].message.content.strip()
+
+        except Exception as e:
+            print(f"Error processing song {idx+1}: {e}")
+            predicted_genre = "ERROR"
+
+    return score_song(lyrics, expected_genre, predicted_genre)
+
+def build_batch_messages(prompt, lyrics_list):
+    """Build one request asking for a JSON prediction for each of the given lyrics."""
+    songs = "\n\n".join(f"### Song {number}\n{lyrics}" for number, lyrics in enumerate(lyrics_list, 1))
+    return [{"role": "user", "content": f"{prompt}\n\n{BATCH_INSTRUCTIONS}\n\n{songs}"}]
+
+def parse_batch_predictions(text, count):
+    """
+    Parse a batch reply into {song number: predicted genre}.
+    Accepts the requested {"predictions": [...]} object, a bare list, a
+    {"1": "Pop", ...} mapping and replies wrapped in code fences or prose.
+    Songs without a usable prediction are left out.
+    """
+    text = (text or "").strip()
+    fenced = re.search(r"```(?:json)?\s*(.*?)```", text, re.DOTALL)
+    if fenced:
+        text = fenced.group(1).strip()
+    try:
+        data = json.loads(text)
+    except ValueError:
+        # fall back to the outermost JSON object or array in the reply
+        match = re.search(r"[{\[].*[}\]]", text, re.DOTALL)
+        if not match:
+            return {}
+        try:
+            data = json.loads(match.group(0))
+        except ValueError:
+            return {}
+
+    if isinstance(data, dict):
+        data = data.get("predictions", data.get("results", data))
+    if isinstance(data, dict):
+        entries = list(data.items())
+    elif isinstance(data, list):
+        entries = [(item.get("id", item.get("song", number)), item.get("genre", item.get("prediction")))
+                   if isinstance(item, dict) else (number, item)
+                   for number, item in enumerate(data, 1)]
+    else:
+        return {}
+
+    predictions = {}
+    for song_id, genre in entries:
+        try:
+            number = int(str(song_id).strip().lstrip("#").split()[-1])
+        except (ValueError, IndexError):
+            continue
+        if 1 <= number <= count and isinstance(genre, str) and genre.strip() and number not in predictions:
+            predictions[number] = genre.strip()
+    return predictions
+
+async def asy_classify_batch(semaphore, songs, prompt, model, layout=DEFAULT_LAYOUT):
+    """
+    Classify several songs with one request.
+
+    songs is a list of (idx, lyrics, expected_genre); the results come back in
+    the same order. Songs missing from the reply are classified one by one.
+    """
+    predictions = {}
+    async with semaphore:
+        try:
+            with span("evaluate_batch"):
+                completion = await asy_create_completion(
+                    model=model,
+                    messages=build_batch_messages(prompt, [lyrics for _, lyrics, _ in songs]),
+                    temperature=0.0,
+                    response_format={"type": "json_object"}
+                )
+            predictions = parse_batch_predictions(completion.choices[0].message.content, len(songs))
+        except Exception as e:
+            print(f"Error processing songs {songs[0][0]+1}-{songs[-1][0]+1} as a batch: {e}")
+
+    missing = [number for number in range(1, len(songs) + 1) if number not in predictions]
+    if missing:
+        print(f"Batch reply had no prediction for {len(missing)}/{len(songs)} songs, classifying them individually")
+    fallbacks = await asyncio.gather(*(asy_classify_song(semaphore, *songs[number - 1], prompt, model, layout)
+                                       for number in missing))
+    results = dict(zip(missing, fallbacks))
+
+    # the batch's own predictions are scored together
+    answered = [number for number in range(1, len(songs) + 1) if number not in results]
+    scored = score_songs([songs[number - 1] for number in answered], [predictions[number] for number in answered])
+    results.update(zip(answered, scored))
+    return [results[number] for number in range(1, len(songs) + 1)]
+
+async def asy_iter_song_results(df, prompt, model="gpt-4o-mini", concurrency=None, mode="single", batch_size=None,
+                                checkpoint=None, layout=DEFAULT_LAYOUT):
+    """
+    Yield (position, result) for every song as its classification completes.
+    Rows are read lazily and at most `concurrency` requests are in flight, so
+    memory does not grow with the dataset. Songs already in the checkpoint
+    (by dataset index) are scored from it first; every new prediction is
+    written to it before it is yielded.
+    """
+    if mode not in ("single", "batch"):
+        raise ValueError(f"Unknown evaluation mode '{mode}' (expected 'single' or 'batch')")
+    if concurrency is None:
+        concurrency = int(os.getenv("EVALUATION_CONCURRENCY", DEFAULT_CONCURRENCY))
+    concurrency = max(1, concurrency)
+    semaphore = asyncio.Semaphore(concurrency)
+    if mode == "batch":
+        if batch_size is None:
+            batch_size = int(os.getenv("EVALUATION_BATCH_SIZE", DEFAULT_BATCH_SIZE))
+        batch_size = max(1, batch_size)
+    else:
+        batch_size = 1
+
+    async def classify(positions, songs):
+        if mode == "batch":
+            results = await asy_classify_batch(semaphore, songs, prompt, model, layout)
+        else:
+            results = [await asy_classify_song(semaphore, *songs[0], prompt, model, layout)]
+        if checkpoint is not None:
+            # a SQLite write that may wait on the file lock, so it stays off the event loop
+            await asyncio.to_thread(checkpoint.record, [(idx, result["Predicted Genre"])
+                                                        for (idx, _, _), result in zip(songs, results)])
+        return list(zip(positions, results))
+
+    rows = enumerate(iter_song_rows(df))
+    completed = await asyncio.to_thread(checkpoint.completed) if checkpoint is not None else {}
+    if completed:
+        resumed = [(position, song) for position, song in rows if song[0] in completed]
+        for (position, _), result in zip(resumed, score_songs([song for _, song in resumed],
+                                                              [completed[song[0]] for _, song in resumed])):
+            yield position, result
+        rows = ((position, song) for position, song in enumerate(iter_song_rows(df)) if song[0] not in completed)
+    pending = set()
+    try:
+        while True:
+            # keep `concurrency` requests going, reading more rows only as slots free up
+            while len(pending) < concurrency:
+                unit = [row for _, row in zip(range(batch_size), rows)]
+                if not unit:
+                    break
+                pending.add(asyncio.ensure_future(classify([position for position, _ in unit],
+                                                           [song for _, song in unit])))
+            if not pending:
+                break
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                for item in task.result():
+                    yield item
+    finally:
+        for task in pending:
+            task.cancel()
+
+async def asy_evaluate_song_genres(df, prompt, model="gpt-4o-mini", concurrency=None, on_result=None, mode="single",
+                                   batch_size=None, checkpoint=None, layout=DEFAULT_LAYOUT):
+    """
+    Evaluate every song concurrently, at most `concurrency` requests in flight.
+    on_result(position, result) is called as each song finishes, in completion order.
+    """
+    results = [None] * len(df)
+    async for position, result in asy_iter_song_results(df, prompt, model=model, concurrency=concurrency,
+                                                        mode=mode, batch_size=batch_size, checkpoint=checkpoint,
+                                                        layout=layout):
+        results[position] = result
+        if on_result is not None:
+            on_result(position, result)
+    return summarize_results(results)
+
 if __name__ == "__main__":
     # This script can be run directly from command line
     if len(sys.argv) < 3:
@@ -222,6 +674,6 @@ if __name__ == "__main__":
         print(f"Score: {result['score']}/100")
         print("\nFeedback Summary:")
         print(result['feedback'][:300] + "..." if len(result['feedback']) > 300 else result['feedback'])
-        print(f"\nFull evaluation saved to data/evaluations/{team_name}_*.txt")
+        print(f"\nFull evaluation archived as evaluation {result['evaluation_id']} (data/evaluations.sqlite3)")
     else:
         print(f"Error: {result['error']}")
\ No newline at end of file
@@ -0,0 +1,358 @@
+"""
+Archive of every song evaluation and file analysis, in SQLite.
+
+Replaces the data/evaluations/<team>_<timestamp>.txt files. Each run is one
+row of `submissions`, indexed by team and time, by prompt and by score, and
+each scored song is one row of `results`. Rows are only added: a submission's
+row is updated once, when its run finishes, and nothing is deleted. Prompts
+and genre strings (expected genres and the models' replies, which repeat a
+lot) are stored once each and referred to by id, so a song result is five
+integers.
+
+A team's history, one submission with its songs and the song-by-song diff of
+two submissions are each answered by indexed queries (GET /api/evaluations/...
+in app.py). migrate_evaluations.py imports the old text files.
+
+Settings (environment variables):
+    EVALUATION_ARCHIVE_DB   SQLite file (default data/evaluations.sqlite3)
+"""
+import os
+import json
+import time
+import sqlite3
+import threading
+from datetime import datetime, timezone
+
+from checkpoints import prompt_hash
+from metrics import timed
+
+DEFAULT_PATH = os.path.join(os.path.dirname(__file__), 'data', 'evaluations.sqlite3')
+# kinds of submission
+SONGS = "songs"
+ANALYSIS = "analysis"
+# a running submission ends as one of complete, estimate (progressive run stopped after its sample) or incomplete
+STATUSES = ("running", "complete", "estimate", "incomplete")
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+SUBMISSION_COLUMNS = ("s.id, s.team, s.kind, s.status, s.created_at, s.finished_at, s.score, s.correct, s.total, "
+                      "p.hash, p.prompt, s.model, s.layout, s.mode, s.dataset_version, s.submission_id, s.details, "
+                      "s.source")
+
+
+class ArchiveQueryError(ValueError):
+    """Raised for a query parameter that cannot be used (bad limit or cursor)."""
+
+
+def iso_time(timestamp):
+    return datetime.fromtimestamp(timestamp, timezone.utc).isoformat(timespec="seconds") if timestamp else None
+
+
+def serialize(row):
+    (id, team, kind, status, created_at, finished_at, score, correct, total, hash, prompt, model, layout, mode,
+     dataset_version, submission_id, details, source) = row
+    return {
+        "id": id,
+        "team": team,
+        "kind": kind,
+        "status": status,
+        "created_at": iso_time(created_at),
+        "finished_at": iso_time(finished_at),
+        "score": score,
+        "correct": correct,
+        "total": total,
+        "prompt_hash": hash,
+        "prompt": prompt,
+        "model": model,
+        "layout": layout,
+        "mode": mode,
+        "dataset_version": dataset_version,
+        "submission_id": submission_id,
+        "details": json.loads(details) if details else None,
+        # the text file a migrated submission came from
+        "source": source,
+    }
+
+
+class EvaluationArchive:
+    """Submissions and their per-song results in one SQLite file."""
+
+    def __init__(self, path=DEFAULT_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        # prompt hash / label text -> id, for the ones this process has seen; ids never change once assigned
+        self._prompt_ids = {}
+        self._label_ids = {}
+
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        # autocommit mode; writes open their own BEGIN IMMEDIATE transaction
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS prompts (id INTEGER PRIMARY KEY, hash TEXT NOT NULL UNIQUE, "
+            "prompt TEXT NOT NULL)"
+        )
+        self._db.execute("CREATE TABLE IF NOT EXISTS labels (id INTEGER PRIMARY KEY, text TEXT NOT NULL UNIQUE)")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS submissions ("
+            "id INTEGER PRIMARY KEY, team TEXT NOT NULL, kind TEXT NOT NULL, status TEXT NOT NULL, "
+            "created_at REAL NOT NULL, finished_at REAL, score INTEGER, correct INTEGER, total INTEGER, "
+            "prompt_id INTEGER REFERENCES prompts (id), model TEXT, layout TEXT, mode TEXT, dataset_version TEXT, "
+            "submission_id TEXT, details TEXT, source TEXT UNIQUE)"
+        )
+        # song is the dataset row position; expected and predicted are label ids
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            "submission INTEGER NOT NULL, song INTEGER NOT NULL, expected INTEGER NOT NULL, "
+            "predicted INTEGER NOT NULL, correct INTEGER NOT NULL, PRIMARY KEY (submission, song)) WITHOUT ROWID"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS submissions_team ON submissions (team, created_at)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS submissions_prompt ON submissions (prompt_id, created_at)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS submissions_score ON submissions (score DESC)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS submissions_created ON submissions (created_at)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS submissions_submission_id ON submissions (submission_id)")
+
+    def _transaction(self, write):
+        """Run write() in an immediate transaction; the caller holds the lock."""
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            result = write()
+            self._db.execute("COMMIT")
+            return result
+        except Exception:
+            self._db.execute("ROLLBACK")
+            # ids interned by the rolled back transaction no longer exist
+            self._prompt_ids.clear()
+            self._label_ids.clear()
+            raise
+
+    def _prompt_id(self, prompt):
+        """Return the id of a prompt, storing it the first time (inside a transaction)."""
+        if prompt is None:
+            return None
+        key = prompt_hash(prompt)
+        if key not in self._prompt_ids:
+            self._db.execute("INSERT OR IGNORE INTO prompts (hash, prompt) VALUES (?, ?)", (key, prompt))
+            self._prompt_ids[key] = self._db.execute("SELECT id FROM prompts WHERE hash = ?", (key,)).fetchone()[0]
+        return self._prompt_ids[key]
+
+    def _label_id(self, text):
+        """Return the id of a genre string, storing it the first time (inside a transaction)."""
+        text = str(text)
+        if text not in self._label_ids:
+            self._db.execute("INSERT OR IGNORE INTO labels (text) VALUES (?)", (text,))
+            self._label_ids[text] = self._db.execute("SELECT id FROM labels WHERE text = ?", (text,)).fetchone()[0]
+        return self._label_ids[text]
+
+    def _insert_results(self, submission, results):
+        self._db.executemany(
+            "INSERT OR IGNORE INTO results (submission, song, expected, predicted, correct) VALUES (?, ?, ?, ?, ?)",
+            [(submission, int(song), self._label_id(expected), self._label_id(predicted), int(bool(correct)))
+             for song, expected, predicted, correct in results]
+        )
+
+    def start(self, team, kind=SONGS, prompt=None, model=None, layout=None, mode=None, dataset_version=None,
+              submission_id=None):
+        """Add a running submission and return its id."""
+        now = time.time()
+
+        def write():
+            return self._db.execute(
+                "INSERT INTO submissions (team, kind, status, created_at, prompt_id, model, layout, mode, "
+                "dataset_version, submission_id) VALUES (?, ?, 'running', ?, ?, ?, ?, ?, ?, ?)",
+                (team, kind, now, self._prompt_id(prompt), model, layout, mode, dataset_version, submission_id)
+            ).lastrowid
+
+        with self._lock:
+            return self._transaction(write)
+
+    @timed("evaluation_archive_write")
+    def add_results(self, submission, results):
+        """Store [(song position, expected genre, predicted genre, correct)] of a running submission."""
+        if not results:
+            return
+        with self._lock:
+            self._transaction(lambda: self._insert_results(submission, results))
+
+    def finish(self, submission, status, score=None, correct=None, total=None, details=None):
+        """Record how a running submission ended."""
+        if status not in STATUSES[1:]:
+            raise ValueError(f"status must be one of {', '.join(STATUSES[1:])}")
+        with self._lock:
+            self._db.execute(
+                "UPDATE submissions SET status = ?, finished_at = ?, score = ?, correct = ?, total = ?, details = ? "
+                "WHERE id = ?",
+                (status, time.time(), score, correct, total, json.dumps(details) if details else None, submission)
+            )
+
+    def record(self, team, status, kind=SONGS, created_at=None, prompt=None, score=None, correct=None, total=None,
+               details=None, results=(), source=None, **fields):
+        """
+        Add a finished submission in one go (file analyses, migrated files).
+
+        Returns:
+            int: its id, or None if a submission from the same source is already archived
+        """
+        created_at = created_at or time.time()
+        columns = ("model", "layout", "mode", "dataset_version", "submission_id")
+
+        def write():
+            cursor = self._db.execute(
+                "INSERT OR IGNORE INTO submissions (team, kind, status, created_at, finished_at, score, correct, "
+                "total, prompt_id, details, source, model, layout, mode, dataset_version, submission_id) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (team, kind, status, created_at, created_at, score, correct, total, self._prompt_id(prompt),
+                 json.dumps(details) if details else None, source, *(fields.get(column) for column in columns))
+            )
+            if not cursor.rowcount:
+                return None
+            self._insert_results(cursor.lastrowid, results)
+            return cursor.lastrowid
+
+        with self._lock:
+            return self._transaction(write)
+
+    def has_source(self, source):
+        with self._lock:
+            return self._db.execute("SELECT 1 FROM submissions WHERE source = ?", (source,)).fetchone() is not None
+
+    def history(self, team, kind=None, prompt_hash=None, limit=None, cursor=None):
+        """
+        Return one page of a team's submissions, newest first.
+
+        Args:
+            team: team name
+            kind, prompt_hash: optional equality filters
+            limit: page size (default 50, at most 500)
+            cursor: next_cursor of the previous page
+
+        Returns:
+            dict: {"submissions": [...], "next_cursor": int or None when this is the last page}
+        """
+        limit = DEFAULT_PAGE_SIZE if limit is None else limit
+        if limit < 1:
+            raise ArchiveQueryError("limit must be a positive integer")
+        limit = min(limit, MAX_PAGE_SIZE)
+        where, params = ["s.team = ?"], [team]
+        if kind is not None:
+            where.append("s.kind = ?")
+            params.append(kind)
+        if prompt_hash is not None:
+            where.append("p.hash = ?")
+            params.append(prompt_hash)
+        if cursor is not None:
+            try:
+                cursor = int(cursor)
+            except (TypeError, ValueError):
+                raise ArchiveQueryError("cursor is not valid")
+            # keyset pagination on (created_at, id): migrated submissions have later ids than newer runs
+            where.append("(s.created_at, s.id) < (SELECT created_at, id FROM submissions WHERE id = ?)")
+            params.append(cursor)
+        with self._lock:
+            # one extra row tells whether there is a next page
+            rows = self._db.execute(
+                f"SELECT {SUBMISSION_COLUMNS} FROM submissions s LEFT JOIN prompts p ON p.id = s.prompt_id "
+                f"WHERE {' AND '.join(where)} ORDER BY s.created_at DESC, s.id DESC LIMIT ?",
+                (*params, limit + 1)
+            ).fetchall()
+        next_cursor = rows[limit - 1][0] if len(rows) > limit else None
+        return {"submissions": [serialize(row) for row in rows[:limit]], "next_cursor": next_cursor}
+
+    def submission(self, submission, songs=True):
+        """Return a submission, with its songs in dataset order if songs is true; None if there is no such id."""
+        with self._lock:
+            row = self._db.execute(
+                f"SELECT {SUBMISSION_COLUMNS} FROM submissions s LEFT JOIN prompts p ON p.id = s.prompt_id "
+                "WHERE s.id = ?", (submission,)
+            ).fetchone()
+            if row is None:
+                return None
+            result = serialize(row)
+            if songs:
+                rows = self._db.execute(
+                    "SELECT r.song, e.text, p.text, r.correct FROM results r JOIN labels e ON e.id = r.expected "
+                    "JOIN labels p ON p.id = r.predicted WHERE r.submission = ? ORDER BY r.song", (submission,)
+                ).fetchall()
+                result["songs"] = [{"song": song + 1, "expected": expected, "predicted": predicted,
+                                    "correct": bool(correct)} for song, expected, predicted, correct in rows]
+        return result
+
+    def diff(self, a, b):
+        """
+        Compare two submissions song by song.
+
+        Returns:
+            dict: both submissions (without songs); songs_compared (songs scored in both); fixed (wrong in a,
+                  right in b), broken (the reverse) and changed (different prediction) counts; score_change;
+                  comparable (same dataset version); and "songs", every song whose prediction or result
+                  differs. None if either submission does not exist.
+        """
+        first, second = self.submission(a, songs=False), self.submission(b, songs=False)
+        if first is None or second is None:
+            return None
+        with self._lock:
+            compared = self._db.execute(
+                "SELECT COUNT(*) FROM results a JOIN results b ON b.submission = ? AND b.song = a.song "
+                "WHERE a.submission = ?", (b, a)
+            ).fetchone()[0]
+            rows = self._db.execute(
+                "SELECT a.song, e.text, pa.text, a.correct, pb.text, b.correct FROM results a "
+                "JOIN results b ON b.submission = ? AND b.song = a.song "
+                "JOIN labels e ON e.id = a.expected JOIN labels pa ON pa.id = a.predicted "
+                "JOIN labels pb ON pb.id = b.predicted "
+                "WHERE a.submission = ? AND (a.predicted != b.predicted OR a.correct != b.correct) ORDER BY a.song",
+                (b, a)
+            ).fetchall()
+        songs = [{"song": song + 1, "expected": expected, "a": predicted_a, "a_correct": bool(correct_a),
+                  "b": predicted_b, "b_correct": bool(correct_b)}
+                 for song, expected, predicted_a, correct_a, predicted_b, correct_b in rows]
+        return {
+            "a": first,
+            "b": second,
+            "comparable": first["dataset_version"] == second["dataset_version"],
+            "score_change": (second["score"] - first["score"]
+                             if first["score"] is not None and second["score"] is not None else None),
+            "songs_compared": compared,
+            "fixed": sum(1 for song in songs if song["b_correct"] and not song["a_correct"]),
+            "broken": sum(1 for song in songs if song["a_correct"] and not song["b_correct"]),
+            "changed": sum(1 for song in songs if song["a"] != song["b"]),
+            "songs": songs,
+        }
+
+    def latest_prompts(self, team=None):
+        """
+        Return the most recent song submission of every distinct (team, prompt), oldest first.
+
+        Returns:
+            list: [(submission id, team, prompt)]
+        """
+        where, params = "", ()
+        if team is not None:
+            where, params = "AND s.team = ?", (team,)
+        with self._lock:
+            return self._db.execute(
+                "SELECT s.id, s.team, p.prompt FROM submissions s JOIN prompts p ON p.id = s.prompt_id "
+                f"WHERE s.kind = 'songs' {where} AND s.id = (SELECT s2.id FROM submissions s2 WHERE s2.team = s.team "
+                "AND s2.prompt_id = s.prompt_id AND s2.kind = 'songs' ORDER BY s2.created_at DESC, s2.id DESC LIMIT 1) "
+                "ORDER BY s.created_at, s.id", params
+            ).fetchall()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+_archive = None
+_archive_lock = threading.Lock()
+
+
+def get_evaluation_archive():
+    """Return the process-wide archive."""
+    global _archive
+    if _archive is None:
+        with _archive_lock:
+            if _archive is None:
+                _archive = EvaluationArchive(os.getenv("EVALUATION_ARCHIVE_DB", DEFAULT_PATH))
+    return _archive
@@ -0,0 +1,164 @@
+"""
+In-process publish/subscribe for Server-Sent Events.
+
+Publishers call publish(topic, event, data) from any thread. Each subscriber
+gets its own queue; sse_stream() turns a subscription into the text/event-stream
+wire format with periodic keep-alive comments. Every topic keeps a short
+history, so a client that connects late (or reconnects with Last-Event-ID)
+is replayed the events it missed. Topics that are finished (e.g. a completed
+submission) are closed and eventually dropped. asy_sse_stream() is the same
+stream for ASGI servers: it waits on an asyncio queue instead of holding a
+thread per connected client.
+"""
+import json
+import queue
+import asyncio
+import threading
+from collections import deque, OrderedDict
+
+# Events kept per topic for late subscribers / reconnects
+HISTORY_SIZE = 1000
+# Closed topics retained for replay before being dropped
+MAX_CLOSED_TOPICS = 256
+KEEPALIVE_SECONDS = 15
+
+
+class _Topic:
+    def __init__(self):
+        self.history = deque(maxlen=HISTORY_SIZE)
+        self.subscribers = set()
+        self.closed = False
+
+
+class _LoopQueue:
+    """Subscriber queue for async consumers: put() may be called from any thread."""
+
+    def __init__(self):
+        self._loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue()
+
+    def put(self, message):
+        self._loop.call_soon_threadsafe(self.queue.put_nowait, message)
+
+
+class EventBroker:
+    """Fan out events to per-subscriber queues, grouped by topic."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._topics = {}
+        self._closed_topics = OrderedDict()
+        self._next_id = 1
+
+    def publish(self, topic, event, data, close=False):
+        """
+        Send an event to every subscriber of topic.
+
+        Args:
+            topic (str): Topic name, e.g. "leaderboard" or "submission:<id>"
+            event (str): SSE event name
+            data: JSON-serializable payload
+            close (bool): Mark the topic finished; subscriber streams end after this event
+        """
+        with self._lock:
+            state = self._topics.setdefault(topic, _Topic())
+            message = (self._next_id, event, json.dumps(data, default=str))
+            self._next_id += 1
+            state.history.append(message)
+            for subscriber in state.subscribers:
+                subscriber.put(message)
+            if close:
+                state.closed = True
+                for subscriber in state.subscribers:
+                    subscriber.put(None)
+                self._closed_topics[topic] = True
+                while len(self._closed_topics) > MAX_CLOSED_TOPICS:
+                    stale, _ = self._closed_topics.popitem(last=False)
+                    self._topics.pop(stale, None)
+
+    def subscribe(self, topic, last_event_id=None, replay=True, subscriber=None):
+        """
+        Return a queue that receives topic events (a new queue.Queue unless subscriber is given).
+
+        The queue is pre-filled with history after last_event_id, or with the
+        whole history if replay is set and no last_event_id is given.
+        """
+        subscriber = queue.Queue() if subscriber is None else subscriber
+        with self._lock:
+            state = self._topics.setdefault(topic, _Topic())
+            for message in state.history:
+                if (last_event_id is None and replay) or (last_event_id is not None and message[0] > last_event_id):
+                    subscriber.put(message)
+            if state.closed:
+                subscriber.put(None)
+            state.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, topic, subscriber):
+        with self._lock:
+            state = self._topics.get(topic)
+            if state is not None:
+                state.subscribers.discard(subscriber)
+                # drop topics that were only ever subscribed to, never published on
+                if not state.subscribers and not state.history:
+                    del self._topics[topic]
+
+    def sse_stream(self, topic, last_event_id=None, replay=True, initial=None):
+        """
+        Generate text/event-stream chunks for topic until it is closed or the client disconnects.
+
+        Args:
+            replay (bool): Replay the topic history to a new subscriber
+            initial (callable): Optional function returning an (event, data) pair to send
+                first; it is called after subscribing, so no later event is missed
+        """
+        subscriber = self.subscribe(topic, last_event_id, replay)
+        try:
+            if initial is not None:
+                event, data = initial()
+                yield format_sse(event, json.dumps(data, default=str))
+            while True:
+                try:
+                    message = subscriber.get(timeout=KEEPALIVE_SECONDS)
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+                    continue
+                if message is None:
+                    return
+                event_id, event, data = message
+                yield format_sse(event, data, event_id)
+        finally:
+            self.unsubscribe(topic, subscriber)
+
+    async def asy_sse_stream(self, topic, last_event_id=None, replay=True, initial=None):
+        """Async version of sse_stream; must be iterated on one event loop."""
+        subscriber = self.subscribe(topic, last_event_id, replay, _LoopQueue())
+        try:
+            if initial is not None:
+                event, data = initial()
+                yield format_sse(event, json.dumps(data, default=str))
+            while True:
+                try:
+                    message = await asyncio.wait_for(subscriber.queue.get(), KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                if message is None:
+                    return
+                event_id, event, data = message
+                yield format_sse(event, data, event_id)
+        finally:
+            self.unsubscribe(topic, subscriber)
+
+
+def format_sse(event, data, event_id=None):
+    """Encode one event in the text/event-stream format."""
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event}")
+    lines.extend(f"data: {line}" for line in data.splitlines() or [""])
+    return "\n".join(lines) + "\n\n"
+
+
+broker = EventBroker()
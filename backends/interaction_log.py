@@ -0,0 +1,312 @@
+"""
+Write-behind logging of chat interactions to MongoDB.
+
+write_to_db / asy_write_to_db put the interaction document on an in-memory
+queue and return at once, so a chat request never waits on Mongo. A
+background thread writes the queue with insert_many, as soon as
+INTERACTION_LOG_BATCH documents are waiting or the oldest waiting document
+is INTERACTION_LOG_FLUSH_SECONDS old.
+
+The queue is bounded. When Mongo falls behind and the queue fills up,
+callers wait up to INTERACTION_LOG_PUT_TIMEOUT seconds for room
+(backpressure); a document that still does not fit goes to the spool file.
+A batch that Mongo rejects (e.g. it is unreachable) is appended to the spool
+file as JSON lines, and the spool is replayed into Mongo after the next
+successful write. A replay that a crash interrupted is finished when the
+writer starts again, and lines that cannot be parsed (a torn write) are moved
+to <spool>.corrupt. Without a spool file such documents are dropped and
+counted. Everything still queued is written when the process exits.
+
+Settings (environment variables):
+    INTERACTION_LOG_BATCH          documents per insert_many (default 100)
+    INTERACTION_LOG_FLUSH_SECONDS  longest a document waits to be written (default 1.0)
+    INTERACTION_LOG_QUEUE          documents that may be waiting (default 10000)
+    INTERACTION_LOG_PUT_TIMEOUT    seconds a caller waits when the queue is full (default 1.0)
+    INTERACTION_LOG_SPOOL          spool file (default data/interaction_spool.jsonl; empty to disable)
+"""
+import os
+import time
+import queue
+import atexit
+import asyncio
+import threading
+
+from bson import json_util
+from pymongo.errors import BulkWriteError
+
+from clients import get_mongo_client
+from metrics import Counter, Gauge, span
+
+DEFAULT_SPOOL_PATH = os.path.join(os.path.dirname(__file__), 'data', 'interaction_spool.jsonl')
+DATABASE = "chatbot"
+COLLECTION = "chatbot"
+
+DOCUMENTS = Counter("datanexus_interaction_log_documents_total",
+                    "Chat interactions by what became of them: written, spooled, replayed, dropped or corrupt.", ["outcome"])
+
+
+def interaction_document(texts, interaction_id=None, chatbot_name=None, interaction_date=None):
+    return {
+        "text": texts,
+        "interaction_id": interaction_id,
+        "chatbot_name": chatbot_name,
+        "interaction_date": interaction_date
+    }
+
+
+class InteractionLog:
+    """Bounded queue of interaction documents drained by one writer thread."""
+
+    def __init__(self, batch_size=100, flush_seconds=1.0, max_queued=10000, put_timeout=1.0,
+                 spool_path=DEFAULT_SPOOL_PATH, collection=None):
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.put_timeout = put_timeout
+        self.spool_path = spool_path or None
+        self._collection = collection
+        self._queue = queue.Queue(maxsize=max_queued)
+        self._spool_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._idle = threading.Condition()
+        self._writing = 0
+        self._thread = None
+        self._thread_lock = threading.Lock()
+        self.stats = {"queued": 0, "written": 0, "batches": 0, "failed_batches": 0, "spooled": 0,
+                      "replayed": 0, "dropped": 0, "corrupt": 0}
+
+    def collection(self):
+        if self._collection is None:
+            self._collection = get_mongo_client()[DATABASE][COLLECTION]
+        return self._collection
+
+    def log(self, document):
+        """Queue a document, waiting up to put_timeout for room; spool or drop it if there is none."""
+        self._start()
+        try:
+            self._queue.put(document, timeout=self.put_timeout)
+        except queue.Full:
+            print(f"Interaction log queue is full; {'spooling' if self.spool_path else 'dropping'} the document")
+            self._spool([document])
+            return
+        self._count("queued")
+
+    async def asy_log(self, document):
+        """log() for event loop callers: only waits (on a worker thread) when the queue is full."""
+        self._start()
+        try:
+            self._queue.put_nowait(document)
+        except queue.Full:
+            await asyncio.to_thread(self.log, document)
+            return
+        self._count("queued")
+
+    def flush(self, timeout=None):
+        """Wait until every document queued so far has been written (or spooled)."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._idle:
+            while self._queue.unfinished_tasks or self._writing:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._idle.wait(0.1 if remaining is None else min(0.1, remaining))
+        return True
+
+    def close(self, timeout=30):
+        """Write everything still queued and stop the writer thread."""
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def get_stats(self):
+        with self._stats_lock:
+            return {**self.stats, "waiting": self._queue.qsize()}
+
+    def _count(self, key, amount=1):
+        with self._stats_lock:
+            self.stats[key] += amount
+        if key in ("written", "spooled", "replayed", "dropped", "corrupt"):
+            DOCUMENTS.inc(amount, outcome=key)
+
+    def _start(self):
+        if self._thread is None:
+            with self._thread_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="interaction-log", daemon=True)
+                    self._thread.start()
+
+    def _next_batch(self):
+        """Block for the first document, then collect more until the batch is full or flush_seconds pass."""
+        while True:
+            try:
+                batch = [self._queue.get(timeout=0.5)]
+                break
+            except queue.Empty:
+                if self._stopping.is_set():
+                    return None
+        deadline = time.monotonic() + self.flush_seconds
+        while len(batch) < self.batch_size:
+            remaining = 0 if self._stopping.is_set() else deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        # finish a replay that an earlier process died in the middle of
+        if self.spool_path and os.path.exists(self._replaying_path()):
+            try:
+                self._replay_spool()
+            except Exception as e:
+                print(f"Error replaying spooled interactions: {e}")
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            with self._idle:
+                self._writing += 1
+            try:
+                self._write(batch)
+            except Exception as e:
+                # the writer thread must outlive any one batch; nothing restarts it
+                print(f"Interaction log writer error: {e}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+                with self._idle:
+                    self._writing -= 1
+                    self._idle.notify_all()
+
+    def _write(self, batch):
+        try:
+            # insert_many adds an _id to each document; a spooled copy must not keep it
+            with span("interaction_log_insert_many"):
+                self.collection().insert_many([dict(document) for document in batch], ordered=False)
+        except BulkWriteError as e:
+            # with ordered=False every other document was inserted, so only the rejected ones are kept
+            failed = failed_documents(batch, e)
+            print(f"Error writing {len(failed)} of {len(batch)} interactions to db: {e}")
+            self._count("failed_batches")
+            self._count("written", len(batch) - len(failed))
+            self._spool(failed)
+            return
+        except Exception as e:
+            print(f"Error writing {len(batch)} interactions to db: {e}")
+            self._count("failed_batches")
+            self._spool(batch)
+            return
+        self._count("written", len(batch))
+        self._count("batches")
+        if self.spool_path and (os.path.exists(self.spool_path) or os.path.exists(self._replaying_path())):
+            self._replay_spool()
+
+    def _spool(self, documents, replayed=False):
+        if not self.spool_path:
+            self._count("dropped", len(documents))
+            return
+        try:
+            with self._spool_lock:
+                os.makedirs(os.path.dirname(os.path.abspath(self.spool_path)), exist_ok=True)
+                torn = False
+                if os.path.exists(self.spool_path) and os.path.getsize(self.spool_path) > 0:
+                    with open(self.spool_path, 'rb') as spool:
+                        spool.seek(-1, os.SEEK_END)
+                        torn = spool.read(1) != b"\n"
+                with open(self.spool_path, 'a', encoding='utf-8') as spool:
+                    # start on a new line if a crash left the last one unfinished
+                    if torn:
+                        spool.write("\n")
+                    for document in documents:
+                        spool.write(json_util.dumps(document) + "\n")
+            if not replayed:
+                self._count("spooled", len(documents))
+        except OSError as e:
+            print(f"Could not spool {len(documents)} interactions: {e}")
+            self._count("dropped", len(documents))
+
+    def _replaying_path(self):
+        return f"{self.spool_path}.replaying"
+
+    def _read_spool(self, path):
+        """Return the documents in a spool file; lines that do not parse are moved to <spool>.corrupt."""
+        documents, corrupt = [], []
+        with open(path, encoding='utf-8', errors='replace') as spool:
+            for line in spool:
+                if not line.strip():
+                    continue
+                try:
+                    documents.append(json_util.loads(line))
+                except Exception:
+                    corrupt.append(line if line.endswith("\n") else line + "\n")
+        if corrupt:
+            print(f"Moving {len(corrupt)} unreadable spooled interactions to {self.spool_path}.corrupt")
+            try:
+                with open(f"{self.spool_path}.corrupt", 'a', encoding='utf-8') as file:
+                    file.writelines(corrupt)
+            except OSError as e:
+                print(f"Could not keep the unreadable spooled interactions: {e}")
+            self._count("corrupt", len(corrupt))
+        return documents
+
+    def _replay_spool(self):
+        """Move the spooled documents into Mongo; whatever fails stays in the spool."""
+        replaying = self._replaying_path()
+        with self._spool_lock:
+            # a replay file left by a crash is replayed before the spool is taken over
+            if not os.path.exists(replaying):
+                try:
+                    os.replace(self.spool_path, replaying)
+                except FileNotFoundError:
+                    return
+        documents = self._read_spool(replaying)
+        for start in range(0, len(documents), self.batch_size):
+            chunk = documents[start:start + self.batch_size]
+            try:
+                self.collection().insert_many(chunk, ordered=False)
+            except BulkWriteError as e:
+                failed = failed_documents(chunk, e)
+                print(f"Error replaying {len(failed)} of {len(chunk)} spooled interactions: {e}")
+                for document in failed:
+                    document.pop("_id", None)
+                self._spool(failed, replayed=True)
+                self._count("replayed", len(chunk) - len(failed))
+                continue
+            except Exception as e:
+                print(f"Error replaying spooled interactions: {e}")
+                for document in documents[start:]:
+                    document.pop("_id", None)
+                self._spool(documents[start:], replayed=True)
+                break
+            self._count("replayed", len(chunk))
+        os.remove(replaying)
+
+
+def failed_documents(documents, error):
+    """Return the documents an unordered insert_many rejected, from its BulkWriteError."""
+    return [documents[write_error["index"]] for write_error in error.details.get("writeErrors", [])]
+
+
+_log = None
+_log_lock = threading.Lock()
+
+Gauge("datanexus_interaction_log_waiting", "Chat interactions queued for Mongo.",
+      function=lambda: _log.get_stats()["waiting"] if _log is not None else 0)
+
+
+def get_interaction_log():
+    """Return the process-wide interaction log; its writer thread starts on the first document."""
+    global _log
+    if _log is None:
+        with _log_lock:
+            if _log is None:
+                _log = InteractionLog(
+                    batch_size=int(os.getenv("INTERACTION_LOG_BATCH", 100)),
+                    flush_seconds=float(os.getenv("INTERACTION_LOG_FLUSH_SECONDS", 1.0)),
+                    max_queued=int(os.getenv("INTERACTION_LOG_QUEUE", 10000)),
+                    put_timeout=float(os.getenv("INTERACTION_LOG_PUT_TIMEOUT", 1.0)),
+                    spool_path=os.getenv("INTERACTION_LOG_SPOOL", DEFAULT_SPOOL_PATH)
+                )
+                # registered after clients.close_clients, so it runs first and Mongo is still open
+                atexit.register(_log.close)
+    return _log
@@ -0,0 +1,228 @@
+"""
+Read side of the chat interaction log (chatbot.chatbot in MongoDB).
+
+Documents are written by interaction_log.py as
+{text, interaction_id, chatbot_name, interaction_date}. This module creates
+the indexes the queries below rely on, pages through interactions newest
+first with an opaque cursor (keyset pagination on interaction_date and _id,
+so a page costs the same however deep it is), and computes usage counts as
+aggregation pipelines that run inside Mongo.
+
+Settings (environment variables):
+    INTERACTION_PAGE_SIZE      default interactions per page (default 50)
+    INTERACTION_MAX_PAGE_SIZE  largest page a client may ask for (default 500)
+"""
+import os
+import json
+import base64
+import threading
+from datetime import datetime
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import ASCENDING, DESCENDING
+
+from clients import get_mongo_client
+from interaction_log import DATABASE, COLLECTION
+
+INDEXES = [
+    # look up one conversation
+    ([("interaction_id", ASCENDING)], "interaction_id"),
+    # one chatbot's interactions in a time window, newest first (also serves chatbot_name alone)
+    ([("chatbot_name", ASCENDING), ("interaction_date", DESCENDING), ("_id", DESCENDING)], "chatbot_date"),
+    # every chatbot's interactions in a time window, newest first
+    ([("interaction_date", DESCENDING), ("_id", DESCENDING)], "interaction_date"),
+]
+
+# $dateToString formats of the buckets GET /api/interactions/counts can group by
+BUCKETS = {
+    "hour": "%Y-%m-%dT%H:00",
+    "day": "%Y-%m-%d",
+    "month": "%Y-%m",
+}
+
+
+class InteractionQueryError(ValueError):
+    """Raised for a query parameter that cannot be used (bad date, cursor or bucket)."""
+
+
+def get_collection():
+    return get_mongo_client()[DATABASE][COLLECTION]
+
+
+def ensure_indexes(collection=None):
+    """Create the query indexes; a no-op for the ones that already exist."""
+    collection = collection if collection is not None else get_collection()
+    for keys, name in INDEXES:
+        collection.create_index(keys, name=name)
+
+
+_indexes_started = False
+_indexes_lock = threading.Lock()
+
+
+def ensure_indexes_in_background():
+    """ensure_indexes() once per process, on a daemon thread, so startup does not wait on (or fail without) Mongo."""
+    global _indexes_started
+    with _indexes_lock:
+        if _indexes_started:
+            return
+        _indexes_started = True
+
+    def run():
+        try:
+            ensure_indexes()
+        except Exception as e:
+            print(f"Could not create interaction indexes: {e}")
+
+    threading.Thread(target=run, name="interaction-indexes", daemon=True).start()
+
+
+def parse_date(value, name):
+    if value is None or value == "":
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise InteractionQueryError(f"{name} must be an ISO 8601 date or datetime")
+
+
+def encode_cursor(document):
+    position = [document["interaction_date"].isoformat(), str(document["_id"])]
+    return base64.urlsafe_b64encode(json.dumps(position).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor):
+    try:
+        date, object_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return datetime.fromisoformat(date), ObjectId(object_id)
+    except (ValueError, TypeError, InvalidId):
+        raise InteractionQueryError("cursor is not valid")
+
+
+def match_stage(chatbot_name=None, interaction_id=None, since=None, until=None):
+    """Return the filter shared by the queries: equality on the ids, since <= interaction_date < until."""
+    match = {}
+    if chatbot_name is not None:
+        match["chatbot_name"] = chatbot_name
+    if interaction_id is not None:
+        match["interaction_id"] = interaction_id
+    if since is not None or until is not None:
+        match["interaction_date"] = {}
+        if since is not None:
+            match["interaction_date"]["$gte"] = since
+        if until is not None:
+            match["interaction_date"]["$lt"] = until
+    return match
+
+
+def serialize(document):
+    return {
+        "id": str(document["_id"]),
+        "interaction_id": document.get("interaction_id"),
+        "chatbot_name": document.get("chatbot_name"),
+        "interaction_date": document["interaction_date"].isoformat() if document.get("interaction_date") else None,
+        "text": document.get("text"),
+    }
+
+
+def find_interactions(chatbot_name=None, interaction_id=None, since=None, until=None, limit=None, cursor=None,
+                      collection=None):
+    """
+    Return one page of interactions, newest first.
+
+    Args:
+        chatbot_name, interaction_id: optional equality filters
+        since, until: optional datetimes; since is inclusive, until exclusive
+        limit: page size (capped at INTERACTION_MAX_PAGE_SIZE)
+        cursor: next_cursor of the previous page
+
+    Returns:
+        dict: {"interactions": [...], "next_cursor": str or None when this is the last page}
+    """
+    collection = collection if collection is not None else get_collection()
+    limit = min(limit or int(os.getenv("INTERACTION_PAGE_SIZE", 50)), int(os.getenv("INTERACTION_MAX_PAGE_SIZE", 500)))
+    match = match_stage(chatbot_name, interaction_id, since, until)
+    # only documents with a date can be paged by date
+    match.setdefault("interaction_date", {})["$type"] = "date"
+    if cursor:
+        date, object_id = decode_cursor(cursor)
+        match["$or"] = [
+            {"interaction_date": {"$lt": date}},
+            {"interaction_date": date, "_id": {"$lt": object_id}},
+        ]
+
+    # one extra document tells whether there is a next page
+    documents = list(collection.find(match).sort([("interaction_date", DESCENDING), ("_id", DESCENDING)])
+                     .limit(limit + 1))
+    next_cursor = encode_cursor(documents[limit - 1]) if len(documents) > limit else None
+    return {"interactions": [serialize(document) for document in documents[:limit]], "next_cursor": next_cursor}
+
+
+def interaction_counts(bucket="hour", chatbot_name=None, since=None, until=None, collection=None):
+    """
+    Count interactions per chatbot per time bucket, computed by Mongo.
+
+    Returns:
+        list: [{"chatbot_name", "bucket", "interactions", "conversations"}] ordered by bucket, then chatbot
+    """
+    if bucket not in BUCKETS:
+        raise InteractionQueryError(f"bucket must be one of {', '.join(BUCKETS)}")
+    collection = collection if collection is not None else get_collection()
+    match = match_stage(chatbot_name, None, since, until)
+    match.setdefault("interaction_date", {})["$type"] = "date"
+    pipeline = [
+        {"$match": match},
+        {"$group": {
+            "_id": {
+                "chatbot_name": "$chatbot_name",
+                "bucket": {"$dateToString": {"format": BUCKETS[bucket], "date": "$interaction_date"}},
+            },
+            "interactions": {"$sum": 1},
+            "conversations": {"$addToSet": "$interaction_id"},
+        }},
+        {"$project": {
+            "_id": 0,
+            "chatbot_name": "$_id.chatbot_name",
+            "bucket": "$_id.bucket",
+            "interactions": 1,
+            "conversations": {"$size": "$conversations"},
+        }},
+        {"$sort": {"bucket": 1, "chatbot_name": 1}},
+    ]
+    return list(collection.aggregate(pipeline))
+
+
+def chatbot_summary(since=None, until=None, collection=None):
+    """
+    Per chatbot: interactions, distinct conversations and first/last interaction date, computed by Mongo.
+
+    Returns:
+        list: [{"chatbot_name", "interactions", "conversations", "first", "last"}], busiest first
+    """
+    collection = collection if collection is not None else get_collection()
+    pipeline = [
+        {"$match": match_stage(since=since, until=until)},
+        # one row per conversation first, so distinct conversations are counted without a per-chatbot set
+        {"$group": {
+            "_id": {"chatbot_name": "$chatbot_name", "interaction_id": "$interaction_id"},
+            "interactions": {"$sum": 1},
+            "first": {"$min": "$interaction_date"},
+            "last": {"$max": "$interaction_date"},
+        }},
+        {"$group": {
+            "_id": "$_id.chatbot_name",
+            "interactions": {"$sum": "$interactions"},
+            "conversations": {"$sum": 1},
+            "first": {"$min": "$first"},
+            "last": {"$max": "$last"},
+        }},
+        {"$sort": {"interactions": -1, "_id": 1}},
+    ]
+    return [{
+        "chatbot_name": row["_id"],
+        "interactions": row["interactions"],
+        "conversations": row["conversations"],
+        "first": row["first"].isoformat() if isinstance(row["first"], datetime) else None,
+        "last": row["last"].isoformat() if isinstance(row["last"], datetime) else None,
+    } for row in collection.aggregate(pipeline, allowDiskUse=True)]
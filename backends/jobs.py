@@ -0,0 +1,269 @@
+"""
+Background job queue for long-running submissions.
+
+Jobs are rows in a SQLite table, so queued and finished jobs survive a
+restart. A bounded pool of worker threads claims jobs with an atomic
+UPDATE and runs the handler registered for the job's kind.
+
+Scheduling policy:
+    1. higher priority first (set by the server, default 0)
+    2. a team may have at most JOB_MAX_RUNNING_PER_TEAM jobs running at once
+    3. among equal priorities, teams take turns: the team whose last job
+       started longest ago goes next, then the oldest job of that team
+    4. a team may have at most JOB_MAX_QUEUED_PER_TEAM jobs waiting
+
+Running jobs send a heartbeat; a job whose heartbeat stops (its process
+died) is put back in the queue, up to JOB_MAX_ATTEMPTS times.
+
+Settings (environment variables):
+    JOBS_DB                    SQLite file (default data/jobs.sqlite3)
+    JOB_WORKERS                worker threads per process (default 4)
+    JOB_MAX_RUNNING_PER_TEAM   default 1
+    JOB_MAX_QUEUED_PER_TEAM    default 5
+    JOB_MAX_ATTEMPTS           default 3
+"""
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+import traceback
+
+DEFAULT_PATH = os.path.join(os.path.dirname(__file__), 'data', 'jobs.sqlite3')
+
+HEARTBEAT_SECONDS = 15
+# A running job with no heartbeat for this long is considered abandoned
+STALE_SECONDS = 90
+IDLE_POLL_SECONDS = 1.0
+
+
+class QueueFullError(Exception):
+    """Raised when a team already has the maximum number of queued jobs."""
+
+
+class JobQueue:
+    """Persistent, fair job queue with a bounded worker pool."""
+
+    def __init__(self, path=DEFAULT_PATH, workers=4, max_running_per_team=1, max_queued_per_team=5, max_attempts=3):
+        self.path = path
+        self.workers = workers
+        self.max_running_per_team = max_running_per_team
+        self.max_queued_per_team = max_queued_per_team
+        self.max_attempts = max_attempts
+        self._handlers = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition()
+        self._running = set()
+        self._threads = []
+        self._stopping = threading.Event()
+
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, kind TEXT NOT NULL, team TEXT NOT NULL, payload TEXT NOT NULL, "
+            "priority INTEGER NOT NULL DEFAULT 0, status TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, "
+            "created_at REAL NOT NULL, started_at REAL, finished_at REAL, heartbeat_at REAL, "
+            "result TEXT, error TEXT)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_queue ON jobs (status, priority, created_at)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_team ON jobs (team, status, started_at)")
+
+    def register(self, kind, handler):
+        """Register handler(job_id, payload) -> result dict for jobs of the given kind."""
+        self._handlers[kind] = handler
+
+    def submit(self, kind, team, payload, priority=0):
+        """
+        Queue a job.
+
+        Returns:
+            dict: The new job (see get())
+
+        Raises:
+            QueueFullError: If the team already has max_queued_per_team jobs waiting
+        """
+        if kind not in self._handlers:
+            raise ValueError(f"No handler registered for job kind '{kind}'")
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                queued = self._db.execute(
+                    "SELECT COUNT(*) FROM jobs WHERE team = ? AND status = 'queued'", (team,)
+                ).fetchone()[0]
+                if queued >= self.max_queued_per_team:
+                    raise QueueFullError(f"Team '{team}' already has {queued} jobs waiting")
+                self._db.execute(
+                    "INSERT INTO jobs (id, kind, team, payload, priority, status, created_at) "
+                    "VALUES (?, ?, ?, ?, ?, 'queued', ?)",
+                    (job_id, kind, team, json.dumps(payload), priority, time.time())
+                )
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        with self._wakeup:
+            self._wakeup.notify()
+        return self.get(job_id)
+
+    def get(self, job_id, include_result=False):
+        """Return a job's state as a dict, or None if it does not exist."""
+        with self._lock:
+            row = self._db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return None
+            position = None
+            if row["status"] == "queued":
+                position = self._db.execute(
+                    "SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND "
+                    "(priority > ? OR (priority = ? AND created_at < ?))",
+                    (row["priority"], row["priority"], row["created_at"])
+                ).fetchone()[0] + 1
+        job = {
+            "job_id": row["id"],
+            "kind": row["kind"],
+            "team": row["team"],
+            "status": row["status"],
+            "attempts": row["attempts"],
+            "queue_position": position,
+            "created_at": row["created_at"],
+            "started_at": row["started_at"],
+            "finished_at": row["finished_at"],
+            "error": row["error"]
+        }
+        if include_result:
+            job["result"] = json.loads(row["result"]) if row["result"] else None
+        return job
+
+    def start(self):
+        """Requeue abandoned jobs and start the worker threads (idempotent)."""
+        with self._lock:
+            if self._threads:
+                return
+            self._requeue_stale()
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            heartbeat = threading.Thread(target=self._heartbeat, name="job-heartbeat", daemon=True)
+            heartbeat.start()
+            self._threads.append(heartbeat)
+
+    def stop(self, timeout=None):
+        """Stop claiming new jobs and wait for the workers to finish their current job."""
+        self._stopping.set()
+        with self._wakeup:
+            self._wakeup.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def _claim(self):
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._db.execute(
+                    "SELECT j.id, j.kind, j.payload FROM jobs j "
+                    "LEFT JOIN (SELECT team, SUM(status = 'running') AS running, MAX(started_at) AS last_started "
+                    "           FROM jobs GROUP BY team) t ON t.team = j.team "
+                    "WHERE j.status = 'queued' AND COALESCE(t.running, 0) < ? "
+                    "ORDER BY j.priority DESC, COALESCE(t.last_started, 0) ASC, j.created_at ASC LIMIT 1",
+                    (self.max_running_per_team,)
+                ).fetchone()
+                if row is not None:
+                    self._db.execute(
+                        "UPDATE jobs SET status = 'running', attempts = attempts + 1, started_at = ?, "
+                        "heartbeat_at = ? WHERE id = ?",
+                        (now, now, row["id"])
+                    )
+                    self._running.add(row["id"])
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        return row
+
+    def _finish(self, job_id, status, result=None, error=None):
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET status = ?, finished_at = ?, result = ?, error = ? WHERE id = ?",
+                (status, time.time(), json.dumps(result) if result is not None else None, error, job_id)
+            )
+            self._running.discard(job_id)
+
+    def _work(self):
+        while not self._stopping.is_set():
+            try:
+                job = self._claim()
+            except Exception as e:
+                print(f"Job queue error: {e}")
+                job = None
+            if job is None:
+                with self._wakeup:
+                    self._wakeup.wait(IDLE_POLL_SECONDS)
+                continue
+
+            try:
+                result = self._handlers[job["kind"]](job["id"], json.loads(job["payload"]))
+                failed = isinstance(result, dict) and result.get("status") == "error"
+                self._finish(job["id"], "failed" if failed else "succeeded", result=result,
+                             error=result.get("error") if failed else None)
+            except Exception as e:
+                print(f"Job {job['id']} failed: {e}")
+                traceback.print_exc()
+                self._finish(job["id"], "failed", error=str(e))
+            # another team's job may now be eligible
+            with self._wakeup:
+                self._wakeup.notify()
+
+    def _heartbeat(self):
+        while not self._stopping.wait(HEARTBEAT_SECONDS):
+            try:
+                with self._lock:
+                    now = time.time()
+                    self._db.executemany("UPDATE jobs SET heartbeat_at = ? WHERE id = ?",
+                                         [(now, job_id) for job_id in self._running])
+                    self._requeue_stale()
+            except Exception as e:
+                print(f"Job heartbeat error: {e}")
+
+    def _requeue_stale(self):
+        # caller holds self._lock
+        cutoff = time.time() - STALE_SECONDS
+        running = tuple(self._running) or ("",)
+        placeholders = ",".join("?" * len(running))
+        self._db.execute(
+            f"UPDATE jobs SET status = 'failed', finished_at = ?, error = 'Abandoned after too many attempts' "
+            f"WHERE status = 'running' AND heartbeat_at < ? AND attempts >= ? AND id NOT IN ({placeholders})",
+            (time.time(), cutoff, self.max_attempts, *running)
+        )
+        self._db.execute(
+            f"UPDATE jobs SET status = 'queued', started_at = NULL "
+            f"WHERE status = 'running' AND heartbeat_at < ? AND id NOT IN ({placeholders})",
+            (cutoff, *running)
+        )
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_job_queue():
+    """Return the process-wide job queue (workers are started separately with start())."""
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                _queue = JobQueue(
+                    path=os.getenv("JOBS_DB", DEFAULT_PATH),
+                    workers=int(os.getenv("JOB_WORKERS", 4)),
+                    max_running_per_team=int(os.getenv("JOB_MAX_RUNNING_PER_TEAM", 1)),
+                    max_queued_per_team=int(os.getenv("JOB_MAX_QUEUED_PER_TEAM", 5)),
+                    max_attempts=int(os.getenv("JOB_MAX_ATTEMPTS", 3))
+                )
+    return _queue
@@ -0,0 +1,252 @@
+"""
+SQLite-backed leaderboard storage.
+
+Replaces the read-modify-write cycle on data/leaderboard.xlsx. Each team is one
+row keyed by name; scores are written with a single atomic upsert inside an
+immediate transaction, so concurrent submissions (threads or processes) are
+serialized by SQLite instead of overwriting each other. Reads use the index on
+score.
+
+Every write bumps a store-wide version number and stamps it on the changed
+row. Readers get an immutable Snapshot (sorted rows, pre-serialized JSON and
+an ETag) that is rebuilt only after a write, either from this process or,
+detected through PRAGMA data_version, from another one. get_changes(since)
+returns just the rows written after a given version, and functions registered
+with add_listener() are called with the same delta after every local write.
+
+On first use an empty store imports the legacy data/leaderboard.xlsx once.
+The workbook can be regenerated with export_xlsx() or GET /api/leaderboard/export.
+
+Settings (environment variables):
+    LEADERBOARD_DB  SQLite file (default data/leaderboard.sqlite3)
+"""
+import os
+import sys
+import json
+import uuid
+import sqlite3
+import threading
+from datetime import datetime
+from collections import namedtuple
+
+import pandas as pd
+
+from metrics import timed
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
+DEFAULT_PATH = os.path.join(DATA_DIR, 'leaderboard.sqlite3')
+LEGACY_XLSX_PATH = os.path.join(DATA_DIR, 'leaderboard.xlsx')
+
+COLUMNS = ['name', 'score', 'last_updated']
+
+# rows: [{name, score, last_updated}] sorted by score; versions: name -> version of last write
+Snapshot = namedtuple('Snapshot', ['version', 'etag', 'rows', 'body', 'versions', 'data_version'])
+
+
+class LeaderboardStore:
+    """Team scores in a SQLite table with an index on score."""
+
+    def __init__(self, path=DEFAULT_PATH):
+        self.path = path
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        # autocommit mode; writes open their own BEGIN IMMEDIATE transaction
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._db.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS leaderboard ("
+            "name TEXT PRIMARY KEY, score NUMERIC NOT NULL, last_updated TEXT NOT NULL, "
+            "version INTEGER NOT NULL DEFAULT 0)"
+        )
+        columns = [row["name"] for row in self._db.execute("PRAGMA table_info(leaderboard)")]
+        if "version" not in columns:
+            self._db.execute("ALTER TABLE leaderboard ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+        self._db.execute("CREATE INDEX IF NOT EXISTS leaderboard_score ON leaderboard (score DESC)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        # Identifies this database file in ETags, so a recreated store never reuses old tags
+        self._db.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('generation', ?)", (uuid.uuid4().hex[:12],))
+        self._snapshot = None
+        self._listeners = []
+
+    def add_listener(self, callback):
+        """Call callback({"version", "full", "changed"}) after every write made through this store."""
+        self._listeners.append(callback)
+
+    def _notify(self, version, rows):
+        delta = {"version": version, "full": False, "changed": rows}
+        for callback in self._listeners:
+            try:
+                callback(delta)
+            except Exception as e:
+                print(f"Leaderboard listener error: {e}")
+
+    def get_leaderboard(self):
+        """Return all teams as [{name, score, last_updated}], highest score first."""
+        return [dict(row) for row in self.get_snapshot().rows]
+
+    @timed("leaderboard_read")
+    def get_snapshot(self):
+        """Return the current Snapshot, rebuilding it only if the table changed since the last one."""
+        with self._lock:
+            data_version = self._db.execute("PRAGMA data_version").fetchone()[0]
+            snapshot = self._snapshot
+            if snapshot is None or snapshot.data_version != data_version:
+                snapshot = self._snapshot = self._build_snapshot(data_version)
+        return snapshot
+
+    def get_changes(self, since):
+        """
+        Return the rows written after version `since`.
+
+        Returns:
+            tuple: (snapshot, rows, full) where full is True if `since` is unknown
+                   to this store and every row is returned
+        """
+        snapshot = self.get_snapshot()
+        if since > snapshot.version or since < 0:
+            return snapshot, snapshot.rows, True
+        rows = [row for row in snapshot.rows if snapshot.versions[row['name']] > since]
+        return snapshot, rows, False
+
+    def _build_snapshot(self, data_version):
+        rows = self._db.execute(
+            "SELECT name, score, last_updated, version FROM leaderboard ORDER BY score DESC, name"
+        ).fetchall()
+        meta = dict(self._db.execute("SELECT key, value FROM meta WHERE key IN ('version', 'generation')").fetchall())
+        version = int(meta.get('version', 0))
+        records = [{'name': row['name'], 'score': row['score'], 'last_updated': row['last_updated']} for row in rows]
+        return Snapshot(
+            version=version,
+            etag=f"{meta['generation']}-{version}",
+            rows=records,
+            body=json.dumps(records),
+            versions={row['name']: row['version'] for row in rows},
+            data_version=data_version
+        )
+
+    def _next_version(self):
+        # must be called inside a write transaction
+        row = self._db.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        version = int(row['value']) + 1 if row else 1
+        self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('version', ?)", (str(version),))
+        return version
+
+    @timed("leaderboard_write")
+    def upsert_score(self, name, score, last_updated=None):
+        """
+        Set a team's score, adding the team if needed.
+
+        Returns:
+            bool: True if the team was added, False if an existing row was updated
+        """
+        last_updated = last_updated or datetime.now().isoformat()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                exists = self._db.execute("SELECT 1 FROM leaderboard WHERE name = ?", (name,)).fetchone()
+                version = self._next_version()
+                self._db.execute(
+                    "INSERT INTO leaderboard (name, score, last_updated, version) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(name) DO UPDATE SET score = excluded.score, "
+                    "last_updated = excluded.last_updated, version = excluded.version",
+                    (name, score, last_updated, version)
+                )
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+            finally:
+                self._snapshot = None
+        self._notify(version, [{'name': name, 'score': score, 'last_updated': last_updated}])
+        return exists is None
+
+    @timed("leaderboard_import_xlsx")
+    def import_xlsx(self, xlsx_path=LEGACY_XLSX_PATH):
+        """
+        Import teams from a leaderboard workbook. Duplicate names keep their most recent row.
+
+        Returns:
+            int: Number of teams imported
+        """
+        df = pd.read_excel(xlsx_path)
+        if 'last_updated' not in df.columns:
+            df['last_updated'] = datetime.now().isoformat()
+        df = df.dropna(subset=['name', 'score'])
+        df['last_updated'] = df['last_updated'].fillna('').astype(str)
+        df = df.sort_values(by='last_updated').drop_duplicates(subset='name', keep='last')
+
+        records = df[COLUMNS].to_dict('records')
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                version = self._next_version()
+                self._db.executemany(
+                    "INSERT INTO leaderboard (name, score, last_updated, version) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(name) DO UPDATE SET score = excluded.score, "
+                    "last_updated = excluded.last_updated, version = excluded.version",
+                    [(str(record['name']), record['score'], record['last_updated'], version) for record in records]
+                )
+                self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('imported_xlsx', ?)",
+                                 (os.path.abspath(xlsx_path),))
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+            finally:
+                self._snapshot = None
+        self._notify(version, [{'name': str(record['name']), 'score': record['score'],
+                                'last_updated': record['last_updated']} for record in records])
+        return len(records)
+
+    def import_legacy_once(self, xlsx_path=LEGACY_XLSX_PATH):
+        """Import the legacy workbook if this store has never imported one and is empty."""
+        with self._lock:
+            imported = self._db.execute("SELECT 1 FROM meta WHERE key = 'imported_xlsx'").fetchone()
+            empty = self._db.execute("SELECT 1 FROM leaderboard LIMIT 1").fetchone() is None
+        if imported or not empty or not os.path.exists(xlsx_path):
+            return 0
+        count = self.import_xlsx(xlsx_path)
+        print(f"Imported {count} teams from {xlsx_path}")
+        return count
+
+    @timed("leaderboard_export_xlsx")
+    def export_xlsx(self, target):
+        """Write the leaderboard to an .xlsx path or file-like object."""
+        df = pd.DataFrame(self.get_leaderboard(), columns=COLUMNS)
+        df.to_excel(target, index=False)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_leaderboard_store():
+    """Return the process-wide leaderboard store, importing the legacy xlsx on first use."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                store = LeaderboardStore(os.getenv("LEADERBOARD_DB", DEFAULT_PATH))
+                store.import_legacy_once()
+                _store = store
+    return _store
+
+
+if __name__ == "__main__":
+    # python leaderboard_store.py import [xlsx_path] | export <xlsx_path>
+    if len(sys.argv) < 2 or sys.argv[1] not in ("import", "export"):
+        print("Usage: python leaderboard_store.py import [xlsx_path] | export <xlsx_path>")
+        sys.exit(1)
+
+    store = LeaderboardStore(os.getenv("LEADERBOARD_DB", DEFAULT_PATH))
+    if sys.argv[1] == "import":
+        path = sys.argv[2] if len(sys.argv) > 2 else LEGACY_XLSX_PATH
+        print(f"Imported {store.import_xlsx(path)} teams from {path}")
+    else:
+        if len(sys.argv) < 3:
+            print("Usage: python leaderboard_store.py export <xlsx_path>")
+            sys.exit(1)
+        store.export_xlsx(sys.argv[2])
+        print(f"Exported leaderboard to {sys.argv[2]}")
@@ -0,0 +1,265 @@
+"""
+Prometheus metrics and per-request timing.
+
+A span times one piece of work into datanexus_span_seconds{span="..."},
+counts the ones that raise and tracks how many are in flight:
+
+    with span("leaderboard_write"):
+        ...
+
+    @timed("chat_in")           # sync and async functions alike
+    def chat_in(...):
+
+Every HTTP request is recorded by RequestTimer (the Flask hooks in app.py,
+and asgi.py for its native routes). The spans that run while a request is
+being handled are collected, and a request that takes SLOW_REQUEST_SECONDS or
+more, or fails with a 5xx, is logged as one JSON line with that breakdown.
+
+GET /metrics returns every metric in the Prometheus text format. Values are
+per process; with several workers, scrape each one.
+
+Settings (environment variables):
+    SLOW_REQUEST_SECONDS   log requests at least this slow as JSON (default 2.0)
+"""
+import os
+import json
+import time
+import inspect
+import functools
+import threading
+import contextlib
+import contextvars
+from datetime import datetime, timezone
+
+# seconds; model calls and whole evaluations sit in the upper buckets
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_metrics = []
+_metrics_lock = threading.Lock()
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """A named metric with optional labels; values are kept per combination of label values."""
+
+    kind = "untyped"
+
+    def __init__(self, name, description, labelnames=()):
+        self.name = name
+        self.description = description
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+        with _metrics_lock:
+            _metrics.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def samples(self):
+        """Yield (sample name, label text, value) for the exposition format."""
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            yield self.name, _labels(self.labelnames, key), value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(f"{name}{labels} {_number(value)}" for name, labels, value in self.samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """A value that goes up and down; with `function`, read from it at scrape time instead."""
+
+    kind = "gauge"
+
+    def __init__(self, name, description, labelnames=(), function=None):
+        super().__init__(name, description, labelnames)
+        self.function = function
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def samples(self):
+        if self.function is not None:
+            try:
+                yield self.name, "", self.function()
+            except Exception as e:
+                print(f"Metric {self.name} could not be read: {e}")
+            return
+        yield from super().samples()
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, description, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, description, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for position, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[position] += 1
+                    break
+            self._values[key] = (counts, total + value)
+
+    def totals(self, **labels):
+        """Return (count, sum) of the observations with these label values."""
+        with self._lock:
+            counts, total = self._values.get(self._key(labels), ((), 0.0))
+        return sum(counts), total
+
+    def samples(self):
+        with self._lock:
+            values = {key: (list(counts), total) for key, (counts, total) in self._values.items()}
+        for key, (counts, total) in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                yield f"{self.name}_bucket", _labels(self.labelnames, key, [("le", _number(bound))]), cumulative
+            yield f"{self.name}_sum", _labels(self.labelnames, key), total
+            yield f"{self.name}_count", _labels(self.labelnames, key), cumulative
+
+
+def render():
+    """Return every registered metric in the Prometheus text exposition format."""
+    with _metrics_lock:
+        metrics = list(_metrics)
+    return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+SPAN_SECONDS = Histogram("datanexus_span_seconds", "Time spent in instrumented operations.", ["span"])
+SPAN_ERRORS = Counter("datanexus_span_errors_total", "Instrumented operations that raised.", ["span"])
+SPANS_IN_FLIGHT = Gauge("datanexus_spans_in_flight", "Instrumented operations running now.", ["span"])
+
+HTTP_REQUESTS = Counter("datanexus_http_requests_total", "HTTP requests handled.", ["method", "route", "status"])
+HTTP_SECONDS = Histogram("datanexus_http_request_seconds",
+                         "Time from receiving a request to its response headers.", ["method", "route"])
+HTTP_IN_FLIGHT = Gauge("datanexus_http_requests_in_flight", "HTTP requests being handled now.", ["method", "route"])
+
+# (span name, seconds) of every span finished while the current request is handled
+_request_spans = contextvars.ContextVar("request_spans", default=None)
+
+
+@contextlib.contextmanager
+def span(name):
+    """Time the enclosed block as span `name`."""
+    SPANS_IN_FLIGHT.inc(span=name)
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        SPAN_ERRORS.inc(span=name)
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        SPANS_IN_FLIGHT.dec(span=name)
+        SPAN_SECONDS.observe(elapsed, span=name)
+        spans = _request_spans.get()
+        if spans is not None:
+            spans.append((name, elapsed))
+
+
+def timed(name):
+    """Decorator: run every call of a function (sync or async) inside span(name)."""
+    def decorate(function):
+        if inspect.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def wrapper(*args, **kwargs):
+                with span(name):
+                    return await function(*args, **kwargs)
+        else:
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with span(name):
+                    return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+class RequestTimer:
+    """Records one HTTP request; the spans run while it is handled are attributed to it."""
+
+    def __init__(self, method, route, path):
+        self.method = method
+        self.route = route
+        self.path = path
+        self.spans = []
+        self.finished = False
+        _request_spans.set(self.spans)
+        HTTP_IN_FLIGHT.inc(method=method, route=route)
+        self.start = time.perf_counter()
+
+    def finish(self, status, error=None):
+        if self.finished:
+            return
+        self.finished = True
+        elapsed = time.perf_counter() - self.start
+        _request_spans.set(None)
+        HTTP_IN_FLIGHT.dec(method=self.method, route=self.route)
+        HTTP_REQUESTS.inc(method=self.method, route=self.route, status=status)
+        HTTP_SECONDS.observe(elapsed, method=self.method, route=self.route)
+        if elapsed >= float(os.getenv("SLOW_REQUEST_SECONDS", 2.0)) or status >= 500:
+            self.log(status, elapsed, error)
+
+    def log(self, status, elapsed, error):
+        breakdown = {}
+        for name, seconds in self.spans:
+            entry = breakdown.setdefault(name, {"count": 0, "total_ms": 0.0, "max_ms": 0.0})
+            entry["count"] += 1
+            entry["total_ms"] += seconds * 1000
+            entry["max_ms"] = max(entry["max_ms"], seconds * 1000)
+        record = {
+            "event": "slow_request" if status < 500 else "failed_request",
+            "time": datetime.now(timezone.utc).isoformat(timespec="milliseconds"),
+            "method": self.method,
+            "path": self.path,
+            "route": self.route,
+            "status": status,
+            "duration_ms": round(elapsed * 1000, 1),
+            "spans": {name: {key: round(value, 1) for key, value in entry.items()}
+                      for name, entry in sorted(breakdown.items(), key=lambda item: -item[1]["total_ms"])},
+        }
+        if error:
+            record["error"] = error
+        print(json.dumps(record), flush=True)
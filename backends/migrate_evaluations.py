@@ -0,0 +1,115 @@
+"""
+Import the data/evaluations/<team>_<timestamp>.txt files into the evaluation archive.
+
+    python migrate_evaluations.py [--dir data/evaluations] [--delete]
+
+Song evaluations keep their prompt, score, status and every song block; file
+analyses keep their score, file and feedback. A submission's time comes from
+the file name. Each file is imported once (its name is stored as the
+submission's source), so the migration can be re-run; --delete removes the
+files that are in the archive.
+"""
+import os
+import re
+import argparse
+from datetime import datetime
+
+from evaluation_archive import get_evaluation_archive, SONGS, ANALYSIS
+
+EVALUATIONS_DIR = os.path.join(os.path.dirname(__file__), 'data', 'evaluations')
+
+FILE_NAME = re.compile(r"_(\d{8}_\d{6})\.txt$")
+SONG_BLOCK = re.compile(r"^Song (\d+):\nLyrics: .*?\nExpected Genre: (.*?)\nPredicted Genre: (.*?)\nCorrect: (Yes|No)$",
+                        re.MULTILINE | re.DOTALL)
+
+
+def header(text, name):
+    match = re.search(rf"^{name}: (.*)$", text, re.MULTILINE)
+    return match.group(1) if match else None
+
+
+def parse_evaluation_file(path):
+    """
+    Parse one evaluation file.
+
+    Returns:
+        dict: EvaluationArchive.record keyword arguments (team, status, kind, created_at, ...)
+
+    Raises:
+        ValueError: the file is not an evaluation file
+    """
+    # older files were written in the platform encoding
+    with open(path, encoding="utf-8", errors="replace") as f:
+        text = f.read()
+    name = os.path.basename(path)
+    team = header(text, "Team")
+    stamp = FILE_NAME.search(name)
+    if team is None or stamp is None:
+        raise ValueError(f"Skipping {name}: not an evaluation file")
+    # the files were named after the server's local time
+    created_at = datetime.strptime(stamp.group(1), "%Y%m%d_%H%M%S").timestamp()
+    score = re.search(r"^Score: (\d+)", text, re.MULTILINE)
+    score = int(score.group(1)) if score else None
+
+    prompt = re.search(r"^Prompt: (.*?)\n\nDetailed Results:", text, re.MULTILINE | re.DOTALL)
+    if prompt is None:
+        # a file analysis (/api/analyze)
+        feedback = text.split("\nEvaluation:\n", 1)[1].rstrip("\n") if "\nEvaluation:\n" in text else None
+        return {"team": team, "status": "complete", "kind": ANALYSIS, "created_at": created_at, "score": score,
+                "details": {"file": header(text, "File"), "feedback": feedback}, "source": name}
+
+    results = [(int(song) - 1, expected, predicted, correct == "Yes")
+               for song, expected, predicted, correct in SONG_BLOCK.findall(text)]
+    counts = re.search(r"^Correct: (\d+)/(\d+)$", text, re.MULTILINE)
+    correct, total = (int(counts.group(1)), int(counts.group(2))) if counts else (None, None)
+    status_line = header(text, "Status") or ""
+    if status_line.startswith("estimate"):
+        status = "estimate"
+    elif status_line.startswith("incomplete") or (not status_line and counts is None):
+        status = "incomplete"
+    else:
+        status = "complete"
+    details = {"status": status_line} if status_line and status != "complete" else None
+    return {"team": team, "status": status, "kind": SONGS, "created_at": created_at, "prompt": prompt.group(1),
+            "score": score, "correct": correct, "total": total, "details": details, "results": results,
+            "source": name}
+
+
+def migrate(evaluations_dir=EVALUATIONS_DIR, archive=None, delete=False):
+    """
+    Import every evaluation file in evaluations_dir that is not archived yet.
+
+    Returns:
+        dict: counts of imported, already archived, skipped and deleted files
+    """
+    archive = archive or get_evaluation_archive()
+    counts = {"imported": 0, "already_archived": 0, "skipped": 0, "deleted": 0}
+    for name in sorted(os.listdir(evaluations_dir)):
+        path = os.path.join(evaluations_dir, name)
+        if not name.endswith(".txt"):
+            continue
+        if archive.has_source(name):
+            counts["already_archived"] += 1
+        else:
+            try:
+                submission = parse_evaluation_file(path)
+            except ValueError as e:
+                print(e)
+                counts["skipped"] += 1
+                continue
+            archive.record(**submission)
+            counts["imported"] += 1
+        if delete:
+            os.remove(path)
+            counts["deleted"] += 1
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import evaluation text files into the evaluation archive")
+    parser.add_argument("--dir", default=EVALUATIONS_DIR, help="directory of <team>_<timestamp>.txt files")
+    parser.add_argument("--delete", action="store_true", help="remove each file once it is in the archive")
+    args = parser.parse_args()
+
+    counts = migrate(args.dir, delete=args.delete)
+    print(", ".join(f"{count} {label.replace('_', ' ')}" for label, count in counts.items()))
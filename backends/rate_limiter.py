@@ -0,0 +1,186 @@
+"""
+Client-side rate limiting for model calls.
+
+Each model gets a RateLimiter with two token buckets: requests per minute
+and tokens per minute. A caller reserves one request plus its estimated
+tokens and sleeps only as long as the buckets need to refill, so calls run
+at the provider's ceiling instead of behind a fixed sleep. The buckets are
+corrected from the provider's x-ratelimit-* response headers (limits and
+remaining capacity, which also reflect other processes using the same key),
+and from the actual token usage reported with each completion.
+
+Failed calls with a 429, a 5xx or a connection error are retried with
+exponential backoff and full jitter, honouring Retry-After when present.
+
+Settings (environment variables):
+    OPENAI_RPM           starting requests-per-minute limit (default 500)
+    OPENAI_TPM           starting tokens-per-minute limit (default 200000)
+    OPENAI_MAX_RETRIES   retries after a rate-limit/server error (default 5)
+    OPENAI_RETRY_DELAY   base backoff delay in seconds (default 1.0)
+    OPENAI_MAX_BACKOFF   maximum backoff delay in seconds (default 60)
+"""
+import os
+import re
+import time
+import random
+import threading
+
+import openai
+
+# Completion tokens assumed for a request that sets no max_tokens
+DEFAULT_COMPLETION_TOKENS = 100
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_DURATION_SECONDS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+def parse_duration(value):
+    """Parse a reset duration like "1s", "6m0s" or "20ms" into seconds."""
+    if value is None:
+        return None
+    parts = _DURATION_PART.findall(str(value))
+    if not parts:
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    return sum(float(amount) * _DURATION_SECONDS[unit] for amount, unit in parts)
+
+
+def estimate_tokens(messages, **kwargs):
+    """Rough token count for a request: ~4 characters per token plus the expected completion."""
+    characters = sum(len(str(message.get("content") or "")) for message in messages)
+    completion = kwargs.get("max_completion_tokens") or kwargs.get("max_tokens") or DEFAULT_COMPLETION_TOKENS
+    return characters // 4 + 4 * len(messages) + completion
+
+
+class TokenBucket:
+    """Continuously refilling bucket; reservations may drive it negative, which callers wait out."""
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.tokens = float(per_minute)
+        self.updated = time.monotonic()
+
+    @property
+    def rate(self):
+        return self.capacity / 60.0
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount, now):
+        """Take amount from the bucket and return the seconds to wait before using it."""
+        self._refill(now)
+        self.tokens -= min(amount, self.capacity)
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def refund(self, amount, now):
+        self._refill(now)
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+    def observe(self, limit, remaining, now):
+        """Adopt the server's limit and never assume more capacity than it reports remaining."""
+        self._refill(now)
+        if limit:
+            self.capacity = float(limit)
+        if remaining is not None:
+            self.tokens = min(self.tokens, float(remaining))
+
+
+class RateLimiter:
+    """Requests-per-minute and tokens-per-minute limits for one model."""
+
+    def __init__(self, rpm, tpm, max_retries=5, base_delay=1.0, max_delay=60.0):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._lock = threading.Lock()
+
+    def reserve(self, tokens):
+        """Reserve one request and `tokens` tokens; return the seconds the caller must wait."""
+        with self._lock:
+            now = time.monotonic()
+            return max(self.requests.reserve(1, now), self.tokens.reserve(tokens, now))
+
+    def record_usage(self, estimated, actual):
+        """Correct the token bucket once a completion reports its real usage."""
+        if actual is None:
+            return
+        with self._lock:
+            now = time.monotonic()
+            if actual > estimated:
+                self.tokens.reserve(actual - estimated, now)
+            else:
+                self.tokens.refund(estimated - actual, now)
+
+    def update_from_headers(self, headers):
+        """Apply x-ratelimit-limit/remaining-{requests,tokens} headers from a response."""
+        if not headers:
+            return
+
+        def number(name):
+            value = headers.get(name)
+            try:
+                return float(value) if value is not None else None
+            except ValueError:
+                return None
+
+        with self._lock:
+            now = time.monotonic()
+            self.requests.observe(number("x-ratelimit-limit-requests"),
+                                  number("x-ratelimit-remaining-requests"), now)
+            self.tokens.observe(number("x-ratelimit-limit-tokens"),
+                                number("x-ratelimit-remaining-tokens"), now)
+
+    def backoff_delay(self, attempt, headers=None, base_delay=None):
+        """Seconds to wait before retry number `attempt` (0-based), honouring Retry-After."""
+        if headers:
+            if headers.get("retry-after-ms"):
+                try:
+                    return max(0.0, min(float(headers["retry-after-ms"]) / 1000, self.max_delay))
+                except ValueError:
+                    pass
+            retry_after = parse_duration(headers.get("retry-after"))
+            if retry_after is not None:
+                return min(retry_after, self.max_delay)
+        # exponential backoff with full jitter
+        base_delay = self.base_delay if base_delay is None else base_delay
+        return random.uniform(0, min(self.max_delay, base_delay * 2 ** attempt))
+
+
+def is_retryable(error):
+    """True for rate-limit, server and connection errors from the OpenAI client."""
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in (408, 429) or error.status_code >= 500
+    # APITimeoutError is a subclass
+    return isinstance(error, openai.APIConnectionError)
+
+
+def error_headers(error):
+    response = getattr(error, "response", None)
+    return getattr(response, "headers", None)
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(model):
+    """Return the shared limiter for a model."""
+    limiter = _limiters.get(model)
+    if limiter is None:
+        with _limiters_lock:
+            limiter = _limiters.get(model)
+            if limiter is None:
+                limiter = _limiters[model] = RateLimiter(
+                    rpm=float(os.getenv("OPENAI_RPM", 500)),
+                    tpm=float(os.getenv("OPENAI_TPM", 200000)),
+                    max_retries=int(os.getenv("OPENAI_MAX_RETRIES", 5)),
+                    base_delay=float(os.getenv("OPENAI_RETRY_DELAY", 1.0)),
+                    max_delay=float(os.getenv("OPENAI_MAX_BACKOFF", 60))
+                )
+    return limiter
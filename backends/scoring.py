@@ -0,0 +1,222 @@
+"""
+Genre matching for song evaluations.
+
+Predictions and expected genres are normalized in bulk: lower-cased, trimmed,
+surrounding quotes and punctuation removed, and genre aliases rewritten to one
+spelling ("Hip hop", "hiphop" and "rap" all become "hip-hop"). Inputs are
+factorized into integer codes, so each distinct string is normalized once and
+each distinct (expected, predicted) pair is compared once; real predictions
+repeat heavily, so a whole evaluation costs a few array operations. Matching:
+
+    exact     the normalized strings are equal
+    contains  either normalized string contains the other
+    fuzzy     Indel similarity 2 * LCS / (len(a) + len(b)) >= 0.8, the measure
+              difflib.SequenceMatcher.ratio() approximates
+
+An empty prediction never matches. Fuzzy matching uses rapidfuzz when it is
+installed and a vectorized NumPy implementation otherwise.
+
+is_correct_genre is the scalar version for callers that score one song at a
+time: the same normalization (cached per string) and comparisons, without
+building arrays. Like the original, it treats an unknown match method as no
+match, where match_genres raises ValueError.
+"""
+import re
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+try:
+    from rapidfuzz.distance import Indel
+    from rapidfuzz.process import cpdist
+except ImportError:
+    cpdist = None
+
+MATCH_METHODS = ("exact", "contains", "fuzzy")
+FUZZY_THRESHOLD = 0.8
+
+# alias -> canonical spelling; applied to whole words after lower-casing
+GENRE_ALIASES = {
+    "hip hop": "hip-hop",
+    "hip_hop": "hip-hop",
+    "hiphop": "hip-hop",
+    "hip-hop/rap": "hip-hop",
+    "hip hop/rap": "hip-hop",
+    "rap/hip-hop": "hip-hop",
+    "rap/hip hop": "hip-hop",
+    "rap": "hip-hop",
+    "r & b": "r&b",
+    "r and b": "r&b",
+    "r'n'b": "r&b",
+    "r n b": "r&b",
+    "rnb": "r&b",
+    "rhythm and blues": "r&b",
+    "rock and roll": "rock",
+    "rock 'n' roll": "rock",
+    "rock n roll": "rock",
+    "country and western": "country",
+    "pop music": "pop",
+}
+
+_ALIAS_PATTERN = re.compile(
+    r"(?<![\w&'-])(" + "|".join(re.escape(alias) for alias in sorted(GENRE_ALIASES, key=len, reverse=True))
+    + r")(?![\w&'-])"
+)
+_EDGE_PUNCTUATION = re.compile(r"^[\s\"'`*_.,:;!?()\[\]]+|[\s\"'`*_.,:;!?()\[\]]+$")
+_WHITESPACE = re.compile(r"\s+")
+
+
+@lru_cache(maxsize=65536)
+def normalize_genre(value):
+    """Normalize one genre string (see module docstring)."""
+    if value is None or value != value:  # None / NaN
+        return ""
+    value = _WHITESPACE.sub(" ", str(value).lower())
+    value = _EDGE_PUNCTUATION.sub("", value)
+    return _ALIAS_PATTERN.sub(lambda match: GENRE_ALIASES[match.group(1)], value)
+
+
+def _factorize(values):
+    """Return (codes, normalized distinct values) for an array of genre strings."""
+    codes, uniques = pd.factorize(np.asarray(values, dtype=object), use_na_sentinel=False)
+    return codes, [normalize_genre(value) for value in uniques]
+
+
+def normalize_genres(values):
+    """Normalize an array of genre strings, running normalize_genre once per distinct value."""
+    codes, normalized = _factorize(values)
+    return np.array(normalized, dtype=object)[codes] if len(codes) else np.array([], dtype=object)
+
+
+def _distinct_pairs(expected, predicted):
+    """
+    Reduce two aligned arrays to their distinct normalized (expected, predicted) pairs.
+
+    Returns:
+        tuple: (expected strings, predicted strings, inverse) where pair inverse[i]
+               is the pair of element i
+    """
+    if len(expected) != len(predicted):
+        raise ValueError("expected and predicted must have the same length")
+    expected_codes, expected_values = _factorize(expected)
+    predicted_codes, predicted_values = _factorize(predicted)
+    pair_codes = expected_codes.astype(np.int64) * max(1, len(predicted_values)) + predicted_codes
+    inverse, pairs = pd.factorize(pair_codes)
+    pairs_expected = [expected_values[code] for code in pairs // max(1, len(predicted_values))]
+    pairs_predicted = [predicted_values[code] for code in pairs % max(1, len(predicted_values))]
+    return pairs_expected, pairs_predicted, inverse
+
+
+def _lcs_lengths(a, b):
+    """Longest common subsequence length of each pair (a[i], b[i]), vectorized over pairs."""
+    n = len(a)
+    width_a = max((len(value) for value in a), default=0)
+    width_b = max((len(value) for value in b), default=0)
+    # code points, padded with values that never match each other
+    codes_a = np.full((n, width_a), -1, dtype=np.int64)
+    codes_b = np.full((n, width_b), -2, dtype=np.int64)
+    for i, (value_a, value_b) in enumerate(zip(a, b)):
+        codes_a[i, :len(value_a)] = [ord(c) for c in value_a]
+        codes_b[i, :len(value_b)] = [ord(c) for c in value_b]
+
+    previous = np.zeros((n, width_b + 1), dtype=np.int64)
+    for i in range(width_a):
+        current = np.zeros_like(previous)
+        equal = codes_b == codes_a[:, i:i + 1]
+        for j in range(width_b):
+            current[:, j + 1] = np.where(equal[:, j], previous[:, j] + 1,
+                                         np.maximum(previous[:, j + 1], current[:, j]))
+        previous = current
+    return previous[:, width_b]
+
+
+def _similarities(expected, predicted):
+    if cpdist is not None:
+        return np.asarray(cpdist(expected, predicted, scorer=Indel.normalized_similarity), dtype=float)
+    lengths = np.array([len(a) + len(b) for a, b in zip(expected, predicted)], dtype=float)
+    lcs = _lcs_lengths(expected, predicted)
+    return np.divide(2 * lcs, lengths, out=np.ones_like(lengths), where=lengths > 0)
+
+
+def similarity(expected, predicted):
+    """Indel similarity (0.0 to 1.0) of each normalized expected/predicted pair."""
+    pairs_expected, pairs_predicted, inverse = _distinct_pairs(expected, predicted)
+    if not len(inverse):
+        return np.array([], dtype=float)
+    return _similarities(pairs_expected, pairs_predicted)[inverse]
+
+
+def match_genres(expected, predicted, match_method="contains", threshold=FUZZY_THRESHOLD):
+    """
+    Compare arrays of expected and predicted genres.
+
+    Each distinct (expected, predicted) pair is normalized and compared once,
+    then the verdicts are spread back over the input with an index array.
+
+    Args:
+        expected: Sequence of expected genres
+        predicted: Sequence of predicted genres, same length
+        match_method (str): 'exact', 'contains' or 'fuzzy'
+        threshold (float): Minimum similarity for a fuzzy match
+
+    Returns:
+        numpy.ndarray: Boolean array, True where the prediction is correct
+    """
+    if match_method not in MATCH_METHODS:
+        raise ValueError(f"Unknown match method '{match_method}' (expected one of {', '.join(MATCH_METHODS)})")
+    pairs_expected, pairs_predicted, inverse = _distinct_pairs(expected, predicted)
+    if not len(inverse):
+        return np.zeros(0, dtype=bool)
+
+    pairs_expected = np.array(pairs_expected, dtype=str)
+    pairs_predicted = np.array(pairs_predicted, dtype=str)
+    if match_method == "exact":
+        correct = pairs_expected == pairs_predicted
+    elif match_method == "contains":
+        correct = (np.char.find(pairs_predicted, pairs_expected) >= 0) | \
+                  (np.char.find(pairs_expected, pairs_predicted) >= 0)
+    else:
+        correct = _similarities(list(pairs_expected), list(pairs_predicted)) >= threshold
+    correct &= np.char.str_len(pairs_predicted) > 0
+    return correct[inverse]
+
+
+def _lcs_length(a, b):
+    """Longest common subsequence length of two strings."""
+    previous = [0] * (len(b) + 1)
+    for char in a:
+        current = [0]
+        for j, other in enumerate(b):
+            current.append(previous[j] + 1 if char == other else max(previous[j + 1], current[j]))
+        previous = current
+    return previous[-1]
+
+
+def _pair_similarity(a, b):
+    """Indel similarity of two normalized strings."""
+    if cpdist is not None:
+        return Indel.normalized_similarity(a, b)
+    if not a and not b:
+        return 1.0
+    return 2 * _lcs_length(a, b) / (len(a) + len(b))
+
+
+def calculate_similarity(a, b):
+    """Similarity ratio (0.0 to 1.0) of two genre strings."""
+    return float(_pair_similarity(normalize_genre(a), normalize_genre(b)))
+
+
+def is_correct_genre(expected, predicted, match_method="contains", threshold=FUZZY_THRESHOLD):
+    """Check if one predicted genre matches the expected genre (match_genres for a single pair)."""
+    expected = normalize_genre(expected)
+    predicted = normalize_genre(predicted)
+    if not predicted:
+        return False
+    if match_method == "exact":
+        return expected == predicted
+    if match_method == "contains":
+        return expected in predicted or predicted in expected
+    if match_method == "fuzzy":
+        return _pair_similarity(expected, predicted) >= threshold
+    return False
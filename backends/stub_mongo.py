@@ -0,0 +1,138 @@
+import sys
+import struct
+import asyncio
+import argparse
+import datetime
+import threading
+
+import bson
+from bson.int64 import Int64
+
+OP_REPLY = 1
+OP_QUERY = 2004
+OP_MSG = 2013
+
+HANDSHAKE = {
+    "helloOk": True,
+    "isWritablePrimary": True,
+    "ismaster": True,
+    "maxBsonObjectSize": 16 * 1024 * 1024,
+    "maxMessageSizeBytes": 48000000,
+    "maxWriteBatchSize": 100000,
+    "logicalSessionTimeoutMinutes": 30,
+    "connectionId": 1,
+    "minWireVersion": 0,
+    "maxWireVersion": 21,
+    "readOnly": False,
+}
+
+
+def command_reply(command, documents, stats):
+    """Answer one command: a handshake, an acknowledged write or an empty cursor."""
+    name = next(iter(command), "")
+    if name.lower() in ("hello", "ismaster"):
+        return {**HANDSHAKE, "localTime": datetime.datetime.now(datetime.timezone.utc), "ok": 1.0}
+    if name in ("insert", "update", "delete"):
+        # the documents come in a kind-1 section, or inline in the command
+        field = {"insert": "documents", "update": "updates", "delete": "deletes"}[name]
+        count = len(documents.get(field) or command.get(field) or [])
+        stats[name] = stats.get(name, 0) + 1
+        stats["documents"] = stats.get("documents", 0) + count
+        return {"n": count, "ok": 1.0}
+    if name in ("find", "aggregate"):
+        return {"cursor": {"id": Int64(0), "ns": f"{command.get('$db', 'test')}.{command[name]}", "firstBatch": []},
+                "ok": 1.0}
+    return {"ok": 1.0}
+
+
+def parse_op_msg(body):
+    """Return (command, {identifier: [documents]}) from an OP_MSG body (after the header)."""
+    flags, = struct.unpack_from("<I", body)
+    end = len(body) - (4 if flags & 1 else 0)  # trailing checksum
+    offset = 4
+    command, documents = {}, {}
+    while offset < end:
+        kind = body[offset]
+        offset += 1
+        size, = struct.unpack_from("<i", body, offset)
+        if kind == 0:
+            command = bson.decode(body[offset:offset + size])
+        else:
+            identifier_end = body.index(b"\x00", offset + 4)
+            identifier = body[offset + 4:identifier_end].decode()
+            documents[identifier] = bson.decode_all(body[identifier_end + 1:offset + size])
+        offset += size
+    return command, documents
+
+
+def create_server(stats):
+    """Return an asyncio connection handler speaking just enough of the MongoDB wire protocol."""
+    request_ids = iter(range(1, 2 ** 31))
+
+    async def handle(reader, writer):
+        try:
+            while True:
+                header = await reader.readexactly(16)
+                length, request_id, _, opcode = struct.unpack("<iiii", header)
+                body = await reader.readexactly(length - 16)
+                if opcode == OP_MSG:
+                    command, documents = parse_op_msg(body)
+                    payload = struct.pack("<IB", 0, 0) + bson.encode(command_reply(command, documents, stats))
+                    reply_opcode = OP_MSG
+                elif opcode == OP_QUERY:
+                    # legacy handshake: flags, cstring namespace, skip, limit, query document
+                    namespace_end = body.index(b"\x00", 4)
+                    command = bson.decode_all(body[namespace_end + 9:])[0]
+                    reply = bson.encode(command_reply(command, {}, stats))
+                    payload = struct.pack("<iqii", 0, 0, 0, 1) + reply
+                    reply_opcode = OP_REPLY
+                else:
+                    break
+                writer.write(struct.pack("<iiii", 16 + len(payload), next(request_ids), request_id, reply_opcode)
+                             + payload)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    return handle
+
+
+def start_in_thread(host="127.0.0.1", port=0):
+    """
+    Run the stub MongoDB server on a background thread.
+
+    Returns:
+        tuple: (MongoDB URI to use as MONGO_URI, stats dict of writes received)
+    """
+    loop = asyncio.new_event_loop()
+    started = threading.Event()
+    stats = {}
+    state = {}
+
+    async def serve():
+        server = await asyncio.start_server(create_server(stats), host, port)
+        state["port"] = server.sockets[0].getsockname()[1]
+        started.set()
+
+    def run():
+        asyncio.set_event_loop(loop)
+        loop.run_until_complete(serve())
+        loop.run_forever()
+
+    threading.Thread(target=run, daemon=True).start()
+    started.wait()
+    return f"mongodb://{host}:{state['port']}/?directConnection=true", stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local MongoDB wire-protocol stub that acknowledges every write")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=27018)
+    args = parser.parse_args()
+
+    print(f"Stub MongoDB on mongodb://{args.host}:{args.port}/?directConnection=true", file=sys.stderr)
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(asyncio.start_server(create_server({}), args.host, args.port))
+    loop.run_forever()
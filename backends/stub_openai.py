@@ -0,0 +1,339 @@
+import re
+import sys
+import math
+import json
+import time
+import uuid
+import asyncio
+import random
+import hashlib
+import argparse
+import threading
+import collections
+from aiohttp import web
+
+GENRES = ["Hip-Hop", "Pop", "Country", "Rock", "R&B"]
+DISTRIBUTIONS = ("fixed", "uniform", "lognormal", "exponential")
+
+
+_SONG_HEADER = re.compile(r"^### Song (\d+)[ \t]*$", re.MULTILINE)
+_LYRICS_HEADER = re.compile(r"^### Lyrics[ \t]*\n", re.MULTILINE)
+
+
+def stub_classify(lyrics):
+    """Deterministic stand-in for a model's genre answer: pick a genre from a hash of the lyrics."""
+    digest = hashlib.sha256(lyrics.strip().encode("utf-8")).digest()
+    return GENRES[digest[0] % len(GENRES)]
+
+
+def stub_classify_in_batch(lyrics, batch_size, batch_noise=0.0):
+    """
+    stub_classify() for a song answered as one of batch_size songs. A batch_noise
+    fraction of the songs get another genre, picked from a hash of the lyrics and
+    the batch size, so batch answers can disagree with single-song ones the way a
+    model's do, and the same batch size always disagrees on the same songs.
+    """
+    genre = stub_classify(lyrics)
+    if not batch_noise:
+        return genre
+    digest = hashlib.sha256(f"{batch_size}\x1f{lyrics.strip()}".encode("utf-8")).digest()
+    if int.from_bytes(digest[:4], "big") / 2 ** 32 >= batch_noise:
+        return genre
+    others = [other for other in GENRES if other != genre]
+    return others[digest[4] % len(others)]
+
+
+def stub_reply(messages, json_mode=False, batch_noise=0.0):
+    """
+    Answer a request the way the evaluation expects.
+
+    A single-song request gets a genre for the first paragraph of its lyrics,
+    whatever the layout: "<lyrics>\n\n<prompt>", "<prompt>\n\n### Lyrics\n<lyrics>"
+    or the lyrics alone after a system prompt. In JSON mode, every "### Song N" block of a batch request gets a
+    {"id", "genre"} entry, with the same genre the single-song request would get
+    except for a batch_noise fraction of the songs (see stub_classify_in_batch).
+    """
+    content = str(messages[-1].get("content", "")) if messages else ""
+    if content.startswith("Echo: "):
+        # lets chat tests ask for a reply of a chosen length
+        return content[len("Echo: "):]
+    if json_mode:
+        parts = _SONG_HEADER.split(content)
+        # parts: [preamble, number, lyrics, number, lyrics, ...]
+        songs = list(zip(parts[1::2], parts[2::2]))
+        predictions = [{"id": int(number), "genre": stub_classify_in_batch(lyrics, len(songs), batch_noise)}
+                       for number, lyrics in songs]
+        return json.dumps({"predictions": predictions})
+    header = _LYRICS_HEADER.search(content)
+    if header:
+        content = content[header.end():]
+    return stub_classify(content.split("\n\n")[0])
+
+
+class PromptCache:
+    """
+    Prompt prefix caching the way the provider reports it: a request whose first
+    1024+ tokens match an earlier request's has the matching prefix, in 128-token
+    steps, counted as cached_tokens. Only the accounting is simulated; the stub's
+    latency does not depend on it.
+    """
+
+    BLOCK_CHARS = 128 * 4
+    MIN_CHARS = 1024 * 4
+
+    def __init__(self, max_entries=100000):
+        self.max_entries = max_entries
+        self._seen = collections.OrderedDict()
+
+    def lookup(self, messages):
+        """Return the cached tokens of this request's prompt and remember its prefixes."""
+        text = "".join(f"{message.get('role')}\x1e{message.get('content') or ''}\x1f" for message in messages)
+        # one running hash per block boundary, so a key stands for the whole prefix up to it
+        digest = hashlib.sha256()
+        matched = 0
+        for end in range(self.BLOCK_CHARS, len(text) + 1, self.BLOCK_CHARS):
+            digest.update(text[end - self.BLOCK_CHARS:end].encode("utf-8"))
+            key = digest.copy().digest()
+            if key in self._seen:
+                matched = end
+            self._seen[key] = True
+            self._seen.move_to_end(key)
+        while len(self._seen) > self.max_entries:
+            self._seen.popitem(last=False)
+        return matched // 4 if matched >= self.MIN_CHARS else 0
+
+
+def stub_usage(messages, content, cached_tokens=0):
+    """Token counts at ~4 characters per token, so usage accounting has something to count."""
+    prompt_tokens = sum(len(str(message.get("content") or "")) for message in messages) // 4 + 4 * len(messages)
+    completion_tokens = max(1, len(content) // 4)
+    return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "prompt_tokens_details": {"cached_tokens": min(cached_tokens, prompt_tokens)}}
+
+
+def completion_body(model, content, usage=None):
+    """Build a chat.completion response body in the OpenAI format."""
+    return {
+        "id": f"chatcmpl-stub-{uuid.uuid4().hex}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": content},
+            "finish_reason": "stop"
+        }],
+        "usage": usage or {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+    }
+
+
+def chunk_body(completion_id, model, delta=None, usage=None):
+    """Build one chat.completion.chunk of a streamed response."""
+    return {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [] if delta is None else [{"index": 0, "delta": delta, "finish_reason": None}],
+        "usage": usage
+    }
+
+
+def sample_latency(rng, distribution, latency, spread):
+    """
+    Draw one request's latency.
+
+    fixed: always `latency`; uniform: latency * (1 ± spread); lognormal: median
+    `latency` with shape `spread` (a long right tail, like real model calls);
+    exponential: mean `latency`.
+    """
+    if distribution == "uniform":
+        return max(0.0, rng.uniform(latency * (1 - spread), latency * (1 + spread)))
+    if distribution == "lognormal":
+        return rng.lognormvariate(math.log(latency), spread) if latency > 0 else 0.0
+    if distribution == "exponential":
+        return rng.expovariate(1 / latency) if latency > 0 else 0.0
+    return latency
+
+
+def error_body(message, error_type, code):
+    return {"error": {"message": message, "type": error_type, "param": None, "code": code}}
+
+
+def create_app(latency=0.2, token_latency=0.0, distribution="fixed", spread=0.5, error_rate=0.0,
+               rate_limit_rate=0.0, rpm=None, retry_after=1.0, seed=None, batch_noise=0.0):
+    """
+    Create a local OpenAI-compatible completion server.
+
+    Args:
+        latency (float): Seconds each completion request waits before answering
+            (the median/mean of `distribution`)
+        token_latency (float): Further seconds per word of the reply; a streamed
+            request receives each word as it is "generated"
+        distribution (str): How latency varies per request: one of DISTRIBUTIONS
+        spread (float): Width of the uniform/lognormal distributions
+        error_rate (float): Fraction of requests answered with a 500
+        rate_limit_rate (float): Fraction of requests answered with a 429
+        rpm (int): Requests per minute accepted before answering 429, like the
+            provider's limit; every response then carries x-ratelimit-* headers
+        retry_after (float): retry-after seconds sent with random 429s
+        seed (int): Seed for the latency, error and 429 draws
+        batch_noise (float): Fraction of the songs in a batch request answered
+            with a different genre than their single-song request gets
+
+    Returns:
+        aiohttp.web.Application
+    """
+    if distribution not in DISTRIBUTIONS:
+        raise ValueError(f"distribution must be one of {', '.join(DISTRIBUTIONS)}")
+    stats = {"requests": 0, "errors": 0, "rate_limited": 0, "prompt_tokens": 0, "cached_tokens": 0}
+    rng = random.Random(seed)
+    prompt_cache = PromptCache()
+    # start times of the requests accepted in the last minute, for the rpm limit
+    window = collections.deque()
+
+    def rate_limit_headers(now):
+        if rpm is None:
+            return {}
+        reset = 60 - (now - window[0]) if window else 0.0
+        return {
+            "x-ratelimit-limit-requests": str(rpm),
+            "x-ratelimit-remaining-requests": str(max(0, rpm - len(window))),
+            "x-ratelimit-reset-requests": f"{reset:.3f}s",
+        }
+
+    def refuse(now):
+        """Return a 429/500 response if this request is rejected, else None (and count it in the window)."""
+        if rpm is not None:
+            while window and now - window[0] >= 60:
+                window.popleft()
+            if len(window) >= rpm:
+                stats["rate_limited"] += 1
+                headers = {**rate_limit_headers(now), "retry-after": f"{60 - (now - window[0]):.3f}"}
+                return web.json_response(error_body("Rate limit reached for requests", "requests",
+                                                    "rate_limit_exceeded"), status=429, headers=headers)
+            window.append(now)
+        if rate_limit_rate and rng.random() < rate_limit_rate:
+            stats["rate_limited"] += 1
+            return web.json_response(error_body("Rate limit reached for requests", "requests", "rate_limit_exceeded"),
+                                     status=429, headers={**rate_limit_headers(now), "retry-after": str(retry_after)})
+        if error_rate and rng.random() < error_rate:
+            stats["errors"] += 1
+            return web.json_response(error_body("The server had an error while processing your request.",
+                                                "server_error", None), status=500)
+        return None
+
+    async def stream_reply(request, model, content, usage, headers):
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream", **headers})
+        await response.prepare(request)
+        completion_id = f"chatcmpl-stub-{uuid.uuid4().hex}"
+
+        async def send(chunk):
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+
+        await send(chunk_body(completion_id, model, {"role": "assistant", "content": ""}))
+        for word in re.findall(r"\s*\S+", content) or [content]:
+            await asyncio.sleep(token_latency)
+            await send(chunk_body(completion_id, model, {"content": word}))
+        await send(chunk_body(completion_id, model, usage=usage))
+        await response.write(b"data: [DONE]\n\n")
+        return response
+
+    async def chat_completions(request):
+        body = await request.json()
+        stats["requests"] += 1
+        now = time.monotonic()
+        refused = refuse(now)
+        if refused is not None:
+            return refused
+        headers = rate_limit_headers(now)
+        await asyncio.sleep(sample_latency(rng, distribution, latency, spread))
+        json_mode = (body.get("response_format") or {}).get("type") == "json_object"
+        content = stub_reply(body.get("messages", []), json_mode=json_mode, batch_noise=batch_noise)
+        model = body.get("model", "stub")
+        usage = stub_usage(body.get("messages", []), content, prompt_cache.lookup(body.get("messages", [])))
+        stats["prompt_tokens"] += usage["prompt_tokens"]
+        stats["cached_tokens"] += usage["prompt_tokens_details"]["cached_tokens"]
+        if body.get("stream"):
+            return await stream_reply(request, model, content, usage, headers)
+        await asyncio.sleep(token_latency * len(content.split()))
+        return web.json_response(completion_body(model, content, usage), headers=headers)
+
+    async def get_stats(request):
+        return web.json_response(stats)
+
+    app = web.Application()
+    app.router.add_post("/v1/chat/completions", chat_completions)
+    # Request, error, 429 and prompt/cached token counters for benchmarks: GET <base_url>/stub/stats
+    app.router.add_get("/v1/stub/stats", get_stats)
+    return app
+
+
+def start_in_thread(latency=0.2, host="127.0.0.1", port=0, **options):
+    """
+    Run the stub server on a background thread.
+
+    Args:
+        latency (float): Seconds per completion
+        **options: The other create_app arguments (distribution, error_rate, rpm...)
+
+    Returns:
+        str: Base URL to pass to the OpenAI client (e.g. "http://127.0.0.1:8001/v1")
+    """
+    loop = asyncio.new_event_loop()
+    started = threading.Event()
+    state = {}
+
+    async def serve():
+        runner = web.AppRunner(create_app(latency, **options))
+        await runner.setup()
+        site = web.TCPSite(runner, host, port)
+        await site.start()
+        state["port"] = site._server.sockets[0].getsockname()[1]
+        started.set()
+
+    def run():
+        asyncio.set_event_loop(loop)
+        loop.run_until_complete(serve())
+        loop.run_forever()
+
+    threading.Thread(target=run, daemon=True).start()
+    started.wait()
+    return f"http://{host}:{state['port']}/v1"
+
+
+def add_stub_arguments(parser):
+    """Add the stub's latency, error and 429 options to an argparse parser (shared with the benchmarks)."""
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds per completion (median/mean)")
+    parser.add_argument("--token-latency", type=float, default=0.0, help="further seconds per word of the reply")
+    parser.add_argument("--distribution", choices=DISTRIBUTIONS, default="fixed", help="latency distribution")
+    parser.add_argument("--spread", type=float, default=0.5, help="width of the uniform/lognormal distribution")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with a 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="fraction of requests answered with a 429")
+    parser.add_argument("--rpm", type=int, help="requests per minute before answering 429 (default unlimited)")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="retry-after seconds of random 429s")
+    parser.add_argument("--seed", type=int, help="seed for the latency, error and 429 draws")
+    parser.add_argument("--batch-noise", type=float, default=0.0,
+                        help="fraction of batched songs answered differently than when sent alone")
+
+
+def stub_options(args):
+    """Return the create_app keyword arguments (besides latency) from parsed add_stub_arguments options."""
+    return {
+        "token_latency": args.token_latency, "distribution": args.distribution, "spread": args.spread,
+        "error_rate": args.error_rate, "rate_limit_rate": args.rate_limit_rate, "rpm": args.rpm,
+        "retry_after": args.retry_after, "seed": args.seed, "batch_noise": args.batch_noise,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local OpenAI-compatible stub completion server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    add_stub_arguments(parser)
+    args = parser.parse_args()
+
+    print(f"Stub server on http://{args.host}:{args.port}/v1 (latency {args.latency}s {args.distribution})",
+          file=sys.stderr)
+    web.run_app(create_app(args.latency, **stub_options(args)), host=args.host, port=args.port, print=None)
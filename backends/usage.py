@@ -0,0 +1,557 @@
+"""
+Token usage accounting per team, submission, model and endpoint, with optional per-team quotas.
+
+completions.py reports every model call here (record_model_call), including
+the ones answered from the completion cache, which cost nothing. Calls are
+attributed to the usage scope they run in: the request hooks open one per
+HTTP request with the route as endpoint, and evaluations and analyses open
+their own with the team and the submission:
+
+    with usage_scope(endpoint="evaluate-songs", team=team_name, submission_id=submission_id) as scope:
+        ...
+    scope.totals()      # what that submission used
+
+Counts are summed in memory and upserted every USAGE_FLUSH_SECONDS into a
+SQLite table with one row per hour, team, submission, model and endpoint,
+so a 200-song evaluation adds one row, not 200. Prompt tokens the provider
+served from its prompt cache are counted as cached_tokens (they are part of
+prompt_tokens) and priced at the cached input rate. Costs are computed when
+a report is read, from USAGE_PRICES.
+
+With USAGE_TEAM_QUOTA (or a per-team USAGE_TEAM_QUOTAS entry) set, a team
+may use that many tokens per UTC day. Work is admitted with reserve_quota()
+before it is dispatched, with an estimate of the tokens it will use; the
+estimates of work still running count against the quota too, so concurrent
+submissions cannot overshoot it together. Over quota, QuotaExceededError is
+raised and the endpoints answer 429.
+
+Settings (environment variables):
+    USAGE                 set to 0 to disable usage accounting and quotas (default 1)
+    USAGE_DB              SQLite file (default data/usage.sqlite3)
+    USAGE_FLUSH_SECONDS   how often counts are written to SQLite (default 5)
+    USAGE_PRICES          "model=input/output;..." or "model=input/cached/output;..." USD per million
+                          tokens (defaults in PRICES; cached input defaults to half the input price)
+    USAGE_TEAM_QUOTA      tokens per team per UTC day (default 0, unlimited)
+    USAGE_TEAM_QUOTAS     per-team quotas as "team=tokens;team=tokens", overriding USAGE_TEAM_QUOTA
+"""
+import os
+import asyncio
+import atexit
+import sqlite3
+import threading
+import contextlib
+import contextvars
+from datetime import datetime, timedelta, timezone
+
+DEFAULT_PATH = os.path.join(os.path.dirname(__file__), 'data', 'usage.sqlite3')
+
+# USD per million (input, cached input, output) tokens
+PRICES = {
+    "gpt-4o-mini": (0.15, 0.075, 0.60),
+    "gpt-4o": (2.50, 1.25, 10.00),
+}
+
+KEY_COLUMNS = ["hour", "team", "submission_id", "model", "endpoint"]
+COUNT_COLUMNS = ["calls", "cache_hits", "prompt_tokens", "completion_tokens", "cached_tokens"]
+
+# what GET /api/usage can group by, as SQL over the usage table
+GROUPS = {
+    "hour": "hour",
+    "day": "substr(hour, 1, 10)",
+    "month": "substr(hour, 1, 7)",
+    "team": "team",
+    "submission_id": "submission_id",
+    "model": "model",
+    "endpoint": "endpoint",
+}
+
+
+class UsageQueryError(ValueError):
+    """Raised for a report parameter that cannot be used (bad group or date)."""
+
+
+class QuotaExceededError(Exception):
+    """Raised when admitting work would take a team over its token quota."""
+
+    def __init__(self, message, details):
+        super().__init__(message)
+        self.details = details
+
+
+def parse_prices(value):
+    """Parse "model=input/output;..." or "model=input/cached/output;..." into {model: (input, cached, output)}."""
+    prices = dict(PRICES)
+    for entry in (value or "").split(";"):
+        if not entry.strip():
+            continue
+        model, _, rates = entry.partition("=")
+        rates = [float(rate) for rate in rates.split("/")]
+        if len(rates) == 2:
+            rates = [rates[0], rates[0] / 2, rates[1]]
+        prices[model.strip()] = tuple(rates)
+    return prices
+
+
+def parse_quotas(value):
+    """Parse "team=tokens;team=tokens" into {team: tokens}."""
+    quotas = {}
+    for entry in (value or "").split(";"):
+        if not entry.strip():
+            continue
+        team, _, tokens = entry.rpartition("=")
+        quotas[team.strip()] = int(tokens)
+    return quotas
+
+
+def cost(model, prompt_tokens, completion_tokens, cached_tokens=0, prices=None):
+    """Return the USD cost of the tokens (cached_tokens are part of prompt_tokens), or None for an unpriced model."""
+    prices = PRICES if prices is None else prices
+    if model not in prices:
+        return None
+    input_price, cached_price, output_price = prices[model]
+    return ((prompt_tokens - cached_tokens) * input_price + cached_tokens * cached_price
+            + completion_tokens * output_price) / 1_000_000
+
+
+def parse_date(value, name):
+    if value is None or value == "":
+        return None
+    try:
+        date = datetime.fromisoformat(value)
+    except ValueError:
+        raise UsageQueryError(f"{name} must be an ISO 8601 date or datetime")
+    return date.astimezone(timezone.utc) if date.tzinfo else date
+
+
+def hour_bucket(moment=None):
+    return (moment or datetime.now(timezone.utc)).strftime("%Y-%m-%dT%H")
+
+
+class UsageScope:
+    """Who the model calls made in it are billed to, and what they have used so far."""
+
+    def __init__(self, endpoint="", team="", submission_id=""):
+        self.endpoint = endpoint or ""
+        self.team = team or ""
+        self.submission_id = submission_id or ""
+        self.counts = dict.fromkeys(COUNT_COLUMNS, 0)
+        self.costs = 0.0
+        self.token = None
+        self._lock = threading.Lock()
+
+    def add(self, counts, call_cost):
+        with self._lock:
+            for column in COUNT_COLUMNS:
+                self.counts[column] += counts[column]
+            self.costs += call_cost or 0.0
+
+    def tokens(self):
+        with self._lock:
+            return self.counts["prompt_tokens"] + self.counts["completion_tokens"]
+
+    def totals(self):
+        with self._lock:
+            return {
+                "submission_id": self.submission_id or None,
+                **self.counts,
+                "total_tokens": self.counts["prompt_tokens"] + self.counts["completion_tokens"],
+                "cost_usd": round(self.costs, 6),
+            }
+
+
+_scope = contextvars.ContextVar("usage_scope", default=None)
+
+
+@contextlib.contextmanager
+def usage_scope(**fields):
+    """
+    Attribute the model calls made inside the block (and in tasks started from it).
+
+    Args:
+        **fields: endpoint, team and/or submission_id; the ones not given are kept from the enclosing scope
+
+    Yields:
+        UsageScope: its totals() are the usage of the block alone
+    """
+    scope = enter_scope(**fields)
+    try:
+        yield scope
+    finally:
+        exit_scope(scope)
+
+
+def enter_scope(**fields):
+    """usage_scope() for code that cannot use a with block; close it with exit_scope() in the same context."""
+    parent = _scope.get()
+    inherited = {key: getattr(parent, key) for key in ("endpoint", "team", "submission_id")} if parent else {}
+    scope = UsageScope(**{**inherited, **{key: value for key, value in fields.items() if value is not None}})
+    scope.token = _scope.set(scope)
+    return scope
+
+
+def exit_scope(scope):
+    _scope.reset(scope.token)
+
+
+def bind_scope(iterator):
+    """
+    Run each step of a generator in the usage scope that is current now.
+
+    A streamed response is iterated after its view has returned and left the
+    request's scope; the model call behind it is still billed to the request.
+    """
+    scope = _scope.get()
+
+    def steps():
+        try:
+            while True:
+                token = _scope.set(scope)
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    _scope.reset(token)
+                yield item
+        finally:
+            token = _scope.set(scope)
+            try:
+                getattr(iterator, "close", lambda: None)()
+            finally:
+                _scope.reset(token)
+
+    return steps()
+
+
+def asy_bind_scope(iterator):
+    """bind_scope for async generators."""
+    scope = _scope.get()
+
+    async def steps():
+        try:
+            while True:
+                token = _scope.set(scope)
+                try:
+                    item = await iterator.__anext__()
+                except StopAsyncIteration:
+                    return
+                finally:
+                    _scope.reset(token)
+                yield item
+        finally:
+            token = _scope.set(scope)
+            try:
+                await iterator.aclose()
+            finally:
+                _scope.reset(token)
+
+    return steps()
+
+
+class Reservation:
+    """Tokens held against a team's quota while admitted work runs; what it has used is subtracted."""
+
+    def __init__(self, store, team, tokens, scope):
+        self.store = store
+        self.team = team
+        self.tokens = tokens
+        self.scope = scope
+
+    def outstanding(self):
+        used = self.scope.tokens() if self.scope is not None else 0
+        return max(0, self.tokens - used)
+
+    def release(self):
+        if self.store is not None:
+            self.store.release(self)
+            self.store = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+
+
+class UsageStore:
+    """Hourly usage rows in SQLite, fed from in-memory counts, and the quota checks that read them."""
+
+    def __init__(self, path=DEFAULT_PATH, flush_seconds=5.0, prices=None, default_quota=0, quotas=None):
+        self.path = path
+        self.flush_seconds = flush_seconds
+        self.prices = PRICES if prices is None else prices
+        self.default_quota = default_quota
+        self.quotas = quotas or {}
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        self._reservations = {}
+        self._reserve_lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS usage ("
+            "hour TEXT NOT NULL, team TEXT NOT NULL, submission_id TEXT NOT NULL, model TEXT NOT NULL, "
+            "endpoint TEXT NOT NULL, calls INTEGER NOT NULL, cache_hits INTEGER NOT NULL, "
+            "prompt_tokens INTEGER NOT NULL, completion_tokens INTEGER NOT NULL, "
+            "cached_tokens INTEGER NOT NULL DEFAULT 0, "
+            "PRIMARY KEY (hour, team, submission_id, model, endpoint)) WITHOUT ROWID"
+        )
+        columns = [row[1] for row in self._db.execute("PRAGMA table_info(usage)")]
+        if "cached_tokens" not in columns:
+            self._db.execute("ALTER TABLE usage ADD COLUMN cached_tokens INTEGER NOT NULL DEFAULT 0")
+        # the quota check sums one team's rows since midnight
+        self._db.execute("CREATE INDEX IF NOT EXISTS usage_team_hour ON usage (team, hour)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS usage_submission ON usage (submission_id)")
+
+    def record(self, model, prompt_tokens=0, completion_tokens=0, cached_tokens=0, cache_hit=False, scope=None):
+        """Count one model call; it reaches SQLite with the next flush."""
+        scope = scope if scope is not None else (_scope.get() or UsageScope())
+        counts = {
+            "calls": 1,
+            "cache_hits": 1 if cache_hit else 0,
+            "prompt_tokens": 0 if cache_hit else prompt_tokens,
+            "completion_tokens": 0 if cache_hit else completion_tokens,
+            "cached_tokens": 0 if cache_hit else cached_tokens,
+        }
+        scope.add(counts, cost(model, counts["prompt_tokens"], counts["completion_tokens"], counts["cached_tokens"],
+                               self.prices))
+        key = (hour_bucket(), scope.team, scope.submission_id, model, scope.endpoint)
+        with self._pending_lock:
+            pending = self._pending.setdefault(key, dict.fromkeys(COUNT_COLUMNS, 0))
+            for column in COUNT_COLUMNS:
+                pending[column] += counts[column]
+        self._start()
+
+    def flush(self):
+        """Write the counts collected since the last flush."""
+        with self._pending_lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        rows = [(*key, *(counts[column] for column in COUNT_COLUMNS)) for key, counts in pending.items()]
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._db.executemany(
+                    f"INSERT INTO usage ({', '.join(KEY_COLUMNS + COUNT_COLUMNS)}) "
+                    f"VALUES ({', '.join('?' for _ in KEY_COLUMNS + COUNT_COLUMNS)}) "
+                    f"ON CONFLICT ({', '.join(KEY_COLUMNS)}) DO UPDATE SET "
+                    + ", ".join(f"{column} = {column} + excluded.{column}" for column in COUNT_COLUMNS),
+                    rows
+                )
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def close(self):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(self.flush_seconds + 5)
+        self.flush()
+
+    def report(self, group_by=("team", "model"), team=None, submission_id=None, endpoint=None, since=None,
+               until=None):
+        """
+        Sum usage by the given groups.
+
+        Args:
+            group_by: names from GROUPS
+            team, submission_id, endpoint: optional equality filters
+            since, until: optional datetimes (UTC when naive), to the hour; since is inclusive, until exclusive
+
+        Returns:
+            list: one dict per group with the group values, calls, cache_hits, prompt_tokens,
+                completion_tokens, cached_tokens, total_tokens and cost_usd (None if a model has no price); most tokens first
+        """
+        unknown = [group for group in group_by if group not in GROUPS]
+        if unknown:
+            raise UsageQueryError(f"group_by must be made of {', '.join(GROUPS)}")
+        self.flush()
+
+        conditions, parameters = [], []
+        for column, value in (("team", team), ("submission_id", submission_id), ("endpoint", endpoint)):
+            if value is not None:
+                conditions.append(f"{column} = ?")
+                parameters.append(value)
+        if since is not None:
+            conditions.append("hour >= ?")
+            parameters.append(hour_bucket(since))
+        if until is not None:
+            conditions.append("hour < ?")
+            parameters.append(hour_bucket(until))
+
+        # grouped by model as well, since the price depends on it; folded back below
+        expressions = [GROUPS[group] for group in group_by] + ["model"]
+        query = (f"SELECT {', '.join(expressions)}, " + ", ".join(f"SUM({column})" for column in COUNT_COLUMNS)
+                 + " FROM usage" + (f" WHERE {' AND '.join(conditions)}" if conditions else "")
+                 + f" GROUP BY {', '.join(expressions)}")
+        with self._lock:
+            rows = self._db.execute(query, parameters).fetchall()
+
+        groups = {}
+        for row in rows:
+            values, model = row[:len(group_by)], row[len(group_by)]
+            counts = dict(zip(COUNT_COLUMNS, row[len(group_by) + 1:]))
+            entry = groups.setdefault(values, {**dict(zip(group_by, values)), **dict.fromkeys(COUNT_COLUMNS, 0),
+                                               "cost_usd": 0.0})
+            for column, count in counts.items():
+                entry[column] += count
+            row_cost = cost(model, counts["prompt_tokens"], counts["completion_tokens"], counts["cached_tokens"],
+                            self.prices)
+            entry["cost_usd"] = None if row_cost is None or entry["cost_usd"] is None else entry["cost_usd"] + row_cost
+
+        report = []
+        for entry in groups.values():
+            entry["total_tokens"] = entry["prompt_tokens"] + entry["completion_tokens"]
+            if entry["cost_usd"] is not None:
+                entry["cost_usd"] = round(entry["cost_usd"], 6)
+            report.append(entry)
+        report.sort(key=lambda entry: -entry["total_tokens"])
+        return report
+
+    def quota(self, team):
+        """Return the team's tokens per UTC day, or None if it is unlimited."""
+        quota = self.quotas.get(team, self.default_quota)
+        return quota if quota and quota > 0 else None
+
+    def quota_status(self, team, now=None):
+        """Return the team's quota, tokens used today, tokens reserved by running work and when the day resets."""
+        now = now or datetime.now(timezone.utc)
+        midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        self.flush()
+        with self._lock:
+            used = self._db.execute(
+                "SELECT COALESCE(SUM(prompt_tokens + completion_tokens), 0) FROM usage WHERE team = ? AND hour >= ?",
+                (team, hour_bucket(midnight))
+            ).fetchone()[0]
+        with self._pending_lock:
+            reserved = sum(reservation.outstanding() for reservation in self._reservations.get(team, []))
+        quota = self.quota(team)
+        resets_at = midnight + timedelta(days=1)
+        return {
+            "team": team,
+            "quota": quota,
+            "used": used,
+            "reserved": reserved,
+            "remaining": None if quota is None else max(0, quota - used - reserved),
+            "resets_at": resets_at.isoformat(),
+            "retry_after": int((resets_at - now).total_seconds()) + 1,
+        }
+
+    def reserve(self, team, tokens):
+        """Admit work estimated at `tokens` for the team, or raise QuotaExceededError."""
+        if self.quota(team) is None:
+            return Reservation(None, team, tokens, None)
+        # check and reserve under one lock, so two submissions cannot both take the last of the quota
+        with self._reserve_lock:
+            status = self.quota_status(team)
+            if tokens > status["remaining"] or status["remaining"] <= 0:
+                raise QuotaExceededError(
+                    f"Team '{team}' has used {status['used']} of its {status['quota']} tokens for today "
+                    f"({status['reserved']} more are reserved by running work); this needs about {tokens}",
+                    {**status, "requested": tokens}
+                )
+            reservation = Reservation(self, team, tokens, _scope.get())
+            with self._pending_lock:
+                self._reservations.setdefault(team, []).append(reservation)
+        return reservation
+
+    def release(self, reservation):
+        with self._pending_lock:
+            reservations = self._reservations.get(reservation.team, [])
+            if reservation in reservations:
+                reservations.remove(reservation)
+
+    def _start(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="usage-flush", daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while not self._stopping.wait(self.flush_seconds):
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Error writing token usage: {e}")
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_usage_store():
+    """Return the process-wide store, or None when USAGE=0."""
+    global _store
+    if os.getenv("USAGE", "1") == "0":
+        return None
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = UsageStore(
+                    path=os.getenv("USAGE_DB", DEFAULT_PATH),
+                    flush_seconds=float(os.getenv("USAGE_FLUSH_SECONDS", 5.0)),
+                    prices=parse_prices(os.getenv("USAGE_PRICES")),
+                    default_quota=int(os.getenv("USAGE_TEAM_QUOTA", 0)),
+                    quotas=parse_quotas(os.getenv("USAGE_TEAM_QUOTAS"))
+                )
+                atexit.register(_store.close)
+    return _store
+
+
+def cached_tokens(usage):
+    """Prompt tokens the provider served from its prompt cache (0 when it does not say)."""
+    details = getattr(usage, "prompt_tokens_details", None) if usage else None
+    return (getattr(details, "cached_tokens", 0) or 0) if details else 0
+
+
+def record_model_call(model, usage=None, cache_hit=False):
+    """Count a model call (usage is the API's usage object, None if it reported none) in the current scope."""
+    store = get_usage_store()
+    if store is None:
+        return
+    prompt_tokens = (getattr(usage, "prompt_tokens", 0) or 0) if usage else 0
+    completion_tokens = (getattr(usage, "completion_tokens", 0) or 0) if usage else 0
+    try:
+        store.record(model, prompt_tokens, completion_tokens, cached_tokens(usage), cache_hit=cache_hit)
+    except Exception as e:
+        print(f"Error recording token usage: {e}")
+
+
+def reserve_quota(team, tokens=0):
+    """
+    Admit work for a team before it is dispatched.
+
+    Args:
+        team (str): Team the work is billed to
+        tokens (int): Estimated tokens it will use
+
+    Returns:
+        Reservation: release() it (or use it as a context manager) when the work is done
+
+    Raises:
+        QuotaExceededError: the team's remaining quota for today is smaller than the estimate
+    """
+    store = get_usage_store()
+    if store is None:
+        return Reservation(None, team, tokens, None)
+    return store.reserve(team, tokens)
+
+
+async def asy_reserve_quota(team, tokens=0):
+    """reserve_quota() for event loop callers: it reads the usage database, so it runs on a worker thread."""
+    return await asyncio.to_thread(reserve_quota, team, tokens)
+
+
+def check_quota(team):
+    """Raise QuotaExceededError if the team has no quota left for today."""
+    reserve_quota(team, 0).release()
@@ -47,11 +47,56 @@ document.addEventListener('DOMContentLoaded', () => {
         updateProgress(stepNumber);
     }
 
+    // Current leaderboard rows, highest score first
+    let leaderboardRows = [];
+
+    // Render leaderboard rows into the table
+    function renderLeaderboard() {
+        leaderboardBody.innerHTML = leaderboardRows.map((team, index) => `
+            <tr>
+                <td>${index + 1}</td>
+                <td>${team.name}</td>
+                <td>${team.score}</td>
+            </tr>
+        `).join('');
+    }
+
+    // Apply changed rows from a leaderboard stream event
+    function mergeLeaderboard(changed) {
+        changed.forEach(row => {
+            const existing = leaderboardRows.findIndex(team => team.name === row.name);
+            if (existing >= 0) {
+                leaderboardRows[existing] = row;
+            } else {
+                leaderboardRows.push(row);
+            }
+        });
+        leaderboardRows.sort((a, b) => b.score - a.score || a.name.localeCompare(b.name));
+        renderLeaderboard();
+    }
+
+    // Subscribe to live leaderboard updates; returns false if the browser has no EventSource
+    function connectLeaderboardStream() {
+        if (!leaderboardBody || !window.EventSource) return false;
+
+        const source = new EventSource('http://127.0.0.1:5000/api/leaderboard/stream');
+        source.addEventListener('snapshot', event => {
+            leaderboardRows = JSON.parse(event.data).changed;
+            renderLeaderboard();
+        });
+        source.addEventListener('leaderboard', event => {
+            mergeLeaderboard(JSON.parse(event.data).changed);
+        });
+        source.onerror = () => console.warn('Leaderboard stream interrupted, reconnecting...');
+        return true;
+    }
+
     // Update leaderboard function
     function updateLeaderboard() {
         if (!leaderboardBody) return;
 
-        fetch('http://127.0.0.1:5000/api/leaderboard')
+        // no-cache revalidates with the server's ETag, so an unchanged leaderboard costs a 304
+        fetch('http://127.0.0.1:5000/api/leaderboard', { cache: 'no-cache' })
             .then(response => {
                 if (!response.ok) {
                     throw new Error('Network response was not ok');
@@ -59,13 +104,8 @@ document.addEventListener('DOMContentLoaded', () => {
                 return response.json();
             })
             .then(data => {
-                leaderboardBody.innerHTML = data.map((team, index) => `
-                    <tr>
-                        <td>${index + 1}</td>
-                        <td>${team.name}</td>
-                        <td>${team.score}</td>
-                    </tr>
-                `).join('');
+                leaderboardRows = data;
+                renderLeaderboard();
             })
             .catch(error => {
                 console.error('Error updating leaderboard:', error);
@@ -75,11 +115,28 @@ document.addEventListener('DOMContentLoaded', () => {
             });
     }
  
-    // Initial leaderboard load
-    updateLeaderboard();
-   
-    // Update every 2 minutes
-    setInterval(updateLeaderboard, 120000);
+    // Live updates over Server-Sent Events; fall back to polling every 2 minutes
+    if (!connectLeaderboardStream()) {
+        updateLeaderboard();
+        setInterval(updateLeaderboard, 120000);
+    }
+
+    // Show per-song progress for a submission while it is being evaluated
+    function watchSubmission(submissionId) {
+        if (!window.EventSource) return null;
+
+        const source = new EventSource(`http://127.0.0.1:5000/api/evaluate-songs/${submissionId}/stream`);
+        source.addEventListener('song', event => {
+            const progress = JSON.parse(event.data);
+            const progressText = document.getElementById('evaluation-progress');
+            if (progressText) {
+                progressText.textContent = `Evaluated ${progress.completed}/${progress.total} songs, ${progress.correct_so_far} correct so far`;
+            }
+        });
+        source.addEventListener('done', () => source.close());
+        source.addEventListener('failed', () => source.close());
+        return source;
+    }
 
     // Handle submission
     function handleSubmit() {
@@ -100,7 +157,7 @@ document.addEventListener('DOMContentLoaded', () => {
                 <div class="evaluation-loading">
                     <div class="loading-spinner"></div>
                     <p>Evaluating your prompt against songs dataset...</p>
-                    <p>This may take up to a minute. Please wait.</p>
+                    <p id="evaluation-progress">This may take up to a minute. Please wait.</p>
                 </div>
             `;
         }
@@ -108,6 +165,10 @@ document.addEventListener('DOMContentLoaded', () => {
         // Path to the songs dataset on the server
         const filePath = 'c:\\Users\\josma\\OneDrive\\Desktop\\DataNexus\\backends\\data\\Prompt Engineering Songs.xlsx';
         
+        // Stream progress for this submission while the evaluation runs
+        const submissionId = window.crypto?.randomUUID ? crypto.randomUUID() : `${Date.now()}-${Math.random().toString(36).slice(2)}`;
+        const progressSource = watchSubmission(submissionId);
+
         // Call the evaluate-songs API
         fetch('http://127.0.0.1:5000/api/evaluate-songs', {
             method: 'POST',
@@ -117,7 +178,8 @@ document.addEventListener('DOMContentLoaded', () => {
             body: JSON.stringify({
                 team_name: teamName,
                 file_path: filePath,
-                prompt: inputText
+                prompt: inputText,
+                submission_id: submissionId
             })
         })
         .then(response => {
@@ -171,6 +233,9 @@ document.addEventListener('DOMContentLoaded', () => {
                     </div>
                 `;
             }
+        })
+        .finally(() => {
+            if (progressSource) progressSource.close();
         });
     }
 
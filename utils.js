@@ -131,35 +131,96 @@ document.addEventListener('DOMContentLoaded', () => {
         };
     }
 
-    // Function to call the API
+    // Function to call the API; the reply is rendered as it streams in
     async function callAPI() {
         const jsonifiedInput = jsonifyInput();
         console.log('jsonifiedInput:', jsonifiedInput);
         try {
             console.log('Sending to API');
-            const response = await fetch('http://127.0.0.1:5000/async_chat', {
+            const response = await fetch('http://127.0.0.1:5000/async_chat/stream', {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json',
-                    'Accept': 'application/json'
+                    'Accept': 'text/event-stream'
                 },
                 body: JSON.stringify(jsonifiedInput),
             });
-            
+
             if (!response.ok) {
                 throw new Error(`HTTP error! status: ${response.status}`);
             }
-            
-            const data = await response.json();
-            console.log('data:', data.response);
-            return data.response;
+
+            // "delta" events carry the next piece of the reply, then "done" (or "error") ends the stream
+            let text = '';
+            let result = null;
+            await readEventStream(response, (event, data) => {
+                if (event === 'delta') {
+                    text += data.text;
+                    renderPartial(text);
+                } else if (event === 'done' || event === 'error') {
+                    result = data;
+                }
+            });
+            console.log('data:', result);
+            return result || { error: 'The response ended before it was complete' };
         } catch (error) {
             console.error('API call failed:', error);
-            return { output: `An error occurred while processing your request: ${error.message}` };
+            return { error: `An error occurred while processing your request: ${error.message}` };
+        }
+    }
+
+    // Function to parse a text/event-stream body, calling onEvent(event, data) per event
+    async function readEventStream(response, onEvent) {
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+
+        while (true) {
+            const { done, value } = await reader.read();
+            if (done) {
+                break;
+            }
+            buffer += decoder.decode(value, { stream: true });
+
+            // Events are separated by a blank line; keep an incomplete one for the next read
+            let boundary;
+            while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                const frame = buffer.slice(0, boundary);
+                buffer = buffer.slice(boundary + 2);
+
+                let event = 'message';
+                const dataLines = [];
+                frame.split('\n').forEach(line => {
+                    if (line.startsWith('event:')) {
+                        event = line.slice(6).trim();
+                    } else if (line.startsWith('data:')) {
+                        dataLines.push(line.slice(5).replace(/^ /, ''));
+                    }
+                });
+                if (dataLines.length) {
+                    onEvent(event, JSON.parse(dataLines.join('\n')));
+                }
+            }
+        }
+    }
+
+    // Function to render the partial reply, at most once per animation frame
+    let pendingText = null;
+    let renderFrame = null;
+    function renderPartial(text) {
+        pendingText = text;
+        if (renderFrame === null) {
+            renderFrame = requestAnimationFrame(() => {
+                renderFrame = null;
+                try {
+                    outputResult.innerHTML = marked.parse(pendingText);
+                } catch (error) {
+                    outputResult.textContent = pendingText;
+                }
+            });
         }
     }
 
-   
     // Function to process the current step
     async function processCurrentStep() {
         outputResult.innerHTML = '<div class="loading-spinner"></div>';
@@ -179,6 +240,12 @@ document.addEventListener('DOMContentLoaded', () => {
 
     // Function to display the API response with Markdown formatting
     function displayOutput(response) {
+        // The full reply replaces any partial render still pending
+        if (renderFrame !== null) {
+            cancelAnimationFrame(renderFrame);
+            renderFrame = null;
+        }
+
         if (!response || !response.response) {
             outputResult.innerHTML = '<p class="error">No response received</p>';
             return;